@@ -0,0 +1,288 @@
+"""
+Admission control: bounds how many requests the app works on at once, so a
+traffic spike turns a fraction of requests away fast (503 + Retry-After)
+instead of slowing every request down together.
+
+Requests under /images are split into pools (uploads, everything else), each
+with its own concurrency limit and a bounded FIFO wait queue. A queued
+request waits at most ADMISSION_QUEUE_TIMEOUT seconds, and never past its
+request deadline; then it is shed. With ADMISSION_ADAPTIVE the limit follows
+observed latency (AIMD): it grows by one per limit's worth of admitted
+requests while the smoothed time to first response byte stays under the
+pool's target, and shrinks by ADMISSION_BACKOFF when it goes over or the
+app answers 503/504 (saturated dependencies), at most once a second.
+
+Optionally each client (ADMISSION_CLIENT_HEADER, else the peer address) gets
+a token bucket of ADMISSION_CLIENT_RATE requests per second; clients over it
+get 429 before taking a slot.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from starlette.responses import JSONResponse
+
+from app.config import settings
+from app.metrics import registry
+from app.resilience import remaining_time
+
+# POST paths that carry image bodies; they get their own pool so slow uploads
+# can't take every slot from reads
+UPLOAD_PATHS = {"/images", "/images/stream", "/images/batch"}
+
+admission_rejections = registry.counter("testagram_admission_rejected_total",
+                                        "Requests turned away by admission control, by pool and reason")
+admission_wait = registry.histogram("testagram_admission_wait_seconds",
+                                    "Time admitted requests waited in the admission queue")
+
+
+def route_pool(method: str, path: str) -> Optional[str]:
+    """The pool a request is admitted through, or None if it is never limited (health, metrics, docs)."""
+    path = path.rstrip("/") or "/"
+    if not path.startswith("/images"):
+        return None
+    if method == "POST" and path in UPLOAD_PATHS:
+        return "upload"
+    return "default"
+
+
+class ConcurrencyLimiter:
+    """
+    Concurrency limit with a bounded FIFO queue of waiters. A finished request
+    hands its slot straight to the oldest waiter, so queued requests are not
+    overtaken by new arrivals.
+    """
+
+    DECREASE_INTERVAL = 1.0
+    SMOOTHING = 0.2 # Weight of each new latency sample in the moving average
+
+    def __init__(self, name: str, max_limit: int, min_limit: int, queue_size: int,
+                 latency_target: float, adaptive: bool):
+        self.name = name
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.queue_size = queue_size
+        self.latency_target = latency_target
+        self.adaptive = adaptive
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.latency = 0.0 # Moving average of time to first response byte
+        self._waiters: deque[asyncio.Future] = deque()
+        self._decreased_at = 0.0
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def try_acquire(self) -> bool:
+        if self.in_flight < self.current_limit and not self._waiters:
+            self.in_flight += 1
+            return True
+        return False
+
+    async def acquire(self, timeout: float) -> bool:
+        """Takes a slot, queueing for up to `timeout` seconds; False if the request should be shed."""
+        if self.try_acquire():
+            return True
+        if self.queued >= self.queue_size or timeout <= 0:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the wait ended: pass the slot on
+                self.release()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                return False
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.current_limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def observe(self, latency: float, overloaded: bool):
+        """Feeds back one admitted request's latency (and whether the app was overloaded)."""
+        self.latency = latency if not self.latency else self.latency + self.SMOOTHING * (latency - self.latency)
+        if not self.adaptive:
+            return
+        if overloaded or self.latency > self.latency_target:
+            now = time.monotonic()
+            if now - self._decreased_at >= self.DECREASE_INTERVAL:
+                self.limit = max(self.min_limit, self.limit * settings.ADMISSION_BACKOFF)
+                self._decreased_at = now
+        elif self.in_flight + 1 >= self.current_limit:
+            # Only grow while the limit is what holds requests back
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead would have drained, as a hint for shed clients."""
+        drain = (self.queued + 1) * (self.latency or self.latency_target) / self.current_limit
+        return min(30, max(1, math.ceil(drain)))
+
+
+class ClientBuckets:
+    """Per-client token buckets, keeping the most recently seen MAX_CLIENTS clients."""
+
+    MAX_CLIENTS = 10000
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict() # client -> (tokens, updated)
+
+    def take(self, client: str) -> float:
+        """Takes a token; returns 0 if there was one, else the seconds until there will be."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.MAX_CLIENTS:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionController:
+    """Process-wide pools and client buckets, created from settings on first use."""
+
+    def __init__(self):
+        self.pools: dict[str, ConcurrencyLimiter] = {}
+        self._clients: Optional[ClientBuckets] = None
+
+    def pool(self, name: str) -> ConcurrencyLimiter:
+        if name not in self.pools:
+            upload = name == "upload"
+            self.pools[name] = ConcurrencyLimiter(
+                name,
+                settings.ADMISSION_UPLOAD_CONCURRENCY if upload else settings.ADMISSION_CONCURRENCY,
+                settings.ADMISSION_MIN_CONCURRENCY, settings.ADMISSION_QUEUE_SIZE,
+                settings.ADMISSION_UPLOAD_LATENCY_TARGET if upload else settings.ADMISSION_LATENCY_TARGET,
+                settings.ADMISSION_ADAPTIVE)
+        return self.pools[name]
+
+    def client_wait(self, client: str) -> float:
+        if settings.ADMISSION_CLIENT_RATE <= 0:
+            return 0.0
+        if self._clients is None:
+            self._clients = ClientBuckets(settings.ADMISSION_CLIENT_RATE, settings.ADMISSION_CLIENT_BURST)
+        return self._clients.take(client)
+
+    def collect(self):
+        return [
+            ("testagram_admission_limit", "Current concurrency limit per admission pool", "gauge",
+             {(("pool", name),): pool.current_limit for name, pool in self.pools.items()}),
+            ("testagram_admission_in_flight", "Requests holding an admission slot", "gauge",
+             {(("pool", name),): pool.in_flight for name, pool in self.pools.items()}),
+            ("testagram_admission_queued", "Requests waiting for an admission slot", "gauge",
+             {(("pool", name),): pool.queued for name, pool in self.pools.items()}),
+        ]
+
+
+def _client_id(scope) -> str:
+    if settings.ADMISSION_CLIENT_HEADER:
+        wanted = settings.ADMISSION_CLIENT_HEADER.lower().encode()
+        for name, value in scope.get("headers", []):
+            if name == wanted:
+                # X-Forwarded-For style lists: the first entry is the original client
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware admitting requests through their pool. It sits inside
+    DeadlineMiddleware, so queueing counts against the request deadline. The
+    slot is released once the response body is sent: background tasks that
+    run after it don't hold it.
+    """
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller or admission
+
+    async def __call__(self, scope, receive, send):
+        name = None
+        if scope["type"] == "http":
+            path, root_path = scope["path"], scope.get("root_path", "")
+            if root_path and path.startswith(root_path):
+                path = path[len(root_path):]
+            name = route_pool(scope["method"], path)
+        if name is None or not settings.admission_enabled:
+            return await self.app(scope, receive, send)
+
+        wait = self.controller.client_wait(_client_id(scope))
+        if wait > 0:
+            admission_rejections.inc(pool=name, reason="client_rate")
+            return await self._reject(scope, receive, send, 429, "Too many requests", math.ceil(wait))
+
+        pool = self.controller.pool(name)
+        timeout = settings.ADMISSION_QUEUE_TIMEOUT
+        remaining = remaining_time()
+        if remaining is not None:
+            timeout = min(timeout, remaining)
+        queue_full = pool.queued >= pool.queue_size
+        queued_at = time.perf_counter()
+        if not await pool.acquire(timeout):
+            admission_rejections.inc(pool=name, reason="queue_full" if queue_full else "timeout")
+            return await self._reject(scope, receive, send, 503, "Server is busy, retry later", pool.retry_after())
+
+        started = time.perf_counter()
+        admission_wait.observe(started - queued_at, pool=name)
+        first_byte = None
+        status = 500
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                pool.observe((first_byte or time.perf_counter()) - started, overloaded=status in (503, 504))
+                pool.release()
+
+        async def send_wrapper(message):
+            nonlocal first_byte, status
+            if message["type"] == "http.response.start":
+                first_byte = time.perf_counter()
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                release()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Responses that were never completed (errors, disconnects)
+            release()
+
+    async def _reject(self, scope, receive, send, status: int, detail: str, retry_after: int):
+        response = JSONResponse(status_code=status, content={"detail": detail},
+                                headers={"Retry-After": str(retry_after)})
+        await response(scope, receive, send)
+
+
+admission = AdmissionController()
+registry.add_collector(admission.collect)
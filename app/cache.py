@@ -0,0 +1,168 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+
+# Returned by MetadataCache.get() for a cached "does not exist" (negative) entry
+MISSING = object()
+_MISSING_MARKER = "__missing__"
+
+
+class MetadataCache(ABC):
+    """
+    Cache interface used in front of DatabaseService.get_metadata. Values are
+    plain dicts (model dumps), so callers always get a fresh model instance.
+    get() returns the value, MISSING for a negative entry, or None on a miss.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    @abstractmethod
+    async def get(self, key: str):
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: dict, ttl: float):
+        ...
+
+    @abstractmethod
+    async def set_missing(self, key: str, ttl: float):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    def _record(self, value):
+        if value is None:
+            self.misses += 1
+        elif value is MISSING:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class LRUCache(MetadataCache):
+    """In-process LRU with per-entry TTL and a bound on the number of entries."""
+
+    def __init__(self, max_entries: int):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, object]]" = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._record(None)
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return self._record(None)
+        self._entries.move_to_end(key)
+        return self._record(value)
+
+    def _put(self, key: str, value, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def set(self, key: str, value: dict, ttl: float):
+        self._put(key, value, ttl)
+
+    async def set_missing(self, key: str, ttl: float):
+        self._put(key, MISSING, ttl)
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "entries": len(self._entries)}
+
+
+class RedisCache(MetadataCache):
+    """
+    Shared cache on any Redis-compatible server, so all instances see the same
+    entries and invalidations. Requires the optional `redis` package. While the
+    server is unreachable every lookup is a miss, so reads fall back to
+    DynamoDB instead of failing.
+    """
+
+    def __init__(self, url: str, prefix: str = "testagram:meta:"):
+        super().__init__()
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("METADATA_CACHE_URL is set but the 'redis' package is not installed")
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+        self.errors = 0
+
+    def _failed(self, operation: str, key: str, error: Exception):
+        self.errors += 1
+        print(f"Metadata cache {operation} failed for {key}: {error}")
+
+    async def get(self, key: str):
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except Exception as e:
+            self._failed("get", key, e)
+            return self._record(None)
+        if raw is None:
+            return self._record(None)
+        value = json.loads(raw)
+        return self._record(MISSING if value == _MISSING_MARKER else value)
+
+    async def _set(self, key: str, value, ttl: float):
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+        except Exception as e:
+            self._failed("set", key, e)
+
+    async def set(self, key: str, value: dict, ttl: float):
+        await self._set(key, value, ttl)
+
+    async def set_missing(self, key: str, ttl: float):
+        await self._set(key, _MISSING_MARKER, ttl)
+
+    async def delete(self, key: str):
+        try:
+            await self.client.delete(self.prefix + key)
+        except Exception as e:
+            self._failed("delete", key, e)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "errors": self.errors}
+
+
+def build_cache() -> Optional[MetadataCache]:
+    if not settings.METADATA_CACHE_ENABLED:
+        return None
+    if settings.METADATA_CACHE_URL:
+        return RedisCache(settings.METADATA_CACHE_URL)
+    return LRUCache(settings.METADATA_CACHE_MAX_ENTRIES)
+
+
+metadata_cache = build_cache()
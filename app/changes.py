@@ -0,0 +1,161 @@
+"""
+Change feed: every image write appends an entry to a sequenced log, so
+clients can sync with GET /images/changes?since=<cursor> instead of
+re-listing the table.
+
+Images are spread over CHANGE_PARTITIONS logs by id (so one image's changes
+stay in order). Each log has a head item ("changes#<p>", an ADD counter)
+and one entry per sequence number ("change#<p>#<seq>": an upsert with the
+image as stored once the number was taken, or a delete tombstone). Entry ids are computed from
+the sequence numbers, so reading the changes after a cursor is a
+BatchGetItem of exactly those keys: a poll costs O(changes), no Query or Scan.
+
+Entries are appended next to the image writes rather than in a transaction.
+A sequence number taken by a writer that failed (or is still writing) shows
+up as a gap; readers wait at a gap until it is CHANGE_SETTLE seconds old and
+then skip it.
+
+Old entries are dropped by compaction, which the deployed worker Lambda
+runs on a schedule (see worker.maintenance), or by hand:
+
+    python -m app.changes
+
+It raises each log's horizon past entries older than CHANGE_RETENTION
+(cursors behind the horizon get 410 and must re-list), deletes entries the
+previous run put behind the horizon, and replaces settled entries that a
+later change of the same image supersedes with small placeholders.
+"""
+import base64
+from datetime import datetime, timedelta
+from typing import Optional
+import zlib
+
+from fastapi import HTTPException
+from app.config import settings
+
+ENTRY_ATTRIBUTES = ('id', 'seq', 'image_id', 'op', 'changed_at')
+
+
+def change_partition(image_id: str) -> int:
+    return zlib.crc32(image_id.encode()) % settings.CHANGE_PARTITIONS
+
+
+def encode_position(positions: list[int]) -> str:
+    raw = ".".join(str(seq) for seq in positions)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_position(cursor: str) -> list[int]:
+    """Parses a change cursor into one sequence number per partition."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        positions = [int(seq) for seq in raw.split(".")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if len(positions) != settings.CHANGE_PARTITIONS or min(positions) < 0:
+        # CHANGE_PARTITIONS changed since the cursor was issued
+        raise HTTPException(status_code=410, detail="Cursor is no longer valid, list images again and restart")
+    return positions
+
+
+def settle_cutoff(now: Optional[datetime] = None) -> str:
+    """changed_at values up to this are old enough that no earlier write can still land."""
+    return ((now or datetime.utcnow()) - timedelta(seconds=settings.CHANGE_SETTLE)).isoformat()
+
+
+def select_changes(position: int, seqs: list[int], entries: dict[int, dict],
+                   head_settled: bool, cutoff: str) -> tuple[list[dict], int]:
+    """
+    Walks one partition's fetched sequence numbers (consecutive, from
+    position + 1) and returns the entries to deliver and the new position.
+    A missing entry is skipped once it can no longer appear: the head was
+    last advanced before the cutoff, or a later entry is already settled.
+    Otherwise the walk stops there and resumes from it on the next poll.
+    """
+    settled_through = max((seq for seq, entry in entries.items() if entry['changed_at'] <= cutoff), default=0)
+    delivered = []
+    for seq in seqs:
+        entry = entries.get(seq)
+        if entry is None and not head_settled and seq > settled_through:
+            break
+        if entry is not None and entry['op'] != 'compacted':
+            delivered.append(entry)
+        position = seq
+    return delivered, position
+
+
+async def compact(table) -> tuple[int, int]:
+    """
+    Applies retention and compaction to every partition; returns the number
+    of entries deleted and replaced by placeholders. Deletes only lag one run
+    behind the horizon, so a reader that read the old horizon never walks
+    into entries that vanished under it.
+    """
+    from app.services import DatabaseService, change_head_item_id, change_item_id
+
+    db = DatabaseService(table)
+    now = datetime.utcnow()
+    retention_cutoff = (now - timedelta(seconds=settings.CHANGE_RETENTION)).isoformat()
+    cutoff = settle_cutoff(now)
+    deleted = replaced = 0
+
+    for partition in range(settings.CHANGE_PARTITIONS):
+        head = (await table.get_item(Key={'id': change_head_item_id(partition)}, ConsistentRead=True)).get('Item')
+        if head is None:
+            continue
+        tip, horizon, purged_to = int(head['seq']), int(head.get('horizon', 0)), int(head.get('purged_to', 0))
+
+        async with table.batch_writer() as batch:
+            for seq in range(purged_to + 1, horizon + 1):
+                await batch.delete_item(Key={'id': change_item_id(partition, seq)})
+        deleted += horizon - purged_to
+
+        seqs = list(range(horizon + 1, tip + 1))
+        items = await db.get_items([change_item_id(partition, seq) for seq in seqs], ENTRY_ATTRIBUTES)
+        entries = {int(item['seq']): item for item in items.values()}
+
+        # The new horizon covers the expired prefix, including gaps that can no longer be filled
+        settled_through = max((seq for seq, entry in entries.items() if entry['changed_at'] <= cutoff), default=0)
+        new_horizon = horizon
+        for seq in seqs:
+            entry = entries.get(seq)
+            if entry is None and seq > settled_through and head.get('bumped_at', '') > cutoff:
+                break
+            if entry is not None and entry['changed_at'] >= retention_cutoff:
+                break
+            new_horizon = seq
+
+        latest, stale = {}, []
+        for seq, entry in sorted(entries.items()):
+            if seq <= new_horizon or entry['op'] == 'compacted' or entry['changed_at'] > cutoff:
+                continue
+            if entry['image_id'] in latest:
+                stale.append(latest[entry['image_id']])
+            latest[entry['image_id']] = entry
+        async with table.batch_writer() as batch:
+            for entry in stale:
+                await batch.put_item(Item={**entry, 'op': 'compacted'})
+        replaced += len(stale)
+
+        await table.update_item(Key={'id': change_head_item_id(partition)},
+                                UpdateExpression='SET horizon = :horizon, purged_to = :purged',
+                                ExpressionAttributeValues={':horizon': new_horizon, ':purged': horizon})
+    return deleted, replaced
+
+
+def main():
+    import asyncio
+
+    async def run():
+        from app.clients import clients
+        try:
+            deleted, replaced = await compact(await clients.table())
+        finally:
+            await clients.close()
+        print(f"Change log compacted: {deleted} entries deleted, {replaced} superseded entries replaced")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import asyncio
+from contextlib import AsyncExitStack
+from typing import Optional
+
+from app.config import settings, load_config
+from app.startup import report
+from app.metrics import instrument_client
+from app.resilience import resilience
+
+
+class AWSClients:
+    """
+    Process-wide holder for long-lived S3 and DynamoDB clients.
+
+    Clients are opened once and reused by every request so connection pools,
+    endpoint resolution and credentials are shared. Under Mangum the lifespan
+    runs around each invocation, so start() is idempotent and the clients are
+    kept open across warm invocations. They are re-opened if the running event
+    loop changes (aiohttp connectors are bound to the loop that created them).
+    """
+
+    def __init__(self):
+        self._session = None
+        self._stack: Optional[AsyncExitStack] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._s3 = None
+        self._dynamodb = None
+        self._sqs = None
+        self._tables = {}
+
+    def _config(self):
+        from aiobotocore.config import AioConfig
+
+        return AioConfig(
+            max_pool_connections=settings.AWS_MAX_POOL_CONNECTIONS,
+            connect_timeout=settings.AWS_CONNECT_TIMEOUT,
+            read_timeout=settings.AWS_READ_TIMEOUT,
+            connector_args={"keepalive_timeout": settings.AWS_KEEPALIVE_TIMEOUT},
+            # The resilience layer retries itself; don't multiply its attempts
+            retries={"total_max_attempts": 1} if resilience.handles_retries else None,
+        )
+
+    def _client_kwargs(self) -> dict:
+        # Credentials come from the session, which presigning reads them from too
+        return dict(region_name=settings.AWS_REGION,
+                    endpoint_url=settings.aws_endpoint,
+                    config=self._config())
+
+    @property
+    def started(self) -> bool:
+        return self._stack is not None and self._loop is asyncio.get_running_loop()
+
+    async def start(self):
+        if self.started:
+            return
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.started:
+                return
+            if self._stack is not None:
+                # Clients belong to a previous (now closed) event loop; drop them.
+                self._reset()
+            # Bucket/table names may come from SSM; cached after the first call
+            await load_config()
+            with report.phase("aws_clients"):
+                # Deferred so cold starts that never touch AWS skip the import
+                import aioboto3
+
+                self._session = aioboto3.Session(aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                                                 aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                                                 region_name=settings.AWS_REGION)
+                stack = AsyncExitStack()
+                kwargs = self._client_kwargs()
+                self._s3 = await stack.enter_async_context(self._session.client("s3", **kwargs))
+                self._dynamodb = await stack.enter_async_context(self._session.resource("dynamodb", **kwargs))
+                # Metrics first: their before-call hook starts the clock ahead of the resilience waits
+                instrument_client(self._s3)
+                instrument_client(self._dynamodb.meta.client)
+                resilience.attach(self._s3)
+                resilience.attach(self._dynamodb.meta.client)
+            self._stack = stack
+            self._loop = loop
+            print("AWS clients started.")
+
+    async def close(self):
+        if self._stack is None:
+            return
+        stack = self._stack
+        self._reset()
+        try:
+            await stack.aclose()
+        except Exception as e:
+            print(f"Failed to close AWS clients: {e}")
+        print("AWS clients closed.")
+
+    def _reset(self):
+        self._stack = None
+        self._loop = None
+        self._s3 = None
+        self._dynamodb = None
+        self._sqs = None
+        self._tables = {}
+
+    async def s3(self):
+        await self.start()
+        return self._s3
+
+    async def dynamodb(self):
+        await self.start()
+        return self._dynamodb
+
+    async def sqs(self):
+        """SQS client for the job queue; opened on first use, as only uploads with jobs need it."""
+        await self.start()
+        if self._sqs is None:
+            async with self._lock:
+                if self._sqs is None:
+                    client = await self._stack.enter_async_context(
+                        self._session.client("sqs", **self._client_kwargs()))
+                    instrument_client(client)
+                    resilience.attach(client)
+                    self._sqs = client
+        return self._sqs
+
+    async def credentials(self):
+        """The session's credentials (botocore Credentials; refreshable when temporary)."""
+        await self.start()
+        return await self._session.get_credentials()
+
+    async def table(self, name: Optional[str] = None):
+        """Returns a cached Table resource (defaults to settings.TABLE_NAME)."""
+        name = name or settings.TABLE_NAME
+        await self.start()
+        table = self._tables.get(name)
+        if table is None:
+            table = await self._dynamodb.Table(name)
+            self._tables[name] = table
+        return table
+
+
+clients = AWSClients()
@@ -1,10 +1,18 @@
+import asyncio
 import os
+import time
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Dict, List, Optional
 
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 from botocore.exceptions import ClientError
-import aioboto3
+from app.startup import report
+
+class RenditionSpec(BaseModel):
+    size: int # Longest edge in pixels; smaller originals are not upscaled
+    format: str # Pillow format name: WEBP, JPEG or PNG
+    quality: int = 85
 
 class Settings(BaseSettings):
     AWS_REGION: str = "us-east-1"
@@ -17,6 +25,165 @@ class Settings(BaseSettings):
     BUCKET_NAME: str = "testagram-images"
     TABLE_NAME: str = "testagram-metadata"
 
+    # Connection pool for the shared S3/DynamoDB clients
+    AWS_MAX_POOL_CONNECTIONS: int = 50
+    AWS_CONNECT_TIMEOUT: float = 5.0
+    AWS_READ_TIMEOUT: float = 10.0
+    AWS_KEEPALIVE_TIMEOUT: float = 30.0
+
+    # Presigned download URLs (signed locally, cached until close to expiry)
+    PRESIGN_EXPIRES_IN: int = 3600
+    PRESIGN_CACHE_MARGIN: int = 300
+    PRESIGN_CACHE_MAX_ENTRIES: int = 10000
+    PRESIGN_CREDENTIALS_TTL: int = 300
+    # URLs are signed as of the start of fixed windows of this many seconds, so
+    # every request (and process) within a window gets byte-identical URLs; 0 signs per call
+    PRESIGN_WINDOW: int = 300
+
+    # HTTP caching of read responses (ETag/If-None-Match, Cache-Control); max-age
+    # is also capped by the time left in the current signing window
+    HTTP_CACHE_MAX_AGE: int = 60
+    HTTP_CACHE_SCOPE: str = "public" # "private" keeps shared caches (CDNs) from storing responses
+
+    # Download proxy (GET /images/{id}/content)
+    DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+    DOWNLOAD_MAX_RANGES: int = 16 # More ranges in one request are answered with the whole object
+
+    # Streaming uploads (S3 multipart); parts must be at least 5 MiB
+    UPLOAD_PART_SIZE: int = 8 * 1024 * 1024
+    UPLOAD_CONCURRENCY: int = 4
+
+    # Direct-to-S3 uploads (presigned POST)
+    MAX_UPLOAD_SIZE: int = 50 * 1024 * 1024
+    UPLOAD_URL_EXPIRES_IN: int = 900
+    PENDING_UPLOAD_TTL: int = 24 * 3600
+
+    # Read-through metadata cache (in-process LRU, or shared Redis when a URL is set)
+    METADATA_CACHE_ENABLED: bool = True
+    METADATA_CACHE_URL: Optional[str] = None
+    METADATA_CACHE_MAX_ENTRIES: int = 10000
+    METADATA_CACHE_TTL: float = 300.0
+    METADATA_CACHE_NEGATIVE_TTL: float = 5.0
+
+    # Resilience for AWS calls: "standard" (jittered exponential backoff with a
+    # shared retry budget), "adaptive" (standard plus per-table rate limits that
+    # back off on throttling) or "botocore" (leave retries to botocore)
+    AWS_RETRY_MODE: str = "standard"
+    AWS_MAX_ATTEMPTS: int = 4
+    AWS_RETRY_BASE_DELAY: float = 0.05
+    AWS_RETRY_MAX_DELAY: float = 2.0
+    AWS_RETRY_BUDGET: int = 500
+    DYNAMODB_MAX_RPS: float = 0.0 # Client-side request rate limit per table; 0 = unlimited
+    DYNAMODB_BURST: float = 10.0
+    CIRCUIT_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_RESET_TIMEOUT: float = 10.0
+    # Per-request deadline for AWS calls and their retries; under Lambda it is
+    # capped by the remaining invocation time minus the margin (Timeout=30)
+    REQUEST_DEADLINE: float = 25.0
+    LAMBDA_DEADLINE_MARGIN: float = 1.0
+
+    # Admission control for /images requests: per-pool concurrency limits (uploads
+    # separate from everything else) with a bounded wait queue; requests that can't
+    # get a slot within ADMISSION_QUEUE_TIMEOUT get 503 + Retry-After. Defaults to
+    # on outside Lambda (there each instance serves one request at a time).
+    ADMISSION_ENABLED: Optional[bool] = None
+    ADMISSION_CONCURRENCY: int = 64
+    ADMISSION_UPLOAD_CONCURRENCY: int = 16
+    ADMISSION_QUEUE_SIZE: int = 128 # Waiters per pool; arrivals beyond it are shed at once
+    ADMISSION_QUEUE_TIMEOUT: float = 2.0 # Also capped by the request deadline
+    # Adaptive limits (AIMD): shrink by ADMISSION_BACKOFF while the smoothed time to
+    # first byte is over the pool's target (or the app answers 503/504), grow back
+    # towards the configured concurrency otherwise
+    ADMISSION_ADAPTIVE: bool = True
+    ADMISSION_MIN_CONCURRENCY: int = 4
+    ADMISSION_LATENCY_TARGET: float = 1.0
+    ADMISSION_UPLOAD_LATENCY_TARGET: float = 10.0
+    ADMISSION_BACKOFF: float = 0.9
+    # Per-client token buckets (429 + Retry-After); 0 = off. Clients are told apart by
+    # this header (e.g. "x-api-key" or "x-forwarded-for"), else by peer address
+    ADMISSION_CLIENT_RATE: float = 0.0
+    ADMISSION_CLIENT_BURST: float = 20.0
+    ADMISSION_CLIENT_HEADER: Optional[str] = None
+
+    # Unfiltered listings read created_at-index, whose partition key is spread over
+    # IMAGE_LIST_SHARDS values ("image#<n>", by image id) so no single partition takes every
+    # upload; a page merges them. Only ever increase it: images stay where they were written
+    IMAGE_LIST_SHARDS: int = 4
+
+    # Batch endpoints
+    BATCH_MAX_ITEMS: int = 1000
+    BATCH_CONCURRENCY: int = 8
+    BATCH_MAX_RETRIES: int = 5
+    BATCH_RETRY_BASE_DELAY: float = 0.05
+
+    # Idempotent uploads: responses to requests with an Idempotency-Key header are
+    # stored and replayed to retries with the same key for this many seconds
+    IDEMPOTENCY_TTL: int = 24 * 3600
+    IDEMPOTENCY_LOCK_TIMEOUT: int = 60 # A running request renews its key's lock; one not renewed this long is taken over
+    IDEMPOTENCY_KEY_MAX_LENGTH: int = 255
+
+    # Content-addressed dedup: identical uploads share one S3 object (reference counted)
+    DEDUP_ENABLED: bool = False
+
+    # Metrics (/metrics in Prometheus format; EMF log lines default to on under Lambda)
+    METRICS_ENABLED: bool = True
+    METRICS_EMF: Optional[bool] = None
+    METRICS_NAMESPACE: str = "Testagram"
+
+    # Post-upload job pipeline: memory:// (in-process worker), sqlite:///<path> (local
+    # stand-in, consumed by worker.py) or an SQS queue URL. Unset: renditions are
+    # generated in a background task after the response, as before.
+    JOB_QUEUE_URL: Optional[str] = None
+    JOB_DEAD_LETTER_URL: Optional[str] = None # SQS only; local queues keep dead letters themselves
+    JOB_PROCESSORS: List[str] = ["renditions", "phash"]
+    JOB_BATCH_SIZE: int = 10
+    JOB_CONCURRENCY: int = 4
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_VISIBILITY_TIMEOUT: int = 300
+    JOB_RETRY_BASE_DELAY: float = 5.0
+    JOB_POLL_INTERVAL: float = 1.0
+
+    # Full-text search (inverted index stored in the table, see app/search.py)
+    SEARCH_SCAN_SEGMENTS: int = 8 # Parallel Scan segments of table-wide rebuilds (search, facets, similarity)
+    SEARCH_MIN_PREFIX: int = 2 # Shorter query tokens only match whole terms
+    SEARCH_MAX_PREFIX: int = 6 # Longest indexed prefix; longer tokens are filtered from its postings
+    SEARCH_MAX_POSTINGS: int = 20000 # Postings read per index key; larger result sets are flagged truncated
+
+    # Materialized facet counts (tags, content types, upload days), kept up to date on write
+    FACET_SHARDS: int = 8 # Items per counter; each write picks one at random, so popular tags don't make a hot key
+    FACET_CACHE_TTL: float = 5.0 # Seconds GET /images/facets is served from memory; 0 = always read
+    FACET_SUMMARY_TAGS: int = 1000 # Most used tags kept by the rollup (python -m app.facets); the tag cloud's limit
+    FACET_SUMMARY_MAX_AGE: float = 3600.0 # A request finding an older (or no) summary rolls up first
+
+    # Change feed (GET /images/changes): image writes are appended to CHANGE_PARTITIONS
+    # sequenced logs (0 = off; changing it invalidates outstanding cursors)
+    CHANGE_PARTITIONS: int = 4
+    # A sequence number still missing after this long was never written and is skipped;
+    # keep it above REQUEST_DEADLINE so slow writers are waited for
+    CHANGE_SETTLE: float = 30.0
+    CHANGE_RETENTION: int = 7 * 24 * 3600 # Compaction drops older entries; older cursors get 410
+
+    # Header probing (dimensions, orientation, capture time) at upload and in the backfill
+    PROBE_HEADER_BYTES: int = 64 * 1024
+    PROBE_MAX_BYTES: int = 1024 * 1024 # Ranged GETs double up to this while the header is cut off
+
+    # Near-duplicate detection (64-bit perceptual hashes in an in-process NumPy index)
+    SIMILAR_INDEX_TTL: float = 300.0 # Rebuild in the background after this many seconds
+    SIMILAR_MAX_DISTANCE: int = 10 # Default Hamming distance (bits) for GET /images/{id}/similar
+    # Reject form uploads within this distance of a stored image (409); unset = accept all
+    NEAR_DUPLICATE_DISTANCE: Optional[int] = None
+
+    # Derived renditions (thumbnails etc.), stored next to the original in S3
+    RENDITIONS: Dict[str, RenditionSpec] = {
+        "thumb": RenditionSpec(size=256, format="WEBP", quality=80),
+        "large": RenditionSpec(size=1024, format="JPEG", quality=85),
+    }
+    RENDITION_WORKERS: int = 2
+    RENDITION_MAX_SOURCE_SIZE: int = 50 * 1024 * 1024
+    # Generate renditions in the background after an upload; defaults to on
+    # outside Lambda (there they are generated lazily on first request)
+    RENDITIONS_ON_UPLOAD: Optional[bool] = None
+
     @property
     def aws_endpoint(self) -> Optional[str]:
         if self.AWS_ENDPOINT_URL:
@@ -26,6 +193,39 @@ class Settings(BaseSettings):
             return f"http://{localstack_host}:4566"
         return None
 
+    # SSM parameters are fetched once per process and refreshed after this many seconds
+    SSM_CACHE_TTL: float = 900.0
+    # Create the bucket/table on startup; defaults to dev/local outside Lambda
+    BOOTSTRAP: Optional[bool] = None
+
+    @property
+    def is_lambda(self) -> bool:
+        return "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+
+    @property
+    def should_bootstrap(self) -> bool:
+        if self.BOOTSTRAP is not None:
+            return self.BOOTSTRAP
+        return self.ENV in ("dev", "local") and not self.is_lambda
+
+    @property
+    def emit_emf(self) -> bool:
+        if self.METRICS_EMF is not None:
+            return self.METRICS_EMF
+        return self.METRICS_ENABLED and self.is_lambda
+
+    @property
+    def admission_enabled(self) -> bool:
+        if self.ADMISSION_ENABLED is not None:
+            return self.ADMISSION_ENABLED
+        return not self.is_lambda
+
+    @property
+    def renditions_on_upload(self) -> bool:
+        if self.RENDITIONS_ON_UPLOAD is not None:
+            return self.RENDITIONS_ON_UPLOAD
+        return not self.is_lambda
+
     model_config = {
         "env_file": "dev.env",
         "extra": "ignore"
@@ -33,11 +233,31 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
+_config_loaded_at: Optional[float] = None
+_config_lock = asyncio.Lock()
+
+async def load_config(force: bool = False):
+    """
+    Loads SSM parameters on first use and caches them for SSM_CACHE_TTL
+    seconds, so warm Lambda invocations do not pay the round trip again.
+    """
+    global _config_loaded_at
+    if not force and _config_loaded_at is not None and time.monotonic() - _config_loaded_at < settings.SSM_CACHE_TTL:
+        return
+    async with _config_lock:
+        if not force and _config_loaded_at is not None and time.monotonic() - _config_loaded_at < settings.SSM_CACHE_TTL:
+            return
+        with report.phase("ssm"):
+            await fetch_ssm_params()
+        _config_loaded_at = time.monotonic()
+
 async def fetch_ssm_params():
     """
     Fetches configuration from SSM Parameter Store.
     Updates the global settings object.
     """
+    import aioboto3 # Deferred: heavy import, only needed once SSM is actually queried
+
     session = aioboto3.Session()
     print(f"DEBUG: Session created. Connecting to SSM at {settings.AWS_ENDPOINT_URL}", flush=True)
     try:
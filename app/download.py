@@ -0,0 +1,226 @@
+"""
+Streaming download proxy: serves an object from S3 through the app with
+HTTP Range support (single ranges as 206, several as multipart/byteranges)
+and ETag/Last-Modified validators for conditional requests.
+
+Bodies are relayed in DOWNLOAD_CHUNK_SIZE chunks straight from the pooled
+S3 connection, so memory per download stays constant; the ASGI server only
+asks for the next chunk once the previous one has been sent.
+
+Plain and single-range requests are a single GetObject: Range and the
+conditional headers are handed to S3, which evaluates them. Only requests
+for several ranges need a HEAD first, to resolve the ranges against the
+object size.
+"""
+import uuid
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+
+from app.config import settings
+from app.http_cache import etag_matches
+from app.resilience import request_deadline
+from app.services import StorageService
+
+ByteRange = Tuple[Optional[int], Optional[int]] # (first, last); (None, n) is a suffix of n bytes
+
+
+def parse_range(header: Optional[str]) -> Optional[List[ByteRange]]:
+    """
+    Parses a `Range: bytes=...` header. Returns None when there is none or it
+    is malformed, in which case the header is ignored (RFC 9110 14.2).
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for part in spec.split(","):
+        first, dash, last = part.strip().partition("-")
+        if not dash or not (first or last) or not (first or "0").isdigit() or not (last or "0").isdigit():
+            return None
+        if not first:
+            ranges.append((None, int(last)))
+            continue
+        if last and int(last) < int(first):
+            return None
+        ranges.append((int(first), int(last) if last else None))
+    return ranges or None
+
+
+def resolve_ranges(ranges: List[ByteRange], size: int) -> List[Tuple[int, int]]:
+    """
+    Turns parsed ranges into satisfiable (start, end) offsets for an object
+    of `size` bytes, sorted with overlapping or adjacent ranges merged.
+    """
+    resolved = []
+    for first, last in ranges:
+        if first is None:
+            if last == 0 or size == 0:
+                continue
+            resolved.append((max(size - last, 0), size - 1))
+        elif first < size:
+            resolved.append((first, min(last if last is not None else size - 1, size - 1)))
+    merged = []
+    for start, end in sorted(resolved):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _format_range(byte_range: ByteRange) -> str:
+    first, last = byte_range
+    if first is None:
+        return f"bytes=-{last}"
+    return f"bytes={first}-{'' if last is None else last}"
+
+
+def _http_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _relay(body) -> AsyncIterator[bytes]:
+    async with body:
+        async for chunk in body.iter_chunks(settings.DOWNLOAD_CHUNK_SIZE):
+            yield chunk
+
+
+def _validators(response: dict) -> dict:
+    headers = {"Accept-Ranges": "bytes"}
+    if response.get('ETag'):
+        headers["ETag"] = response['ETag']
+    if response.get('LastModified'):
+        headers["Last-Modified"] = format_datetime(response['LastModified'].astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def _not_modified(request: Request, head: dict) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return bool(head.get('ETag')) and etag_matches(if_none_match, head['ETag'])
+    since = _http_date(request.headers.get("if-modified-since"))
+    return since is not None and head.get('LastModified') is not None and head['LastModified'] <= since
+
+
+def _range_applies(request: Request, head: dict) -> bool:
+    """If-Range: ranges only apply to the representation the client already has."""
+    if_range = request.headers.get("if-range")
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == head.get('ETag')
+    date = _http_date(if_range)
+    return date is not None and head.get('LastModified') is not None and head['LastModified'] <= date
+
+
+async def stream_object(request: Request, storage: StorageService, key: str, content_type: str) -> Response:
+    """Answers GET for the object `key`, honouring Range, If-Range, If-None-Match and If-Modified-Since."""
+    ranges = parse_range(request.headers.get("range"))
+    if ranges is not None and len(ranges) > 1:
+        return await _stream_ranges(request, storage, key, content_type, ranges)
+
+    conditions = {}
+    if request.headers.get("if-none-match"):
+        conditions['IfNoneMatch'] = request.headers["if-none-match"]
+    elif _http_date(request.headers.get("if-modified-since")):
+        conditions['IfModifiedSince'] = _http_date(request.headers["if-modified-since"])
+
+    response = None
+    if ranges is not None:
+        range_conditions = {'Range': _format_range(ranges[0])}
+        if_range = request.headers.get("if-range")
+        if if_range:
+            # S3 has no If-Range; a failed If-Match/If-Unmodified-Since means "send it all"
+            if if_range.startswith('"'):
+                range_conditions['IfMatch'] = if_range
+            elif _http_date(if_range):
+                range_conditions['IfUnmodifiedSince'] = _http_date(if_range)
+            else:
+                range_conditions = {}
+        if range_conditions:
+            try:
+                response = await storage.open_file(key, **conditions, **range_conditions)
+            except HTTPException as e:
+                if e.status_code != 412:
+                    raise
+    if response is None:
+        response = await storage.open_file(key, **conditions)
+
+    headers = _validators(response)
+    headers["Content-Length"] = str(response['ContentLength'])
+    status = 200
+    if response.get('ContentRange'):
+        headers["Content-Range"] = response['ContentRange']
+        status = 206
+    return StreamingResponse(_relay(response['Body']), status_code=status,
+                             media_type=response.get('ContentType') or content_type, headers=headers)
+
+
+async def _stream_ranges(request: Request, storage: StorageService, key: str, content_type: str,
+                         ranges: List[ByteRange]) -> Response:
+    """Several ranges: a multipart/byteranges body, one ranged GetObject per part as it is sent."""
+    head = await storage.head_file(key)
+    if head is None:
+        raise HTTPException(status_code=404, detail="Image object not found")
+    headers = _validators(head)
+    if _not_modified(request, head):
+        return Response(status_code=304, headers=headers)
+
+    size = head['ContentLength']
+    content_type = head.get('ContentType') or content_type
+    resolved = resolve_ranges(ranges, size) if _range_applies(request, head) else [(0, size - 1)]
+    if len(ranges) > settings.DOWNLOAD_MAX_RANGES:
+        # Too many ranges to be worth a request each; send the whole object
+        resolved = [(0, size - 1)]
+    if not resolved:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+
+    # Every part is fetched with If-Match, so all of them come from the object we just HEADed
+    guard = {'IfMatch': head['ETag']} if head.get('ETag') else {}
+    if len(resolved) == 1:
+        start, end = resolved[0]
+        if size == 0:
+            headers["Content-Length"] = "0"
+            return Response(status_code=200, media_type=content_type, headers=headers)
+        response = await storage.open_file(key, Range=f"bytes={start}-{end}", **guard)
+        headers["Content-Length"] = str(response['ContentLength'])
+        if (start, end) != (0, size - 1):
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return StreamingResponse(_relay(response['Body']), status_code=206 if "Content-Range" in headers else 200,
+                                 media_type=content_type, headers=headers)
+
+    boundary = uuid.uuid4().hex
+    parts = [(start, end, (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+                           f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode())
+             for start, end in resolved]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    headers["Content-Length"] = str(sum(len(header) + end - start + 1 for start, end, header in parts)
+                                    + len(closing))
+
+    async def body() -> AsyncIterator[bytes]:
+        for start, end, header in parts:
+            yield header
+            # Parts are fetched while the response streams, possibly long after the
+            # request deadline; outside Lambda each fetch gets a fresh one
+            fresh = settings.REQUEST_DEADLINE and not settings.is_lambda
+            with request_deadline(settings.REQUEST_DEADLINE) if fresh else nullcontext():
+                part = await storage.open_file(key, Range=f"bytes={start}-{end}", **guard)
+            async for chunk in _relay(part['Body']):
+                yield chunk
+        yield closing
+
+    return StreamingResponse(body(), status_code=206, headers=headers,
+                             media_type=f"multipart/byteranges; boundary={boundary}")
@@ -0,0 +1,184 @@
+"""
+Materialized facet counts: images per tag, content type and upload day.
+
+Each counter ("<kind>#<value>", e.g. "tag#cats") is spread over
+FACET_SHARDS items, "facet#<kind>#<value>#<shard>", each holding a count.
+Every write ADDs to one shard picked at random, so a popular tag spreads its
+writes over all of them, and no item grows with the number of tags.
+
+Counter items also carry facet_group = "<kind>#<shard>", the partition key
+of the sparse, keys-only facet-index. It lists which counters exist; count
+updates don't touch it. Listing every counter is too much for a request, so
+a rollup, to be run periodically,
+
+    python -m app.facets
+
+sums them into a summary item ("facet#summary": the FACET_SUMMARY_TAGS most
+used tags, every content type and day). The deployed worker Lambda runs it
+on a schedule (see worker.maintenance); a request that finds the summary
+missing or older than FACET_SUMMARY_MAX_AGE rolls up itself. GET
+/images/facets reads the summary, then the live shards of the counters it
+needs (the top tags, the content types and the days since the rollup) with
+BatchGetItem. A tag or content type first used after the last rollup
+appears with the next one.
+
+Counts are adjusted next to the image writes rather than in a transaction,
+so a failed counter update leaves them off by one. Recount from the table
+(also needed once for images stored before counting existed):
+
+    python -m app.facets --recount
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+import time
+from typing import Optional
+
+from app.config import settings
+
+KINDS = {"tag": "tags", "type": "content_types", "day": "days"}
+COUNTER_ATTRIBUTES = ('id', 'facet_key', 'count')
+
+
+def facet_keys(tags: list[str], content_type: str, created_at: str) -> list[str]:
+    """The counters an image contributes to."""
+    keys = [f"tag#{tag}" for tag in sorted(set(tags))]
+    keys.append(f"type#{content_type}")
+    keys.append(f"day#{created_at[:10]}")
+    return keys
+
+
+def sum_counters(items: list[dict]) -> dict[str, int]:
+    """Adds up counter shard items by counter key."""
+    counts: dict[str, int] = {}
+    for item in items:
+        counts[item['facet_key']] = counts.get(item['facet_key'], 0) + int(item.get('count', 0))
+    return counts
+
+
+def group_counts(counts: dict[str, int]) -> dict[str, dict[str, int]]:
+    """Splits counter keys by kind ("tags", ...) and value; counts that dropped to zero are left out."""
+    totals = {name: {} for name in KINDS.values()}
+    for key, count in counts.items():
+        kind, _, value = key.partition("#")
+        if kind in KINDS and value and count > 0:
+            totals[KINDS[kind]][value] = count
+    return totals
+
+
+def top_tags(tags: dict[str, int], limit: int) -> list[str]:
+    """Most used first, ties alphabetically."""
+    return [tag for tag, _ in sorted(tags.items(), key=lambda entry: (-entry[1], entry[0]))[:limit]]
+
+
+def days_since(rolled_up_at: Optional[str], today: Optional[date] = None) -> list[str]:
+    """The upload days whose counters may have changed since the rollup (just today without one)."""
+    today = today or datetime.utcnow().date()
+    day = datetime.fromisoformat(rolled_up_at).date() if rolled_up_at else today
+    days = []
+    while day <= today:
+        days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+
+class FacetCache:
+    """Holds facets for FACET_CACHE_TTL seconds (per tag limit), so tag clouds don't read every counter per request."""
+
+    def __init__(self):
+        self._values: dict[int, tuple[float, dict]] = {}
+
+    def get(self, limit: int) -> Optional[dict]:
+        entry = self._values.get(limit)
+        if entry is not None and time.monotonic() < entry[0]:
+            return entry[1]
+        return None
+
+    def put(self, limit: int, value: dict):
+        if settings.FACET_CACHE_TTL > 0:
+            self._values[limit] = (time.monotonic() + settings.FACET_CACHE_TTL, value)
+
+    def clear(self):
+        self._values.clear()
+
+
+async def counter_items(table) -> list[dict]:
+    """Every counter shard item's id and key, listed from facet-index."""
+    from app.schema import FACET_INDEX
+
+    async def list_group(group: str) -> list[dict]:
+        items, kwargs = [], {'IndexName': FACET_INDEX, 'KeyConditionExpression': 'facet_group = :group',
+                             'ExpressionAttributeValues': {':group': group}}
+        while True:
+            response = await table.query(**kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    groups = await asyncio.gather(*(list_group(f"{kind}#{shard}")
+                                    for kind in KINDS for shard in range(settings.FACET_SHARDS)))
+    return [item for group in groups for item in group]
+
+
+async def rollup(table) -> dict[str, dict[str, int]]:
+    """Sums every counter and stores the summary item GET /images/facets starts from; returns the totals."""
+    from app.services import DatabaseService, FACET_SUMMARY_ITEM_ID
+
+    rolled_up_at = datetime.utcnow().isoformat()
+    ids = [item['id'] for item in await counter_items(table)]
+    items = await DatabaseService(table).get_items(ids, COUNTER_ATTRIBUTES)
+    totals = group_counts(sum_counters(list(items.values())))
+    tags = {tag: totals['tags'][tag] for tag in top_tags(totals['tags'], settings.FACET_SUMMARY_TAGS)}
+    await table.put_item(Item={'id': FACET_SUMMARY_ITEM_ID, 'tags': tags, 'content_types': totals['content_types'],
+                               'days': totals['days'], 'rolled_up_at': rolled_up_at})
+    facet_cache.clear()
+    return totals
+
+
+async def recount(table) -> dict[str, dict[str, int]]:
+    """
+    Recomputes every counter from the image items (onto shard 0, deleting
+    the other shards) and rolls them up. Uploads and deletes that land while
+    the table is being scanned may be missed, so run it when writes are quiet.
+    """
+    from app.search import scan_images
+    from app.services import facet_item_id
+
+    counts: dict[str, int] = {}
+    for item in await scan_images(table, settings.SEARCH_SCAN_SEGMENTS,
+                                  ('id', 'status', 'tags', 'content_type', 'created_at')):
+        if item.get('status', 'ready') != 'ready':
+            continue
+        for key in facet_keys(item.get('tags', []), item['content_type'], item['created_at']):
+            counts[key] = counts.get(key, 0) + 1
+
+    recounted = {facet_item_id(key, 0) for key in counts}
+    async with table.batch_writer() as batch:
+        for item in await counter_items(table):
+            if item['id'] not in recounted:
+                await batch.delete_item(Key={'id': item['id']})
+        for key, count in counts.items():
+            await batch.put_item(Item={'id': facet_item_id(key, 0), 'facet_key': key,
+                                       'facet_group': f"{key.partition('#')[0]}#0", 'count': count})
+    return await rollup(table)
+
+
+def main():
+    import sys
+
+    async def run():
+        from app.clients import clients
+        try:
+            totals = await (recount if "--recount" in sys.argv[1:] else rollup)(await clients.table())
+        finally:
+            await clients.close()
+        print(f"Facets rolled up: {sum(totals['content_types'].values())} images, {len(totals['tags'])} tags")
+
+    asyncio.run(run())
+
+
+facet_cache = FacetCache()
+
+
+if __name__ == "__main__":
+    main()
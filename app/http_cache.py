@@ -0,0 +1,59 @@
+"""
+HTTP caching for read responses: a strong ETag over the serialized body,
+304 Not Modified for a matching If-None-Match, and Cache-Control aligned to
+the presigned URL window (see PresignService.window()).
+
+Download URLs are the only part of a read response that changes without a
+write, and they are byte-identical within a signing window, so the same
+image (or page) yields the same body and ETag until it is modified or the
+window rolls over.
+"""
+import base64
+import hashlib
+import time
+from typing import Optional
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+from app.config import settings
+from app.presign import presigner
+
+
+def etag_for(body: bytes) -> str:
+    digest = hashlib.sha256(body).digest()[:16]
+    return '"' + base64.urlsafe_b64encode(digest).decode().rstrip("=") + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison, as RFC 9110 prescribes for If-None-Match."""
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
+
+
+def cache_control() -> str:
+    wall = time.time()
+    _, reuse_until = presigner.window(wall)
+    max_age = max(0, min(settings.HTTP_CACHE_MAX_AGE, int(reuse_until - wall)))
+    return f"{settings.HTTP_CACHE_SCOPE}, max-age={max_age}"
+
+
+def cached_response(request: Request, model: BaseModel, include: Optional[dict] = None,
+                    exclude_none: bool = False) -> Response:
+    """
+    Serializes `model` as the response, or answers 304 without a body when
+    the client already holds this representation.
+
+    The model is serialized straight to JSON bytes by pydantic-core, skipping
+    FastAPI's response_model re-validation and jsonable_encoder pass, so it
+    must already be a trusted instance of the declared response model.
+    `include` and `exclude_none` shape the output (field projection, compact views).
+    """
+    body = model.model_dump_json(include=include, exclude_none=exclude_none).encode()
+    etag = etag_for(body)
+    headers = {"ETag": etag, "Cache-Control": cache_control()}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
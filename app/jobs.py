@@ -0,0 +1,399 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import random
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+from app.config import settings
+from app.models import ImageMetadata
+
+
+@dataclass
+class Message:
+    id: str
+    body: dict
+    receipt: Optional[str] # Handle for delete/retry; changes with every delivery
+    receive_count: int # Deliveries so far, including this one
+
+
+class JobQueue(ABC):
+    """
+    At-least-once queue with SQS semantics: a received message is hidden for
+    JOB_VISIBILITY_TIMEOUT seconds and delivered again unless it is deleted.
+    Messages that keep failing are moved to a dead-letter queue.
+    """
+
+    @abstractmethod
+    async def send(self, body: dict):
+        ...
+
+    @abstractmethod
+    async def receive(self, max_messages: int, wait: float) -> list[Message]:
+        ...
+
+    @abstractmethod
+    async def delete(self, message: Message):
+        ...
+
+    @abstractmethod
+    async def retry(self, message: Message, delay: float):
+        """Makes the message visible again after `delay` seconds."""
+
+    @abstractmethod
+    async def dead_letter(self, message: Message):
+        ...
+
+
+class MemoryQueue(JobQueue):
+    """In-process queue for local development; its worker runs inside the app (see start_local_worker)."""
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self):
+        # id -> [body, visible_at, receive_count, receipt]
+        self._messages: dict[str, list] = {}
+        self.dead: list[Message] = []
+
+    async def send(self, body: dict):
+        self._messages[str(uuid.uuid4())] = [body, time.monotonic(), 0, None]
+
+    def _receive(self, max_messages: int) -> list[Message]:
+        now = time.monotonic()
+        received = []
+        for message_id, entry in list(self._messages.items()):
+            if len(received) >= max_messages:
+                break
+            body, visible_at, receive_count, _ = entry
+            if visible_at > now:
+                continue
+            if receive_count >= settings.JOB_MAX_ATTEMPTS:
+                # Never acknowledged within its attempts (e.g. the worker died)
+                del self._messages[message_id]
+                self.dead.append(Message(message_id, body, None, receive_count))
+                continue
+            entry[1:] = [now + settings.JOB_VISIBILITY_TIMEOUT, receive_count + 1, str(uuid.uuid4())]
+            received.append(Message(message_id, body, entry[3], entry[2]))
+        return received
+
+    async def receive(self, max_messages: int, wait: float) -> list[Message]:
+        deadline = time.monotonic() + wait
+        while True:
+            received = self._receive(max_messages)
+            if received or time.monotonic() >= deadline:
+                return received
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    def _current(self, message: Message) -> Optional[list]:
+        entry = self._messages.get(message.id)
+        return entry if entry is not None and entry[3] == message.receipt else None
+
+    async def delete(self, message: Message):
+        if self._current(message) is not None:
+            del self._messages[message.id]
+
+    async def retry(self, message: Message, delay: float):
+        entry = self._current(message)
+        if entry is not None:
+            entry[1] = time.monotonic() + delay
+
+    async def dead_letter(self, message: Message):
+        if self._current(message) is not None:
+            del self._messages[message.id]
+            self.dead.append(message)
+
+    def __len__(self):
+        return len(self._messages)
+
+
+class SQLiteQueue(JobQueue):
+    """
+    Local stand-in for SQS in a SQLite file, so the API and worker.py can run
+    as separate processes without AWS. Dead letters stay in the same table
+    with dead = 1.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            body TEXT NOT NULL,
+            visible_at REAL NOT NULL,
+            receive_count INTEGER NOT NULL DEFAULT 0,
+            receipt TEXT,
+            dead INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS jobs_visible ON jobs (dead, visible_at);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        connection = self._connect()
+        try:
+            connection.executescript(self.SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per operation keeps this safe across threads
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _run(self, fn, *args):
+        def run():
+            connection = self._connect()
+            try:
+                return fn(connection, *args)
+            finally:
+                connection.close()
+        return asyncio.to_thread(run)
+
+    async def send(self, body: dict):
+        await self._run(lambda c: c.execute("INSERT INTO jobs (id, body, visible_at) VALUES (?, ?, ?)",
+                                            (str(uuid.uuid4()), json.dumps(body), time.time())))
+
+    @staticmethod
+    def _receive(connection: sqlite3.Connection, max_messages: int) -> list[Message]:
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("UPDATE jobs SET dead = 1 WHERE dead = 0 AND visible_at <= ? AND receive_count >= ?",
+                               (now, settings.JOB_MAX_ATTEMPTS))
+            rows = connection.execute(
+                "SELECT id, body, receive_count FROM jobs WHERE dead = 0 AND visible_at <= ? "
+                "ORDER BY visible_at LIMIT ?", (now, max_messages)).fetchall()
+            received = []
+            for message_id, body, receive_count in rows:
+                receipt = str(uuid.uuid4())
+                connection.execute("UPDATE jobs SET visible_at = ?, receive_count = ?, receipt = ? WHERE id = ?",
+                                   (now + settings.JOB_VISIBILITY_TIMEOUT, receive_count + 1, receipt, message_id))
+                received.append(Message(message_id, json.loads(body), receipt, receive_count + 1))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return received
+
+    async def receive(self, max_messages: int, wait: float) -> list[Message]:
+        deadline = time.monotonic() + wait
+        while True:
+            received = await self._run(self._receive, max_messages)
+            if received or time.monotonic() >= deadline:
+                return received
+            await asyncio.sleep(min(settings.JOB_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+
+    async def delete(self, message: Message):
+        await self._run(lambda c: c.execute("DELETE FROM jobs WHERE id = ? AND receipt = ?",
+                                            (message.id, message.receipt)))
+
+    async def retry(self, message: Message, delay: float):
+        await self._run(lambda c: c.execute("UPDATE jobs SET visible_at = ? WHERE id = ? AND receipt = ?",
+                                            (time.time() + delay, message.id, message.receipt)))
+
+    async def dead_letter(self, message: Message):
+        await self._run(lambda c: c.execute("UPDATE jobs SET dead = 1 WHERE id = ? AND receipt = ?",
+                                            (message.id, message.receipt)))
+
+
+class SQSQueue(JobQueue):
+    """
+    SQS through the shared clients. The queue's redrive policy should move
+    messages to JOB_DEAD_LETTER_URL after JOB_MAX_ATTEMPTS receives (deploy.py
+    sets it up), which also covers workers that die mid-job.
+    """
+
+    def __init__(self, url: str, dead_letter_url: Optional[str]):
+        self.url = url
+        self.dead_letter_url = dead_letter_url
+
+    async def _client(self):
+        from app.clients import clients
+        return await clients.sqs()
+
+    async def send(self, body: dict):
+        await (await self._client()).send_message(QueueUrl=self.url, MessageBody=json.dumps(body))
+
+    async def receive(self, max_messages: int, wait: float) -> list[Message]:
+        response = await (await self._client()).receive_message(
+            QueueUrl=self.url, MaxNumberOfMessages=min(max_messages, 10), WaitTimeSeconds=int(min(wait, 20)),
+            VisibilityTimeout=settings.JOB_VISIBILITY_TIMEOUT, AttributeNames=['ApproximateReceiveCount'])
+        return [Message(message['MessageId'], json.loads(message['Body']), message['ReceiptHandle'],
+                        int(message.get('Attributes', {}).get('ApproximateReceiveCount', 1)))
+                for message in response.get('Messages', [])]
+
+    async def delete(self, message: Message):
+        await (await self._client()).delete_message(QueueUrl=self.url, ReceiptHandle=message.receipt)
+
+    async def retry(self, message: Message, delay: float):
+        # SQS caps visibility timeouts at 12 hours
+        await (await self._client()).change_message_visibility(
+            QueueUrl=self.url, ReceiptHandle=message.receipt, VisibilityTimeout=int(min(delay, 43200)))
+
+    async def dead_letter(self, message: Message):
+        if self.dead_letter_url:
+            await (await self._client()).send_message(QueueUrl=self.dead_letter_url,
+                                                      MessageBody=json.dumps(message.body))
+        else:
+            print(f"No JOB_DEAD_LETTER_URL set, dropping job {message.id}: {message.body}")
+        await self.delete(message)
+
+
+_queues: dict[str, JobQueue] = {}
+
+
+def job_queue() -> Optional[JobQueue]:
+    """The queue configured by JOB_QUEUE_URL, or None when the pipeline is off."""
+    url = settings.JOB_QUEUE_URL
+    if not url:
+        return None
+    queue = _queues.get(url)
+    if queue is None:
+        if url.startswith("memory://"):
+            queue = MemoryQueue()
+        elif url.startswith("sqlite:///"):
+            queue = SQLiteQueue(url[len("sqlite:///"):])
+        elif url.startswith(("http://", "https://")):
+            queue = SQSQueue(url, settings.JOB_DEAD_LETTER_URL)
+        else:
+            raise RuntimeError(f"Unsupported JOB_QUEUE_URL: {url}")
+        _queues[url] = queue
+    return queue
+
+
+# --- Processors -----------------------------------------------------------
+
+Processor = Callable[[ImageMetadata, object, object], Awaitable[None]]
+PROCESSORS: dict[str, Processor] = {}
+
+
+def processor(name: str):
+    """
+    Registers `fn(image, storage, db)` as a job step runnable via
+    JOB_PROCESSORS. Steps must be idempotent (jobs are delivered at least
+    once) and record their results on the image themselves. An HTTPException
+    with a 4xx status marks a permanent failure that is not retried.
+    """
+    def register(fn: Processor) -> Processor:
+        PROCESSORS[name] = fn
+        return fn
+    return register
+
+
+@processor("renditions")
+async def generate_renditions(image: ImageMetadata, storage, db):
+    if settings.RENDITIONS and image.content_type.startswith("image/"):
+        from app.renditions import renditions
+        await renditions.ensure(image, list(settings.RENDITIONS), storage, db)
+
+
+@processor("phash")
+async def hash_image(image: ImageMetadata, storage, db):
+    # Form uploads are hashed in the request; this covers streamed and direct uploads
+    from app.similarity import hash_image
+    await hash_image(image, storage, db)
+
+
+# --- Worker ---------------------------------------------------------------
+
+DONE, RETRY, DEAD = "done", "retry", "dead"
+
+
+class JobWorker:
+    """
+    Runs the JOB_PROCESSORS steps for queued images, up to JOB_CONCURRENCY at
+    a time, and records the outcome as the image's processing status. Failed
+    jobs are retried with jittered exponential backoff; after
+    JOB_MAX_ATTEMPTS deliveries, or on a permanent failure, the image is
+    marked "failed" and the job goes to the dead-letter queue.
+    """
+
+    def __init__(self, queue: JobQueue):
+        self.queue = queue
+
+    async def _services(self):
+        from app.cache import metadata_cache
+        from app.clients import clients
+        from app.similarity import similarity_index
+        from app.services import DatabaseService, StorageService
+
+        return StorageService(await clients.s3()), DatabaseService(await clients.table(), metadata_cache,
+                                                                   similarity_index)
+
+    async def process(self, message: Message) -> str:
+        """Processes one job and returns DONE, RETRY or DEAD; the caller acknowledges it."""
+        storage, db = await self._services()
+        image = await db.get_metadata(message.body['image_id'])
+        if image is None or image.status != "ready":
+            # Deleted (or never completed) since it was queued; nothing to do
+            return DONE
+        try:
+            for name in settings.JOB_PROCESSORS:
+                await PROCESSORS[name](image, storage, db)
+        except Exception as e:
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            permanent = isinstance(e, HTTPException) and 400 <= e.status_code < 500
+            if not permanent and message.receive_count < settings.JOB_MAX_ATTEMPTS:
+                print(f"Job for {image.id} failed (attempt {message.receive_count}), retrying: {error}")
+                return RETRY
+            print(f"Job for {image.id} failed for good: {error}")
+            await db.set_processing(image, "failed", error)
+            return DEAD
+        await db.set_processing(image, "done")
+        return DONE
+
+    def retry_delay(self, message: Message) -> float:
+        return random.uniform(0.5, 1.0) * settings.JOB_RETRY_BASE_DELAY * 2 ** (message.receive_count - 1)
+
+    async def consume(self, message: Message) -> str:
+        try:
+            outcome = await self.process(message)
+        except Exception as e:
+            # Infrastructure failure (e.g. the metadata read): let it come back
+            print(f"Job {message.id} crashed: {e}")
+            outcome = RETRY
+        if outcome == DONE:
+            await self.queue.delete(message)
+        elif outcome == RETRY:
+            await self.queue.retry(message, self.retry_delay(message))
+        else:
+            await self.queue.dead_letter(message)
+        return outcome
+
+    async def run_once(self, wait: float = 0.0) -> int:
+        """Receives and processes one batch; returns the number of jobs handled."""
+        from app.services import gather_bounded
+
+        messages = await self.queue.receive(settings.JOB_BATCH_SIZE, wait)
+        await gather_bounded((self.consume(message) for message in messages), settings.JOB_CONCURRENCY)
+        return len(messages)
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        while stop is None or not stop.is_set():
+            try:
+                await self.run_once(wait=settings.JOB_POLL_INTERVAL)
+            except Exception as e:
+                print(f"Job worker error: {e}")
+                await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+
+
+async def enqueue_processing(image: ImageMetadata, db) -> bool:
+    """Queues the post-upload job for an image; returns False if there is no queue."""
+    queue = job_queue()
+    if queue is None:
+        return False
+    try:
+        await queue.send({'image_id': image.id})
+    except Exception as e:
+        print(f"Could not queue processing for {image.id}: {e}")
+        await db.set_processing(image, "failed", f"Could not queue processing: {e}")
+    return True
+
+
+def start_local_worker() -> Optional[asyncio.Task]:
+    """Runs the worker inside the app when the queue is in-process (memory://)."""
+    queue = job_queue()
+    if not isinstance(queue, MemoryQueue):
+        return None
+    return asyncio.create_task(JobWorker(queue).run())
@@ -1,63 +1,62 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
+from botocore.exceptions import ClientError
 from contextlib import asynccontextmanager
-import aioboto3
-from app.config import settings, fetch_ssm_params
+from app.config import settings
+from app.clients import clients
+from app.cache import metadata_cache
+from app.renditions import renditions
+from app.jobs import start_local_worker
+from app.schema import ensure_metadata_table
+from app.startup import report, FirstResponseMiddleware
+from app.metrics import registry, MetricsMiddleware
+from app.resilience import DeadlineMiddleware, is_throttling
+from app.admission import AdmissionMiddleware
 from app.routers import images
-import uvicorn
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
     print("Starting up...")
-    
-    # 1. Fetch SSM Params
-    await fetch_ssm_params()
-
-    # 2. Bootstrap LocalStack (Ensure Bucket and Table exist)
-    # Only do this if we are in dev/local environment
-    if settings.ENV == "dev" or settings.ENV == "local":
-        session = aioboto3.Session()
-        
+
+    # Bootstrap LocalStack (Ensure Bucket and Table exist)
+    # Only in dev/local outside Lambda. Everywhere else SSM params and AWS clients
+    # are loaded lazily by the first request that needs them (and cached across
+    # warm Lambda invocations), so nothing here sits on the cold-start path.
+    if settings.should_bootstrap:
+        # Loads SSM params and opens the shared clients (no-op when already open)
+        await clients.start()
+
         # S3 Bootstrap
         try:
-            async with session.client("s3", 
-                                      region_name=settings.AWS_REGION, 
-                                      endpoint_url=settings.aws_endpoint,
-                                      aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                      aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY) as s3:
-                try:
-                    await s3.head_bucket(Bucket=settings.BUCKET_NAME)
-                    print(f"Bucket {settings.BUCKET_NAME} exists.")
-                except:
-                    print(f"Creating bucket {settings.BUCKET_NAME}...")
-                    await s3.create_bucket(Bucket=settings.BUCKET_NAME)
+            s3 = await clients.s3()
+            try:
+                await s3.head_bucket(Bucket=settings.BUCKET_NAME)
+                print(f"Bucket {settings.BUCKET_NAME} exists.")
+            except:
+                print(f"Creating bucket {settings.BUCKET_NAME}...")
+                await s3.create_bucket(Bucket=settings.BUCKET_NAME)
         except Exception as e:
             print(f"Failed to bootstrap S3: {e}")
 
         # DynamoDB Bootstrap
         try:
-            async with session.resource("dynamodb",
-                                        region_name=settings.AWS_REGION, 
-                                        endpoint_url=settings.aws_endpoint,
-                                        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY) as dynamo:
-                table = await dynamo.Table(settings.TABLE_NAME)
-                try:
-                    await table.load()
-                    print(f"Table {settings.TABLE_NAME} exists.")
-                except:
-                    print(f"Creating table {settings.TABLE_NAME}...")
-                    await dynamo.create_table(
-                        TableName=settings.TABLE_NAME,
-                        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
-                        AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
-                        ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                    )
+            await ensure_metadata_table(await clients.dynamodb(), settings.TABLE_NAME)
         except Exception as e:
             print(f"Failed to bootstrap DynamoDB: {e}")
 
+    # memory:// job queues are consumed inside the app (other queues by worker.py)
+    worker = start_local_worker()
+
     yield
     print("Shutting down...")
+    if worker is not None:
+        worker.cancel()
+    # Mangum runs the lifespan around every Lambda invocation; keep the pooled
+    # clients open so warm invocations reuse their connections.
+    if not settings.is_lambda:
+        await clients.close()
+        renditions.close()
 
 import os
 root_path = os.environ.get("ROOT_PATH", "")
@@ -65,13 +64,50 @@ app = FastAPI(title="Testagram Image Service", lifespan=lifespan, root_path=root
 
 app.include_router(images.router)
 
+@app.exception_handler(ClientError)
+async def client_error_handler(request, exc: ClientError):
+    # DynamoDB throttling that outlasted the retries: ask the client to back off
+    if is_throttling(exc):
+        return JSONResponse(status_code=503, content={"detail": "Service is busy, retry later"},
+                            headers={"Retry-After": "1"})
+    print(f"Unhandled AWS error on {request.method} {request.url.path}: {exc}")
+    return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Testagram Image Service"}
 
+@app.get("/cache/stats")
+def cache_stats():
+    return metadata_cache.stats() if metadata_cache else {"backend": None}
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    return PlainTextResponse(registry.expose(), media_type="text/plain; version=0.0.4")
+
+def _cache_metrics():
+    stats = metadata_cache.stats() if metadata_cache else {}
+    return [(f"testagram_metadata_cache_{name}_total", f"Metadata cache {name}", "counter", {(): stats[name]})
+            for name in ("hits", "misses", "negative_hits", "evictions") if name in stats]
+
+registry.add_collector(_cache_metrics)
+
+# Inside the deadline, so time spent queueing for admission counts against it
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(DeadlineMiddleware)
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+if report.enabled:
+    app.add_middleware(FirstResponseMiddleware)
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True, env_file="dev.env")
 
-# Adapter for AWS Lambda
-from mangum import Mangum
-handler = Mangum(app)
+def __getattr__(name):
+    # The Lambda adapter lives in handler.py so importing the app stays light;
+    # `app.main.handler` is kept for existing deployments.
+    if name == "handler":
+        from handler import handler
+        return handler
+    raise AttributeError(name)
@@ -0,0 +1,341 @@
+import contextvars
+import functools
+import inspect
+import json
+import time
+from collections import defaultdict
+from typing import Optional
+
+from app.config import settings
+
+# Seconds; covers sub-millisecond cache hits up to Lambda-timeout-sized requests
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# DynamoDB operations that accept ReturnConsumedCapacity
+CAPACITY_OPERATIONS = {"GetItem", "PutItem", "UpdateItem", "DeleteItem", "Query", "Scan",
+                       "BatchGetItem", "BatchWriteItem", "TransactGetItems", "TransactWriteItems"}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1.0, **labels):
+        self.values[_label_key(labels)] += amount
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # label key -> [per-bucket counts..., +Inf count], sum
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = defaultdict(float)
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        self.sums[key] += value
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {self.sums[key]:g}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """In-process metric registry rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: dict[str, object] = {}
+        self.collectors = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def add_collector(self, collect):
+        """`collect()` returns extra (name, help, type, {label tuple: value}) samples at scrape time."""
+        self.collectors.append(collect)
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose())
+        for collect in self.collectors:
+            for name, help, kind, values in collect():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_format_labels(key)} {value:g}" for key, value in sorted(values.items())]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter("testagram_http_requests_total", "HTTP requests by route and status")
+http_latency = registry.histogram("testagram_http_request_duration_seconds", "HTTP request latency by route")
+service_latency = registry.histogram("testagram_service_call_duration_seconds",
+                                     "StorageService/DatabaseService call latency")
+aws_latency = registry.histogram("testagram_aws_request_duration_seconds",
+                                 "AWS API call latency by operation and table/bucket, from the call to its final "
+                                 "outcome (rate-limit waits, retries and backoff included)")
+aws_retries = registry.counter("testagram_aws_retries_total", "AWS API call retries (resilience layer or botocore)")
+aws_errors = registry.counter("testagram_aws_errors_total", "AWS API calls that failed, by error code")
+dynamodb_capacity = registry.counter("testagram_dynamodb_consumed_capacity_total",
+                                     "DynamoDB capacity units consumed")
+dynamodb_scanned = registry.counter("testagram_dynamodb_items_scanned_total",
+                                    "Items DynamoDB evaluated for Query/Scan")
+dynamodb_returned = registry.counter("testagram_dynamodb_items_returned_total",
+                                     "Items DynamoDB returned for Query/Scan")
+
+
+class RequestMetrics:
+    """Per-request totals of the dependency calls made while serving it (for EMF)."""
+
+    def __init__(self):
+        self.values: dict[str, float] = defaultdict(float)
+
+    def add(self, name: str, value: float):
+        self.values[name] += value
+
+
+_current: contextvars.ContextVar[Optional[RequestMetrics]] = contextvars.ContextVar("request_metrics",
+                                                                                   default=None)
+
+
+def _record(name: str, value: float):
+    current = _current.get()
+    if current is not None:
+        current.add(name, value)
+
+
+# --- Service wrappers -----------------------------------------------------
+
+def instrumented(service: str):
+    """
+    Class decorator timing every public coroutine method of a service class
+    (e.g. StorageService.upload_file) as testagram_service_call_duration_seconds.
+    """
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith("_") or not inspect.iscoroutinefunction(method):
+                continue
+            setattr(cls, name, _timed(service, name, method))
+        return cls
+    return decorate
+
+
+def _timed(service: str, operation: str, method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await method(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            service_latency.observe(time.perf_counter() - start, service=service,
+                                    operation=operation, outcome=outcome)
+    return wrapper
+
+
+# --- AWS client hooks -----------------------------------------------------
+
+def _resource_name(params: dict) -> str:
+    if "TableName" in params:
+        return params["TableName"]
+    if "Bucket" in params:
+        return params["Bucket"]
+    items = params.get("RequestItems") or params.get("TransactItems")
+    if isinstance(items, dict):
+        return ",".join(sorted(items))
+    return ""
+
+
+def _before_parameter_build(params, model, context, **kwargs):
+    context["metrics_resource"] = _resource_name(params)
+    if model.service_model.service_name == "dynamodb" and model.name in CAPACITY_OPERATIONS:
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+
+def _before_call(model, context, **kwargs):
+    # Registered ahead of the resilience hooks, so the clock also runs through their waits and retries
+    context["metrics_start"] = time.perf_counter()
+    context["metrics_service"] = model.service_model.service_name
+    context["metrics_operation"] = model.name
+
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    start = context.get("metrics_start")
+    if start is None:
+        return
+    service = model.service_model.service_name
+    resource = context.get("metrics_resource", "")
+    elapsed = time.perf_counter() - start
+    aws_latency.observe(elapsed, service=service, operation=model.name, resource=resource)
+    _record(f"{service}_ms", elapsed * 1000)
+
+    retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    if retries:
+        aws_retries.inc(retries, service=service, operation=model.name)
+        _record("aws_retries", retries)
+    if "Error" in parsed:
+        aws_errors.inc(service=service, operation=model.name, code=parsed["Error"].get("Code", ""))
+
+    capacity = parsed.get("ConsumedCapacity")
+    if capacity:
+        for entry in capacity if isinstance(capacity, list) else [capacity]:
+            units = entry.get("CapacityUnits", 0)
+            dynamodb_capacity.inc(units, table=entry.get("TableName", resource), operation=model.name)
+            _record("dynamodb_capacity_units", units)
+    if "ScannedCount" in parsed:
+        dynamodb_scanned.inc(parsed["ScannedCount"], table=resource, operation=model.name)
+        dynamodb_returned.inc(parsed.get("Count", 0), table=resource, operation=model.name)
+        _record("dynamodb_items_scanned", parsed["ScannedCount"])
+        _record("dynamodb_items_returned", parsed.get("Count", 0))
+
+
+def _after_call_error(exception, context, **kwargs):
+    # botocore passes no model with this event; before-call noted the operation
+    start = context.get("metrics_start")
+    if start is None:
+        return
+    service, operation = context["metrics_service"], context["metrics_operation"]
+    aws_latency.observe(time.perf_counter() - start, service=service, operation=operation,
+                        resource=context.get("metrics_resource", ""))
+    aws_errors.inc(service=service, operation=operation, code=type(exception).__name__)
+
+
+def instrument_client(client):
+    """Registers the metric hooks on a botocore/aiobotocore client."""
+    if not settings.METRICS_ENABLED:
+        return
+    events = client.meta.events
+    events.register("before-parameter-build", _before_parameter_build, unique_id="testagram-metrics-params")
+    events.register("before-call", _before_call, unique_id="testagram-metrics-before")
+    events.register("after-call", _after_call, unique_id="testagram-metrics-after")
+    events.register("after-call-error", _after_call_error, unique_id="testagram-metrics-error")
+
+
+# --- HTTP -----------------------------------------------------------------
+
+def _route_template(scope) -> str:
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is None or app is None:
+        return "unmatched"
+    templates = getattr(app, "_metrics_route_templates", None)
+    if templates is None:
+        templates = {getattr(route, "endpoint", None): route.path for route in app.routes}
+        app._metrics_route_templates = templates
+    return templates.get(endpoint, "unmatched")
+
+
+def emf_line(route: str, method: str, status: int, latency_ms: float, values: dict) -> str:
+    """One CloudWatch embedded-metric-format log line for a request."""
+    metrics = {"RequestLatency": ("Milliseconds", latency_ms),
+               "DynamoDBLatency": ("Milliseconds", values.get("dynamodb_ms", 0.0)),
+               "S3Latency": ("Milliseconds", values.get("s3_ms", 0.0)),
+               "AwsRetries": ("Count", values.get("aws_retries", 0)),
+               "DynamoDBCapacityUnits": ("Count", values.get("dynamodb_capacity_units", 0.0)),
+               "DynamoDBItemsScanned": ("Count", values.get("dynamodb_items_scanned", 0)),
+               "DynamoDBItemsReturned": ("Count", values.get("dynamodb_items_returned", 0))}
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": settings.METRICS_NAMESPACE,
+                "Dimensions": [["route", "method"]],
+                "Metrics": [{"Name": name, "Unit": unit} for name, (unit, _) in metrics.items()],
+            }],
+        },
+        "route": route,
+        "method": method,
+        "status": status,
+        **{name: round(value, 3) for name, (_, value) in metrics.items()},
+    }
+    return json.dumps(document, separators=(",", ":"))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency and status per route template, and
+    (under Lambda by default) printing one EMF log line per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        finished = None
+        status = 500
+        current = RequestMetrics()
+        token = _current.set(current)
+
+        async def send_wrapper(message):
+            nonlocal status, finished
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Background tasks run after this; they are not part of the latency
+                finished = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            elapsed = (finished or time.perf_counter()) - start
+            route, method = _route_template(scope), scope["method"]
+            http_latency.observe(elapsed, route=route, method=method)
+            http_requests.inc(route=route, method=method, status=status)
+            if settings.emit_emf:
+                print(emf_line(route, method, status, elapsed * 1000, current.values), flush=True)
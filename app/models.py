@@ -1,7 +1,21 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 from pydantic import BaseModel, Field
 
+class Rendition(BaseModel):
+    filename: str # Derived S3 key
+    content_type: str
+    width: int
+    height: int
+    size: int
+
+class ImageInfo(BaseModel):
+    width: int # Stored pixel size; orientations 5-8 display rotated (width and height swapped)
+    height: int
+    format: str # Pillow format name, e.g. JPEG, PNG, WEBP
+    orientation: int = 1 # EXIF orientation (1-8)
+    taken_at: Optional[str] = None # EXIF capture time (camera local time, no zone)
+
 class ImageMetadata(BaseModel):
     id: str
     filename: str
@@ -12,13 +26,85 @@ class ImageMetadata(BaseModel):
     created_at: str
     tags: List[str] = []
     description: Optional[str] = None
+    content_hash: Optional[str] = None # SHA-256 of the object, when computed at upload
+    status: str = "ready" # "pending" until a direct upload is completed
+    etag: Optional[str] = None
+    blob_hash: Optional[str] = None # Set when the object is shared through the dedup index
+    renditions: Dict[str, Rendition] = {} # Generated renditions by name (see settings.RENDITIONS)
+    processing: Optional[str] = None # "queued", "done" or "failed" when processed by the job pipeline
+    processing_error: Optional[str] = None
+    info: Optional[ImageInfo] = None # Dimensions/EXIF probed from the header at upload
+    phash: Optional[str] = None # 64-bit perceptual hash (16 hex digits), for near-duplicate detection
 
 class ImageCreate(BaseModel):
     tags: List[str] = []
     description: Optional[str] = None
 
+class UploadRequest(BaseModel):
+    filename: str
+    content_type: str
+    size: Optional[int] = None # Expected size in bytes, checked against MAX_UPLOAD_SIZE
+    tags: List[str] = []
+    description: Optional[str] = None
+
+class UploadTicket(BaseModel):
+    id: str
+    upload_url: str # POST the file here as multipart form data, with `fields` first
+    fields: Dict[str, str]
+    expires_in: int
+    image: ImageMetadata
+
+class BatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1)
+
+class BatchItemResult(BaseModel):
+    id: Optional[str] = None
+    filename: Optional[str] = None # Original filename, for batch uploads
+    status: int # HTTP-style status of this item
+    error: Optional[str] = None
+    image: Optional[ImageMetadata] = None
+
+class BatchResponse(BaseModel):
+    items: List[BatchItemResult]
+
 class ImageFilter(BaseModel):
     filename: Optional[str] = None
     tag: Optional[str] = None
     date_from: Optional[datetime] = None
     date_to: Optional[datetime] = None
+
+class ImagePage(BaseModel):
+    items: List[ImageMetadata]
+    limit: int
+    next_cursor: Optional[str] = None # Opaque; pass back as ?cursor= to fetch the next page
+
+class SimilarImage(ImageMetadata):
+    distance: int # Hamming distance (bits) between the perceptual hashes
+
+class SimilarImages(BaseModel):
+    items: List[SimilarImage] # Nearest first
+    max_distance: int
+
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class Facets(BaseModel):
+    tags: List[FacetCount] # Most used first
+    content_types: List[FacetCount]
+    days: List[FacetCount] # Upload day (UTC, YYYY-MM-DD), newest first
+
+class ImageChange(BaseModel):
+    id: str # Image id
+    op: str # "upsert", or "delete" (tombstone)
+    changed_at: str
+    image: Optional[ImageMetadata] = None # The image as of this change; None for deletes
+
+class ChangePage(BaseModel):
+    items: List[ImageChange] # The latest change of each image changed since the cursor
+    cursor: str # Opaque; pass back as ?since= to get the changes after this page
+    has_more: bool
+
+class SearchPage(ImagePage):
+    total: int # Number of matching images (a lower bound when truncated)
+    truncated: bool = False # A query word matched more than SEARCH_MAX_POSTINGS images; some matches are missing
@@ -0,0 +1,206 @@
+import hashlib
+import hmac
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+from app.config import settings
+
+ALGORITHM = "AWS4-HMAC-SHA256"
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+
+
+@dataclass(frozen=True)
+class SigningCredentials:
+    access_key: str
+    secret_key: str
+    token: Optional[str] = None
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+def _quote(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+
+class UrlSigner:
+    """
+    Builds SigV4 presigned S3 GET URLs locally.
+
+    Presigning is pure HMAC work: the derived signing key only changes once a
+    day, so it is cached and every URL costs two SHA-256 digests and one HMAC.
+    No client or network call is involved once credentials are known.
+    """
+
+    def __init__(self, credentials: SigningCredentials, region: str,
+                 endpoint_url: Optional[str] = None):
+        self.credentials = credentials
+        self.region = region
+        self.endpoint_url = endpoint_url.rstrip("/") if endpoint_url else None
+        self._signing_key: Optional[Tuple[str, bytes]] = None
+
+    def _key_for(self, datestamp: str) -> bytes:
+        cached = self._signing_key
+        if cached is not None and cached[0] == datestamp:
+            return cached[1]
+        key = _hmac(("AWS4" + self.credentials.secret_key).encode("utf-8"), datestamp)
+        key = _hmac(key, self.region)
+        key = _hmac(key, "s3")
+        key = _hmac(key, "aws4_request")
+        self._signing_key = (datestamp, key)
+        return key
+
+    def _location(self, bucket: str, key: str) -> Tuple[str, str, str]:
+        """Returns (scheme://host, host, canonical path) for the object."""
+        encoded_key = _quote(key, safe="/~")
+        if self.endpoint_url:
+            # Custom endpoints (LocalStack) are addressed path-style
+            parts = urlsplit(self.endpoint_url)
+            return f"{parts.scheme}://{parts.netloc}", parts.netloc, f"{parts.path}/{bucket}/{encoded_key}"
+        if self.region == "us-east-1":
+            host = "s3.amazonaws.com"
+        else:
+            host = f"s3.{self.region}.amazonaws.com"
+        if "." in bucket:
+            return f"https://{host}", host, f"/{bucket}/{encoded_key}"
+        host = f"{bucket}.{host}"
+        return f"https://{host}", host, f"/{encoded_key}"
+
+    def presign_get(self, bucket: str, key: str, expires_in: int,
+                    now: Optional[datetime] = None) -> str:
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        datestamp = amz_date[:8]
+        scope = f"{datestamp}/{self.region}/s3/aws4_request"
+        base, host, path = self._location(bucket, key)
+
+        params = {
+            "X-Amz-Algorithm": ALGORITHM,
+            "X-Amz-Credential": f"{self.credentials.access_key}/{scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expires_in),
+            "X-Amz-SignedHeaders": "host",
+        }
+        if self.credentials.token:
+            params["X-Amz-Security-Token"] = self.credentials.token
+        query = "&".join(f"{_quote(k)}={_quote(v)}" for k, v in sorted(params.items()))
+
+        canonical_request = f"GET\n{path}\n{query}\nhost:{host}\n\nhost\n{UNSIGNED_PAYLOAD}"
+        string_to_sign = (f"{ALGORITHM}\n{amz_date}\n{scope}\n"
+                          f"{hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()}")
+        signature = hmac.new(self._key_for(datestamp), string_to_sign.encode("utf-8"),
+                             hashlib.sha256).hexdigest()
+        return f"{base}{path}?{query}&X-Amz-Signature={signature}"
+
+
+class PresignedUrlCache:
+    """
+    In-memory cache of presigned URLs keyed by (bucket, key).
+
+    A URL is reused until `margin` seconds before it expires, so callers always
+    receive a link that stays valid for at least that long.
+    """
+
+    def __init__(self, max_entries: int, margin: int):
+        self.max_entries = max_entries
+        self.margin = margin
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+
+    def get(self, bucket: str, key: str, now: Optional[float] = None) -> Optional[str]:
+        entry = self._entries.get((bucket, key))
+        if entry is None:
+            return None
+        url, expires_at = entry
+        if (now or time.time()) >= expires_at - self.margin:
+            del self._entries[(bucket, key)]
+            return None
+        return url
+
+    def put(self, bucket: str, key: str, url: str, expires_at: float):
+        entries = self._entries
+        entries[(bucket, key)] = (url, expires_at)
+        entries.move_to_end((bucket, key))
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PresignService:
+    """
+    Process-wide presigning context: one signer built from the AWS session's
+    credentials (re-read every PRESIGN_CREDENTIALS_TTL seconds, and as soon as
+    temporary credentials are due for a refresh) plus the URL cache.
+    """
+
+    def __init__(self):
+        self.cache = PresignedUrlCache(settings.PRESIGN_CACHE_MAX_ENTRIES,
+                                       settings.PRESIGN_CACHE_MARGIN)
+        self._signer: Optional[UrlSigner] = None
+        self._signer_expires = 0.0
+
+    async def signer(self, credentials) -> UrlSigner:
+        """
+        The signer for `credentials`, the session's (aio)botocore Credentials.
+        Refreshable ones renew themselves in get_frozen_credentials().
+        """
+        if credentials is None:
+            raise RuntimeError("No AWS credentials to presign with")
+        refresh_needed = getattr(credentials, "refresh_needed", None)
+        if (self._signer is None or time.monotonic() >= self._signer_expires
+                or (refresh_needed is not None and refresh_needed())):
+            frozen = await credentials.get_frozen_credentials()
+            signing = SigningCredentials(frozen.access_key, frozen.secret_key, frozen.token)
+            if self._signer is None or self._signer.credentials != signing:
+                # URLs signed with rotated (temporary) credentials may stop working early
+                self.cache.clear()
+                self._signer = UrlSigner(signing, settings.AWS_REGION, settings.aws_endpoint)
+            self._signer_expires = time.monotonic() + settings.PRESIGN_CREDENTIALS_TTL
+        return self._signer
+
+    def window(self, wall: Optional[float] = None) -> Tuple[float, float]:
+        """
+        Returns (signing time, reuse deadline) for URLs handed out at `wall`.
+
+        With PRESIGN_WINDOW set, URLs are signed as of the start of the current
+        window and reused until it ends, so they are byte-identical for every
+        request in it. The window never exceeds the URL lifetime minus the
+        cache margin, so a URL still has that long to live when it is replaced.
+        """
+        wall = time.time() if wall is None else wall
+        lifetime = settings.PRESIGN_EXPIRES_IN - self.cache.margin
+        size = min(settings.PRESIGN_WINDOW, lifetime)
+        if size <= 0:
+            return wall, wall + lifetime
+        start = wall - wall % size
+        return start, start + size
+
+    def sign_many(self, signer: UrlSigner, bucket: str,
+                  filenames: Iterable[str]) -> Dict[str, str]:
+        expires_in = settings.PRESIGN_EXPIRES_IN
+        wall = time.time()
+        signed_at, reuse_until = self.window(wall)
+        now = datetime.fromtimestamp(signed_at, timezone.utc)
+        urls = {}
+        for filename in filenames:
+            if filename in urls:
+                continue
+            url = self.cache.get(bucket, filename, wall)
+            if url is None:
+                url = signer.presign_get(bucket, filename, expires_in, now)
+                # Dropped from the cache when the window closes
+                self.cache.put(bucket, filename, url, reuse_until + self.cache.margin)
+            urls[filename] = url
+        return urls
+
+
+presigner = PresignService()
@@ -0,0 +1,147 @@
+"""
+Header-only image probing: dimensions, format, EXIF orientation and capture
+time, read from the first bytes of an image without decoding its pixels.
+
+Backfill images stored before probing existed (ranged GETs, no full
+downloads):
+
+    python -m app.probe [--concurrency 16] [--force]
+"""
+import io
+from datetime import datetime
+from typing import Optional
+
+from app.config import settings
+from app.models import ImageInfo, ImageMetadata
+
+EXIF_IFD = 0x8769
+ORIENTATION = 0x0112
+DATETIME = 0x0132
+DATETIME_ORIGINAL = 0x9003
+
+
+class NeedMoreBytes(Exception):
+    """The header did not fit into the bytes given."""
+
+
+def _capture_time(exif) -> Optional[str]:
+    value = exif.get_ifd(EXIF_IFD).get(DATETIME_ORIGINAL) or exif.get(DATETIME)
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip("\x00 "), "%Y:%m:%d %H:%M:%S").isoformat()
+    except ValueError:
+        return None
+
+
+def probe(head: bytes, complete: bool = False) -> Optional[ImageInfo]:
+    """
+    Parses the image header in `head` (the first bytes of the object, or all
+    of it when `complete`). Pillow's open() only reads up to the frame
+    header, so no pixels are decoded. Returns None for data that is not a
+    recognizable image; raises NeedMoreBytes when the header is cut off.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(head)) as image:
+            # Image.getexif() may load the pixels (PNG); the raw block from the header is enough
+            exif = Image.Exif()
+            if image.info.get("exif"):
+                exif.load(image.info["exif"])
+            orientation = exif.get(ORIENTATION, 1)
+            return ImageInfo(width=image.width, height=image.height, format=image.format,
+                             orientation=orientation if orientation in range(1, 9) else 1,
+                             taken_at=_capture_time(exif))
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError, EOFError):
+        # Not an image, or its header runs past the bytes we have
+        if complete:
+            return None
+        raise NeedMoreBytes()
+
+
+def probe_prefix(head: bytes, total_size: Optional[int]) -> Optional[ImageInfo]:
+    """probe() for a prefix read at upload time; a too-short prefix counts as unknown."""
+    complete = total_size is not None and len(head) >= total_size
+    try:
+        return probe(head, complete=complete)
+    except NeedMoreBytes:
+        return None
+
+
+async def probe_object(storage, key: str) -> Optional[ImageInfo]:
+    """
+    Probes a stored object with ranged GETs, starting with PROBE_HEADER_BYTES
+    and doubling up to PROBE_MAX_BYTES while the header is cut off.
+    """
+    length = settings.PROBE_HEADER_BYTES
+    while True:
+        head, size = await storage.get_range(key, 0, length - 1)
+        complete = len(head) >= size
+        try:
+            return probe(head, complete=complete or length >= settings.PROBE_MAX_BYTES)
+        except NeedMoreBytes:
+            length *= 2
+
+
+async def backfill(concurrency: int, force: bool = False) -> int:
+    """Probes every ready image without info (or all of them with `force`); returns the count updated."""
+    from boto3.dynamodb.conditions import Attr
+    from app.cache import metadata_cache
+    from app.clients import clients
+    from app.schema import IMAGE_ENTITY
+    from app.services import DatabaseService, StorageService, gather_bounded
+
+    table = await clients.table()
+    db = DatabaseService(table, metadata_cache)
+    storage = StorageService(await clients.s3())
+    condition = Attr('entity').begins_with(IMAGE_ENTITY)
+    if not force:
+        condition = condition & Attr('info').not_exists()
+    updated = 0
+
+    async def process(item: dict):
+        nonlocal updated
+        image = ImageMetadata(**item)
+        if image.status != "ready":
+            return
+        try:
+            info = await probe_object(storage, image.filename)
+        except Exception as e:
+            print(f"Could not probe {image.id}: {e}")
+            return
+        if info is not None and await db.save_info(image, info):
+            updated += 1
+
+    kwargs = {'FilterExpression': condition}
+    while True:
+        response = await table.scan(**kwargs)
+        await gather_bounded((process(item) for item in response.get('Items', [])), concurrency)
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return updated
+
+
+def main():
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Record dimensions/EXIF info for existing images")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--force", action="store_true", help="re-probe images that already have info")
+    args = parser.parse_args()
+
+    async def run():
+        from app.clients import clients
+        try:
+            count = await backfill(args.concurrency, args.force)
+        finally:
+            await clients.close()
+        print(f"Updated {count} images")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import asyncio
+import io
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException
+from app.config import settings, RenditionSpec
+from app.models import ImageMetadata, Rendition
+
+CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg", "PNG": "png"}
+
+
+def rendition_key(image_id: str, name: str, spec: RenditionSpec) -> str:
+    return f"renditions/{image_id}/{name}.{EXTENSIONS[spec.format.upper()]}"
+
+
+def rendition_keys(image: ImageMetadata) -> list[str]:
+    """Every derived key an image may have: recorded ones plus the configured ones."""
+    keys = {rendition.filename for rendition in image.renditions.values()}
+    keys.update(rendition_key(image.id, name, spec) for name, spec in settings.RENDITIONS.items())
+    return sorted(keys)
+
+
+def render(body: bytes, size: int, image_format: str, quality: int) -> tuple[bytes, int, int]:
+    """
+    Resizes an image so its longest edge is at most `size` and re-encodes it.
+    Runs in a worker process, so it only takes and returns plain values.
+    """
+    from PIL import Image, ImageOps
+
+    image_format = image_format.upper()
+    with Image.open(io.BytesIO(body)) as original:
+        # Let the JPEG decoder downscale by up to 8x while decoding
+        original.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if image_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA")
+        out = io.BytesIO()
+        image.save(out, format=image_format, quality=quality, optimize=True)
+    return out.getvalue(), image.width, image.height
+
+
+class RenditionService:
+    """
+    Generates, stores and records derived renditions of an image.
+
+    Resizing is CPU-bound, so it runs in a process pool and never blocks the
+    event loop. Lambda has no /dev/shm for multiprocessing, so there (or if a
+    pool cannot be created) a thread pool is used instead; Pillow releases the
+    GIL while resizing and encoding. Concurrent requests for the same missing
+    rendition share a single generation.
+    """
+
+    def __init__(self):
+        self._executor: Optional[Executor] = None
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if settings.is_lambda:
+                self._executor = ThreadPoolExecutor(max_workers=settings.RENDITION_WORKERS)
+            else:
+                try:
+                    self._executor = ProcessPoolExecutor(max_workers=settings.RENDITION_WORKERS)
+                except (OSError, NotImplementedError) as e:
+                    print(f"Process pool unavailable ({e}), rendering in threads")
+                    self._executor = ThreadPoolExecutor(max_workers=settings.RENDITION_WORKERS)
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def ensure(self, image: ImageMetadata, names: list[str], storage, db) -> ImageMetadata:
+        """
+        Makes sure the named renditions exist, generating the missing ones from
+        the original, and returns the image with them recorded.
+        """
+        missing = [name for name in names if name not in image.renditions]
+        if not missing:
+            return image
+        image = await db.refresh_metadata(image)
+        missing = [name for name in names if name not in image.renditions]
+        if not missing:
+            return image
+
+        tasks = {}
+        todo = []
+        for name in missing:
+            task = self._inflight.get(f"{image.id}:{name}")
+            if task is None:
+                todo.append(name)
+            else:
+                tasks[name] = task
+        if todo:
+            task = asyncio.ensure_future(self._generate(image, todo, storage, db))
+            keys = [f"{image.id}:{name}" for name in todo]
+            for name, key in zip(todo, keys):
+                self._inflight[key] = task
+                tasks[name] = task
+            task.add_done_callback(lambda _: [self._inflight.pop(key, None) for key in keys])
+
+        generated = {}
+        for result in await asyncio.gather(*(asyncio.shield(task) for task in set(tasks.values()))):
+            generated.update(result)
+        image.renditions = {**image.renditions, **{name: generated[name] for name in missing}}
+        return image
+
+    async def _generate(self, image: ImageMetadata, names: list[str], storage, db) -> dict[str, Rendition]:
+        body = await storage.get_file(image.filename, max_size=settings.RENDITION_MAX_SOURCE_SIZE)
+        loop = asyncio.get_running_loop()
+
+        async def make(name: str) -> tuple[str, Rendition]:
+            spec = settings.RENDITIONS[name]
+            try:
+                data, width, height = await loop.run_in_executor(
+                    self.executor(), render, body, spec.size, spec.format, spec.quality)
+            except BrokenExecutor as e:
+                # A worker died (e.g. out of memory); start a fresh pool next time
+                self.close()
+                raise HTTPException(status_code=500, detail=f"Rendition worker failed: {e}")
+            except Exception as e:
+                raise HTTPException(status_code=422, detail=f"Cannot render image: {e}")
+            key = rendition_key(image.id, name, spec)
+            content_type = CONTENT_TYPES[spec.format.upper()]
+            await storage.put_file(key, data, content_type)
+            return name, Rendition(filename=key, content_type=content_type,
+                                   width=width, height=height, size=len(data))
+
+        generated = dict(await asyncio.gather(*(make(name) for name in names)))
+        if not await db.save_renditions(image, generated):
+            # The image was deleted meanwhile; don't leave its renditions behind
+            await storage.delete_files([rendition.filename for rendition in generated.values()])
+            raise HTTPException(status_code=404, detail="Image not found")
+        return generated
+
+    async def generate_in_background(self, image: ImageMetadata, storage, db):
+        """Background-task variant of ensure(): failures are logged, not raised."""
+        if not image.content_type.startswith("image/"):
+            return
+        try:
+            await self.ensure(image, list(settings.RENDITIONS), storage, db)
+        except HTTPException as e:
+            print(f"Could not generate renditions for {image.id}: {e.detail}")
+        except Exception as e:
+            print(f"Could not generate renditions for {image.id}: {e}")
+
+
+renditions = RenditionService()
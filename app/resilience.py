@@ -0,0 +1,462 @@
+import asyncio
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi import HTTPException
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+from app.config import settings
+from app.metrics import registry
+
+# Error codes AWS uses to push back on request rate
+THROTTLING_CODES = {"Throttling", "ThrottlingException", "ThrottledException", "RequestThrottledException",
+                    "TooManyRequestsException", "ProvisionedThroughputExceededException",
+                    "TransactionInProgressException", "RequestLimitExceeded", "BandwidthLimitExceeded",
+                    "LimitExceededException", "RequestThrottled", "SlowDown", "PriorRequestNotComplete",
+                    "EC2ThrottledException"}
+TRANSIENT_CODES = {"RequestTimeout", "RequestTimeoutException", "PriorRequestNotComplete", "InternalError",
+                   "InternalServerError", "ServiceUnavailable"}
+
+# Retry budget costs, as in botocore's standard retry quota
+RETRY_COST = 5
+TIMEOUT_RETRY_COST = 10
+NO_RETRY_INCREMENT = 1
+
+resilience_retries = registry.counter("testagram_aws_resilience_retries_total",
+                                      "AWS API calls retried by the resilience layer, by reason")
+resilience_rejections = registry.counter("testagram_aws_resilience_rejected_total",
+                                         "AWS API calls failed fast (open circuit, retry budget, deadline)")
+rate_limit_wait = registry.histogram("testagram_aws_rate_limit_wait_seconds",
+                                     "Time AWS API calls waited for the client-side rate limiter")
+
+
+class DependencyUnavailable(HTTPException):
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(status_code=503, detail=f"{service} is unavailable, retry later",
+                         headers={"Retry-After": str(max(1, round(retry_after)))})
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self, detail: str = "Request deadline exceeded"):
+        super().__init__(status_code=504, detail=detail)
+
+
+def error_code(error: BaseException) -> str:
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code", "")
+    return ""
+
+
+def _throttling(code: str, status: int) -> bool:
+    return code in THROTTLING_CODES or status == 429
+
+
+def _transient(code: str, status: int) -> bool:
+    return code in TRANSIENT_CODES or (status >= 500 and not _throttling(code, status))
+
+
+def is_throttling(error: BaseException) -> bool:
+    if not isinstance(error, ClientError):
+        return False
+    return _throttling(error_code(error), error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0)
+
+
+def is_transient(error: BaseException) -> bool:
+    """Errors worth retrying that mean the dependency itself is failing (not throttling)."""
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        return _transient(error_code(error), error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0)
+    return False
+
+
+# --- Deadlines ------------------------------------------------------------
+
+class Deadline:
+    def __init__(self, at: Optional[float]):
+        self.at = at # time.monotonic() value, or None for no deadline
+
+    def remaining(self) -> Optional[float]:
+        return None if self.at is None else self.at - time.monotonic()
+
+
+_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left until the current request's deadline, or None outside a request."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline.remaining()
+
+
+@contextmanager
+def request_deadline(seconds: float):
+    """Applies a deadline to the AWS calls made inside the block (e.g. a worker invocation)."""
+    token = _deadline.set(Deadline(time.monotonic() + seconds))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class DeadlineMiddleware:
+    """
+    Pure ASGI middleware giving every request a deadline of REQUEST_DEADLINE
+    seconds, capped by the remaining Lambda time (minus LAMBDA_DEADLINE_MARGIN)
+    so retries never run into the function timeout. Outside Lambda the
+    deadline is lifted once the response is sent, so background tasks may
+    run longer; under Lambda they still have to finish within the invocation.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        budget = settings.REQUEST_DEADLINE
+        context = scope.get("aws.context")
+        if context is not None:
+            lambda_remaining = context.get_remaining_time_in_millis() / 1000 - settings.LAMBDA_DEADLINE_MARGIN
+            budget = min(budget, lambda_remaining) if budget else lambda_remaining
+        deadline = Deadline(time.monotonic() + budget if budget else None)
+        token = _deadline.set(deadline)
+
+        async def send_wrapper(message):
+            if (message["type"] == "http.response.body" and not message.get("more_body", False)
+                    and context is None):
+                deadline.at = None
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _deadline.reset(token)
+
+
+# --- Building blocks ------------------------------------------------------
+
+class RetryBudget:
+    """
+    Token bucket shared by all AWS calls of the process: every retry withdraws
+    tokens and successful calls pay a little back, so during an outage retries
+    stop quickly instead of multiplying the load.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.tokens = capacity
+
+    def withdraw(self, cost: int) -> bool:
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    def deposit(self, amount: int):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    Client-side token bucket (rate per second, with a burst allowance),
+    scheduled without locks: each caller reserves the next free slot and
+    sleeps until it. A rate of 0 means unlimited.
+
+    In adaptive mode the rate follows the table's actual capacity: a throttle
+    halves it (starting from the recently observed request rate when it was
+    unlimited; at most once a second) and every second it grows back by 10%,
+    up to the configured rate if there is one.
+    """
+
+    MIN_RATE = 1.0
+
+    def __init__(self, rate: float, burst: float, adaptive: bool = False):
+        self.rate = rate
+        self.max_rate = rate
+        self.burst = burst
+        self.adaptive = adaptive
+        self._next_free = 0.0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._observed_rate = 0.0
+        self._adjusted_at = 0.0
+        self._decreased_at = 0.0
+        self._ceiling = 0.0
+
+    def _observe(self, now: float):
+        if now - self._window_start >= 1.0:
+            self._observed_rate = self._window_count / (now - self._window_start)
+            self._window_start, self._window_count = now, 0
+        self._window_count += 1
+
+    def _recover(self, now: float):
+        steps = int(now - self._adjusted_at)
+        if steps <= 0 or self.rate == self.max_rate:
+            return
+        self._adjusted_at += steps
+        self.rate *= 1.1 ** min(steps, 100)
+        if self.max_rate:
+            self.rate = min(self.rate, self.max_rate)
+        elif self.rate >= self._ceiling:
+            # Well past the rate that was throttled: unlimited again
+            self.rate = 0.0
+
+    def reserve(self) -> float:
+        """Takes a slot and returns how long to wait for it."""
+        now = time.monotonic()
+        self._observe(now)
+        if self.adaptive and self.rate:
+            self._recover(now)
+        if not self.rate:
+            return 0.0
+        interval = 1.0 / self.rate
+        start = max(self._next_free, now - self.burst * interval)
+        self._next_free = start + interval
+        return max(0.0, start - now)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if not self.adaptive or now - self._decreased_at < 1.0:
+            return
+        current = self.rate or max(self._observed_rate, self._window_count, self.MIN_RATE)
+        if not self.rate:
+            self._ceiling = current * 2
+        self.rate = max(self.MIN_RATE, current / 2)
+        self._adjusted_at = self._decreased_at = now
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a dependency fast after CIRCUIT_FAILURE_THRESHOLD
+    consecutive failures. After CIRCUIT_RESET_TIMEOUT seconds one trial call
+    is let through (half-open); its outcome closes or re-opens the circuit.
+    Throttling and client errors do not count as failures, and neither do
+    calls cut short by the caller's deadline.
+    """
+
+    def __init__(self, name: str, threshold: int, reset_timeout: float):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self) -> bool:
+        """Raises DependencyUnavailable while open; returns True for the half-open trial call."""
+        state = self.state
+        if state == "closed":
+            return False
+        now = time.monotonic()
+        # A trial that never reported back (e.g. cancelled) is given up after reset_timeout
+        if state == "half_open" and (self._trial_started is None or now - self._trial_started > self.reset_timeout):
+            self._trial_started = now
+            return True
+        resilience_rejections.inc(service=self.name, reason="circuit_open")
+        raise DependencyUnavailable(self.name, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def release(self, trial: bool):
+        """Ends a call without an outcome (the caller gave up), freeing the trial slot."""
+        if trial:
+            self._trial_started = None
+
+    def record(self, success: bool, trial: bool):
+        if trial:
+            self._trial_started = None
+        if success:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if trial or self.failures >= self.threshold:
+            if self.opened_at is None or trial:
+                print(f"Circuit for {self.name} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+# --- Client hooks ---------------------------------------------------------
+
+def _table_names(params: dict) -> list[str]:
+    if "TableName" in params:
+        return [params["TableName"]]
+    items = params.get("RequestItems") or {}
+    return sorted(items) if isinstance(items, dict) else []
+
+
+def _response_error(http_response, parsed) -> tuple[str, int]:
+    return parsed.get("Error", {}).get("Code", ""), http_response.status_code
+
+
+class Resilience:
+    """
+    Retry, rate limiting, circuit breaking and deadlines for the shared AWS
+    clients. attach() registers botocore event hooks on a client, so
+    everything going through StorageService, DatabaseService (including
+    Table resources and batch writers) and s3transfer is covered without
+    touching the callers:
+
+    - before-call: fails fast while the circuit is open or the deadline has
+      passed, and waits for the per-table rate limiters;
+    - needs-retry: decides on retries and their backoff (botocore sleeps and
+      re-sends), drawing on the retry budget and never past the deadline;
+    - after-call / after-call-error: record the final outcome for the
+      circuit breaker and pay the retry budget back.
+
+    A request already in flight is bounded by AWS_READ_TIMEOUT rather than
+    the deadline; the deadline is checked before every attempt and backoff.
+
+    AWS_RETRY_MODE "standard" retries throttling and transient errors with
+    jittered exponential backoff, drawing on a shared retry budget;
+    "adaptive" additionally adapts the per-table rate limiters to
+    throttling; "botocore" leaves retries to botocore (rate limits, breakers
+    and deadlines still apply).
+    """
+
+    def __init__(self):
+        self.budget = RetryBudget(settings.AWS_RETRY_BUDGET)
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.limiters: dict[str, RateLimiter] = {}
+
+    @property
+    def handles_retries(self) -> bool:
+        return settings.AWS_RETRY_MODE != "botocore"
+
+    def breaker(self, service: str) -> CircuitBreaker:
+        breaker = self.breakers.get(service)
+        if breaker is None:
+            breaker = self.breakers[service] = CircuitBreaker(service, settings.CIRCUIT_FAILURE_THRESHOLD,
+                                                              settings.CIRCUIT_RESET_TIMEOUT)
+        return breaker
+
+    def limiter(self, table: str) -> RateLimiter:
+        limiter = self.limiters.get(table)
+        if limiter is None:
+            limiter = self.limiters[table] = RateLimiter(settings.DYNAMODB_MAX_RPS, settings.DYNAMODB_BURST,
+                                                         adaptive=settings.AWS_RETRY_MODE == "adaptive")
+        return limiter
+
+    def attach(self, client):
+        """Registers the resilience hooks on an aiobotocore client (its retries should be off, see clients)."""
+        events = client.meta.events
+        events.register("before-parameter-build", self._before_parameter_build,
+                        unique_id="testagram-resilience-params")
+        events.register("before-call", self._before_call, unique_id="testagram-resilience-before")
+        events.register("needs-retry", self._needs_retry, unique_id="testagram-resilience-retry")
+        events.register("after-call", self._after_call, unique_id="testagram-resilience-after")
+        events.register("after-call-error", self._after_call_error, unique_id="testagram-resilience-error")
+
+    def _pace(self, tables: list[str]) -> float:
+        """Reserves a slot with the rate limiter of every table; returns how long to wait for them."""
+        delay = 0.0
+        for table in tables:
+            wait = self.limiter(table).reserve()
+            if wait:
+                rate_limit_wait.observe(wait, table=table)
+                delay = max(delay, wait)
+        return delay
+
+    def _check_deadline(self, delay: float, service: str, operation_name: str):
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            resilience_rejections.inc(service=service, reason="deadline")
+            raise DeadlineExceeded(f"{operation_name} would exceed the request deadline")
+
+    def _before_parameter_build(self, params, model, context, **kwargs):
+        if model.service_model.service_name == "dynamodb":
+            context["resilience_tables"] = _table_names(params)
+
+    async def _before_call(self, model, context, **kwargs):
+        service = context["resilience_service"] = model.service_model.service_name
+        breaker = self.breaker(service)
+        trial = context["resilience_trial"] = breaker.before_call()
+        try:
+            delay = self._pace(context.get("resilience_tables", []))
+            self._check_deadline(delay, service, model.name)
+            if delay:
+                await asyncio.sleep(delay)
+        except BaseException:
+            # Not sent, so nothing learned about the dependency
+            breaker.release(trial)
+            raise
+
+    def _needs_retry(self, response, caught_exception, attempts, operation, request_dict, **kwargs):
+        if not self.handles_retries:
+            return None
+        if caught_exception is not None:
+            throttled, transient = is_throttling(caught_exception), is_transient(caught_exception)
+        elif response is not None and response[0].status_code >= 300:
+            code, status = _response_error(*response)
+            throttled, transient = _throttling(code, status), _transient(code, status)
+        else:
+            return None
+
+        context = request_dict["context"]
+        service = operation.service_model.service_name
+        tables = context.get("resilience_tables", [])
+        if throttled:
+            for table in tables:
+                self.limiter(table).on_throttle()
+        if not (throttled or transient) or attempts >= settings.AWS_MAX_ATTEMPTS:
+            return None
+        timed_out = isinstance(caught_exception, (BotoConnectionError, HTTPClientError))
+        cost = TIMEOUT_RETRY_COST if timed_out else RETRY_COST
+        if not self.budget.withdraw(cost):
+            resilience_rejections.inc(service=service, reason="retry_budget")
+            return None
+        context["resilience_retry_cost"] = context.get("resilience_retry_cost", 0) + cost
+        resilience_retries.inc(service=service, operation=operation.name,
+                               reason="throttling" if throttled else "transient")
+        delay = random.uniform(0, min(settings.AWS_RETRY_MAX_DELAY,
+                                      settings.AWS_RETRY_BASE_DELAY * 2 ** (attempts - 1)))
+        delay = max(delay, self._pace(tables))
+        # Raised out of the call; after-call-error releases the breaker
+        self._check_deadline(delay, service, operation.name)
+        return delay
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        if "resilience_trial" not in context:
+            return
+        breaker = self.breaker(model.service_model.service_name)
+        trial = context["resilience_trial"]
+        if http_response.status_code < 300:
+            self.budget.deposit(context.get("resilience_retry_cost") or NO_RETRY_INCREMENT)
+            breaker.record(success=True, trial=trial)
+        else:
+            # Throttling and client errors mean the dependency is up
+            breaker.record(success=not _transient(*_response_error(http_response, parsed)), trial=trial)
+
+    def _after_call_error(self, exception, context, **kwargs):
+        if "resilience_trial" not in context:
+            return
+        breaker = self.breaker(context["resilience_service"])
+        if isinstance(exception, DeadlineExceeded):
+            # The caller ran out of time; that says nothing about the dependency
+            breaker.release(context["resilience_trial"])
+        else:
+            breaker.record(success=not is_transient(exception), trial=context["resilience_trial"])
+
+    def collect(self):
+        states = {"closed": 0, "half_open": 1, "open": 2}
+        return [
+            ("testagram_aws_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", "gauge",
+             {(("service", name),): states[breaker.state] for name, breaker in self.breakers.items()}),
+            ("testagram_aws_retry_budget_tokens", "Tokens left in the shared retry budget", "gauge",
+             {(): self.budget.tokens}),
+            ("testagram_dynamodb_rate_limit", "Client-side request rate limit per table (0 = unlimited)", "gauge",
+             {(("table", name),): limiter.rate for name, limiter in self.limiters.items()}),
+        ]
+
+
+resilience = Resilience()
+registry.add_collector(resilience.collect)
@@ -1,38 +1,301 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Query
-from app.services import StorageService, DatabaseService
-from app.models import ImageMetadata, ImageCreate, ImageFilter
-from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Form, Depends, HTTPException, Query, Request, Header, Response
+from app.services import StorageService, DatabaseService, gather_bounded, hash_upload
+from app.clients import clients
+from app.cache import metadata_cache
+from app.facets import facet_cache
+from app.similarity import similarity_index, compute_hash, hash_image, hash_in_background
+from app.renditions import renditions, rendition_keys
+from app.jobs import job_queue, enqueue_processing
+from app.probe import probe_prefix, probe_object
+from app.http_cache import cached_response
+from app.download import stream_object
+from app.changes import encode_position, decode_position
+from app.models import (ImageMetadata, ImageInfo, ImageCreate, ImageFilter, ImagePage, SearchPage, UploadRequest, UploadTicket,
+                        BatchRequest, BatchItemResult, BatchResponse, SimilarImage, SimilarImages, FacetCount, Facets,
+                        ImageChange, ChangePage)
+from app.config import settings
+from typing import Awaitable, Callable, List, Optional
+import asyncio
+import hashlib
+import json
 import uuid
 from datetime import datetime
 
 router = APIRouter(prefix="/images", tags=["images"])
 
-# Dependency Injection for services
+# Dependency Injection for services (backed by the process-wide pooled clients)
 async def get_storage_service():
-    return StorageService()
+    return StorageService(await clients.s3())
 
 async def get_db_service():
-    return DatabaseService()
+    return DatabaseService(await clients.table(), metadata_cache, similarity_index, facet_cache)
+
+async def finalize_upload(metadata: ImageMetadata, storage: StorageService,
+                          db: DatabaseService) -> ImageMetadata:
+    """
+    Saves the metadata and signs the download URL concurrently once the object
+    is in S3. If the metadata write fails the object is removed again (or its
+    dedup reference dropped), so a failed upload never leaves an orphan behind.
+    """
+    if job_queue() is not None:
+        metadata.processing = "queued"
+    saved, url = await asyncio.gather(db.save_metadata(metadata),
+                                      storage.generate_presigned_url(metadata.filename),
+                                      return_exceptions=True)
+    if isinstance(saved, BaseException):
+        try:
+            await release_object(metadata, storage, db)
+        except Exception as e:
+            print(f"Failed to remove orphaned object {metadata.filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to save metadata: {saved}")
+
+    metadata.download_url = None if isinstance(url, BaseException) else url
+    return metadata
+
+async def read_info(file: UploadFile) -> Optional[ImageInfo]:
+    """Probes the upload's header (its first PROBE_HEADER_BYTES); the file is rewound afterwards."""
+    head = await file.read(settings.PROBE_HEADER_BYTES)
+    await file.seek(0)
+    return probe_prefix(head, file.size)
+
+async def read_phash(file: UploadFile) -> Optional[str]:
+    """Perceptual hash of an uploaded image (decoded in the worker pool); the file is rewound afterwards."""
+    if not (file.content_type or "").startswith("image/") or (file.size or 0) > settings.RENDITION_MAX_SOURCE_SIZE:
+        return None
+    body = await file.read()
+    await file.seek(0)
+    return await compute_hash(body)
+
+async def reject_near_duplicate(metadata: ImageMetadata, db: DatabaseService):
+    """Refuses an upload within NEAR_DUPLICATE_DISTANCE bits of a stored image, before anything is stored."""
+    if settings.NEAR_DUPLICATE_DISTANCE is None or metadata.phash is None:
+        return
+    similar = await db.find_similar(metadata.phash, settings.NEAR_DUPLICATE_DISTANCE, limit=1)
+    if similar:
+        raise HTTPException(status_code=409, detail=f"Near-duplicate of image {similar[0][0].id}")
+
+async def release_object(image: ImageMetadata, storage: StorageService, db: DatabaseService):
+    """Deletes the image's object, or drops its reference if the object is shared (dedup)."""
+    if image.blob_hash is None or await db.release_blob(image.blob_hash, image.filename):
+        await storage.delete_file(image.filename)
+
+async def upload_deduplicated(file: UploadFile, metadata: ImageMetadata,
+                              storage: StorageService, db: DatabaseService):
+    """
+    Stores an upload through the dedup index: content that is already stored
+    only gains a reference (no PUT), anything new is uploaded and indexed.
+    """
+    metadata.content_hash = await hash_upload(file)
+    shared = await db.acquire_blob(metadata.content_hash)
+    if shared is not None:
+        metadata.filename = shared
+        metadata.blob_hash = metadata.content_hash
+        return
+    await storage.upload_file(file, metadata.filename)
+    await index_uploaded(metadata, storage, db)
+
+async def index_uploaded(metadata: ImageMetadata, storage: StorageService, db: DatabaseService):
+    """
+    Registers an uploaded object under its content hash. If the same content
+    was indexed concurrently, the image joins that object and its own copy is
+    removed. After a few lost races the image simply keeps its own object.
+    """
+    for _ in range(3):
+        if await db.register_blob(metadata.content_hash, metadata.filename, metadata.size):
+            metadata.blob_hash = metadata.content_hash
+            return
+        shared = await db.acquire_blob(metadata.content_hash)
+        if shared is not None:
+            try:
+                await storage.delete_file(metadata.filename)
+            except Exception as e:
+                print(f"Failed to remove duplicate object {metadata.filename}: {e}")
+            metadata.filename = shared
+            metadata.blob_hash = metadata.content_hash
+            return
+    print(f"Could not index {metadata.filename}, stored without dedup")
+
+async def remove_image(image: ImageMetadata, storage: StorageService, db: DatabaseService):
+    """
+    Deletes the S3 object and the metadata row concurrently.
+
+    If the row delete fails it is retried once; the object delete is idempotent,
+    so a later DELETE can always finish the job. If the object delete fails the
+    row is put back, so the image stays visible instead of leaking an object
+    nobody references.
+
+    A shared (deduplicated) object is only released once the row is gone, so
+    a row never points at an object that may have been deleted.
+    """
+    if image.blob_hash is not None:
+        await remove_shared_image(image, storage, db)
+        return
+
+    s3_error, db_error = await asyncio.gather(storage.delete_file(image.filename),
+                                              db.delete_metadata(image.id),
+                                              return_exceptions=True)
+    if db_error is not None:
+        try:
+            await db.delete_metadata(image.id)
+            db_error = None
+        except Exception as e:
+            db_error = e
+
+    if s3_error is not None:
+        if db_error is None:
+            try:
+                if image.status == "pending":
+                    await db.save_pending(image)
+                else:
+                    await db.save_metadata(image)
+            except Exception as e:
+                print(f"Failed to restore metadata for {image.id}: {e}")
+        if isinstance(s3_error, HTTPException):
+            raise s3_error
+        raise HTTPException(status_code=500, detail=f"S3 Delete Failed: {s3_error}")
+
+    if db_error is not None:
+        raise HTTPException(status_code=500, detail=f"Metadata delete failed, retry the delete: {db_error}")
+
+    await remove_renditions(image, storage)
+
+async def remove_shared_image(image: ImageMetadata, storage: StorageService, db: DatabaseService):
+    for attempt in range(2):
+        try:
+            await db.delete_metadata(image.id)
+            break
+        except Exception as e:
+            if attempt:
+                raise HTTPException(status_code=500, detail=f"Metadata delete failed, retry the delete: {e}")
+    try:
+        await release_object(image, storage, db)
+    except Exception as e:
+        # The row is gone; at worst the shared object outlives its last reference
+        print(f"Failed to release object {image.filename} of {image.id}: {e}")
+    await remove_renditions(image, storage)
+
+async def remove_renditions(image: ImageMetadata, storage: StorageService):
+    # Derived objects are best-effort: nothing references them once the row is gone
+    errors = await storage.delete_files(rendition_keys(image))
+    for key, error in errors.items():
+        print(f"Failed to delete rendition {key}: {error}")
+
+async def schedule_processing(background_tasks: BackgroundTasks, image: ImageMetadata,
+                              storage: StorageService, db: DatabaseService):
+    """
+    Queues the post-upload job when the job pipeline is configured. Otherwise
+    the configured renditions are generated after the response, unless they
+    are left to be lazy.
+    """
+    if await enqueue_processing(image, db):
+        return
+    if image.phash is None and image.content_type.startswith("image/"):
+        background_tasks.add_task(hash_in_background, image, storage, db)
+    if settings.renditions_on_upload and settings.RENDITIONS:
+        background_tasks.add_task(renditions.generate_in_background, image, storage, db)
+
+def _projection(fields: Optional[str]) -> Optional[set]:
+    """Parses ?fields=id,download_url into the set of image fields to return."""
+    if not fields:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - ImageMetadata.model_fields.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return names
+
+def _page_include(page: type[ImagePage], fields: Optional[set]) -> Optional[dict]:
+    # Page attributes (limit, cursor, total) are always returned; only items are projected
+    if fields is None:
+        return None
+    return {**{name: True for name in page.model_fields if name != "items"}, "items": {"__all__": fields}}
+
+def _check_rendition(rendition: Optional[str]):
+    if rendition is not None and rendition not in settings.RENDITIONS:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown rendition, expected one of: {', '.join(settings.RENDITIONS)}")
+
+def request_fingerprint(*parts) -> str:
+    """Identifies what a request asks for, so a reused Idempotency-Key can't replay another upload."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+async def idempotent(key: Optional[str], fingerprint: str, response: Response, storage: StorageService,
+                     db: DatabaseService, upload: Callable[[], Awaitable[ImageMetadata]]) -> ImageMetadata:
+    """
+    Runs an upload at most once per Idempotency-Key. A retry of a completed
+    request gets the stored response back (with a freshly signed URL) without
+    touching the upload; only successful responses are stored, so a failed
+    request releases its key and can be retried. The key's lock is renewed
+    while the upload runs, so a slow upload is not taken over.
+    """
+    if key is None:
+        return await upload()
+    if not key or len(key) > settings.IDEMPOTENCY_KEY_MAX_LENGTH or not key.isprintable():
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+
+    owner = uuid.uuid4().hex
+    stored = await db.claim_idempotency_key(key, fingerprint, owner)
+    if stored is not None:
+        image = ImageMetadata.model_validate_json(stored)
+        image.download_url = await storage.generate_presigned_url(image.filename)
+        response.headers["Idempotent-Replayed"] = "true"
+        return image
+
+    async def keep_locked():
+        while True:
+            await asyncio.sleep(settings.IDEMPOTENCY_LOCK_TIMEOUT / 3)
+            try:
+                if not await db.renew_idempotency_key(key, owner):
+                    print(f"Lost the lock of Idempotency-Key {key} to another request")
+                    return
+            except Exception as e:
+                print(f"Failed to renew Idempotency-Key {key}: {e}")
+
+    renewal = asyncio.create_task(keep_locked())
+    try:
+        image = await upload()
+    except BaseException:
+        try:
+            await db.release_idempotency_key(key, owner)
+        except Exception as e:
+            print(f"Failed to release Idempotency-Key {key}: {e}")
+        raise
+    finally:
+        renewal.cancel()
+    try:
+        if not await db.complete_idempotency_key(key, owner, image.model_dump_json(exclude={'download_url'})):
+            print(f"Not storing the response for Idempotency-Key {key}: its lock was taken over")
+    except Exception as e:
+        # The upload itself succeeded; a retry waits for the lock to time out and uploads again
+        print(f"Failed to store response for Idempotency-Key {key}: {e}")
+    return image
 
 @router.post("/", response_model=ImageMetadata)
 async def upload_image(
+    background_tasks: BackgroundTasks,
+    response: Response,
     file: UploadFile = File(...),
     tags: Optional[List[str]] = Query(default=[]),
+    form_tags: List[str] = Form(default=[], alias="tags"),
     description: Optional[str] = Form(default=None),
+    idempotency_key: Optional[str] = Header(default=None),
     storage: StorageService = Depends(get_storage_service),
     db: DatabaseService = Depends(get_db_service)
 ):
+    # Tags may arrive as query parameters or as multipart form fields
+    tags = list(dict.fromkeys([*(tags or []), *form_tags]))
+    fingerprint = request_fingerprint("form", file.filename, file.size, file.content_type, tags, description)
+    return await idempotent(idempotency_key, fingerprint, response, storage, db,
+                            lambda: store_upload(file, tags, description, background_tasks, storage, db))
+
+async def store_upload(file: UploadFile, tags: List[str], description: Optional[str],
+                       background_tasks: BackgroundTasks, storage: StorageService,
+                       db: DatabaseService) -> ImageMetadata:
     # Generate unique ID and filename
     image_id = str(uuid.uuid4())
     extension = file.filename.split(".")[-1]
     unique_filename = f"{image_id}.{extension}"
     
-    # Upload to S3
-    try:
-        await storage.upload_file(file, unique_filename)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    
     # Create Metadata
     metadata = ImageMetadata(
         id=image_id,
@@ -41,49 +304,465 @@ async def upload_image(
         content_type=file.content_type,
         created_at=datetime.utcnow().isoformat(),
         tags=tags,
-        description=description
+        description=description,
+        info=await read_info(file),
+        phash=await read_phash(file)
     )
+    await reject_near_duplicate(metadata, db)
+
+    # Upload to S3 (or reference an identical stored object in dedup mode)
+    try:
+        if settings.DEDUP_ENABLED:
+            await upload_deduplicated(file, metadata, storage, db)
+        else:
+            await storage.upload_file(file, unique_filename)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
     
-    # Save to DynamoDB
-    await db.save_metadata(metadata)
-    
-    # Generate download URL for response
-    metadata.download_url = await storage.generate_presigned_url(unique_filename)
-    # Upload URL not really needed here, but can include if required.
-    
-    return metadata
+    # Save to DynamoDB and generate the download URL for the response
+    image = await finalize_upload(metadata, storage, db)
+    await schedule_processing(background_tasks, image, storage, db)
+    return image
+
+@router.post("/stream", response_model=ImageMetadata)
+async def upload_image_stream(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    filename: str = Query(..., description="Original filename, used for the extension"),
+    tags: Optional[List[str]] = Query(default=[]),
+    description: Optional[str] = Query(default=None),
+    idempotency_key: Optional[str] = Header(default=None),
+    storage: StorageService = Depends(get_storage_service),
+    db: DatabaseService = Depends(get_db_service)
+):
+    """
+    Uploads the raw request body (not multipart) by piping it straight into an
+    S3 multipart upload, so memory stays bounded whatever the image size.
+    A replayed request (Idempotency-Key) returns before the body is read.
+    """
+    fingerprint = request_fingerprint("stream", filename, request.headers.get("content-length"),
+                                      request.headers.get("content-type"), tags, description)
+    return await idempotent(idempotency_key, fingerprint, response, storage, db,
+                            lambda: store_stream(request, filename, tags, description, background_tasks, storage, db))
+
+async def store_stream(request: Request, filename: str, tags: List[str], description: Optional[str],
+                       background_tasks: BackgroundTasks, storage: StorageService,
+                       db: DatabaseService) -> ImageMetadata:
+    image_id = str(uuid.uuid4())
+    extension = filename.split(".")[-1]
+    unique_filename = f"{image_id}.{extension}"
+    content_type = request.headers.get("content-type", "application/octet-stream")
+
+    result = await storage.upload_stream(request.stream(), unique_filename, content_type)
+
+    metadata = ImageMetadata(
+        id=image_id,
+        filename=unique_filename,
+        size=result.size,
+        content_type=content_type,
+        created_at=datetime.utcnow().isoformat(),
+        tags=tags,
+        description=description,
+        content_hash=result.content_hash,
+        info=probe_prefix(result.head, result.size)
+    )
+    if settings.DEDUP_ENABLED:
+        # The hash is only known once the body has been streamed, so a
+        # duplicate still costs one upload but not the storage
+        await index_uploaded(metadata, storage, db)
+    image = await finalize_upload(metadata, storage, db)
+    await schedule_processing(background_tasks, image, storage, db)
+    return image
 
-@router.get("/", response_model=List[ImageMetadata])
+def _check_batch_size(count: int):
+    if count > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_ITEMS} items per batch")
+
+@router.post("/batch", response_model=BatchResponse)
+async def upload_images_batch(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    tags: List[str] = Form(default=[]),
+    description: Optional[str] = Form(default=None),
+    storage: StorageService = Depends(get_storage_service),
+    db: DatabaseService = Depends(get_db_service)
+):
+    """Uploads many files in one request; tags and description apply to all of them."""
+    _check_batch_size(len(files))
+    tags = list(dict.fromkeys(tags))
+
+    async def upload_one(file: UploadFile) -> BatchItemResult:
+        image_id = str(uuid.uuid4())
+        unique_filename = f"{image_id}.{file.filename.split('.')[-1]}"
+        try:
+            metadata = ImageMetadata(
+                id=image_id,
+                filename=unique_filename,
+                size=file.size if file.size else 0,
+                content_type=file.content_type,
+                created_at=datetime.utcnow().isoformat(),
+                tags=tags,
+                description=description,
+                info=await read_info(file),
+                phash=await read_phash(file)
+            )
+            await reject_near_duplicate(metadata, db)
+            if settings.DEDUP_ENABLED:
+                await upload_deduplicated(file, metadata, storage, db)
+            else:
+                await storage.upload_file(file, unique_filename)
+            image = await finalize_upload(metadata, storage, db)
+            await schedule_processing(background_tasks, image, storage, db)
+        except HTTPException as e:
+            return BatchItemResult(filename=file.filename, status=e.status_code, error=e.detail)
+        except Exception as e:
+            return BatchItemResult(filename=file.filename, status=500, error=str(e))
+        return BatchItemResult(id=image_id, filename=file.filename, status=200, image=image)
+
+    items = await gather_bounded((upload_one(file) for file in files), settings.BATCH_CONCURRENCY)
+    return BatchResponse(items=items)
+
+@router.post("/batch-get", response_model=BatchResponse)
+async def get_images_batch(
+    batch: BatchRequest,
+    db: DatabaseService = Depends(get_db_service),
+    storage: StorageService = Depends(get_storage_service)
+):
+    _check_batch_size(len(batch.ids))
+    found = await db.batch_get_metadata(batch.ids)
+    urls = await storage.generate_presigned_urls(
+        [image.filename for image in found.values() if image and image.status == "ready"])
+
+    items = []
+    for image_id in batch.ids:
+        if image_id not in found:
+            items.append(BatchItemResult(id=image_id, status=503, error="Could not read image, retry"))
+        elif found[image_id] is None:
+            items.append(BatchItemResult(id=image_id, status=404, error="Image not found"))
+        else:
+            image = found[image_id].model_copy()
+            image.download_url = urls.get(image.filename) if image.status == "ready" else None
+            items.append(BatchItemResult(id=image_id, status=200, image=image))
+    return BatchResponse(items=items)
+
+@router.post("/batch-delete", response_model=BatchResponse)
+async def delete_images_batch(
+    batch: BatchRequest,
+    db: DatabaseService = Depends(get_db_service),
+    storage: StorageService = Depends(get_storage_service)
+):
+    """
+    Deletes many images: objects go first (DeleteObjects), then the rows of
+    every image whose object is gone (BatchWriteItem), so a failure never
+    leaves an object without its row. Shared (deduplicated) objects are
+    released after their rows are gone instead, as in remove_image().
+    """
+    _check_batch_size(len(batch.ids))
+    found = await db.batch_get_metadata(batch.ids)
+    images = [image for image in found.values() if image is not None]
+    shared = [image for image in images if image.blob_hash is not None]
+
+    object_errors = await storage.delete_files([image.filename for image in images if image.blob_hash is None])
+    deletable = [image for image in images if image.blob_hash is not None or image.filename not in object_errors]
+    row_failures = await db.batch_delete_metadata(deletable)
+
+    async def release(image: ImageMetadata):
+        try:
+            await release_object(image, storage, db)
+        except Exception as e:
+            print(f"Failed to release object {image.filename} of {image.id}: {e}")
+
+    await gather_bounded((release(image) for image in shared if image.id not in row_failures),
+                         settings.BATCH_CONCURRENCY)
+
+    # Renditions are best-effort, as in remove_image()
+    rendition_errors = await storage.delete_files(
+        [key for image in deletable if image.id not in row_failures for key in rendition_keys(image)])
+    for key, error in rendition_errors.items():
+        print(f"Failed to delete rendition {key}: {error}")
+
+    items = []
+    for image_id in dict.fromkeys(batch.ids):
+        image = found.get(image_id)
+        if image_id not in found:
+            items.append(BatchItemResult(id=image_id, status=503, error="Could not read image, retry"))
+        elif image is None:
+            items.append(BatchItemResult(id=image_id, status=404, error="Image not found"))
+        elif image.blob_hash is None and image.filename in object_errors:
+            items.append(BatchItemResult(id=image_id, status=500, error=object_errors[image.filename]))
+        elif image_id in row_failures:
+            items.append(BatchItemResult(id=image_id, status=500, error="Metadata delete failed, retry the delete"))
+        else:
+            items.append(BatchItemResult(id=image_id, status=200))
+    return BatchResponse(items=items)
+
+@router.post("/uploads", response_model=UploadTicket)
+async def create_upload(
+    upload: UploadRequest,
+    storage: StorageService = Depends(get_storage_service),
+    db: DatabaseService = Depends(get_db_service)
+):
+    """
+    Phase one of a direct upload: returns a presigned POST policy so the client
+    sends the bytes straight to S3, and records a pending image that expires
+    unless it is completed via POST /images/{id}/complete.
+    """
+    if upload.size is not None and upload.size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {settings.MAX_UPLOAD_SIZE} bytes")
+
+    image_id = str(uuid.uuid4())
+    extension = upload.filename.split(".")[-1]
+    unique_filename = f"{image_id}.{extension}"
+
+    upload_url, fields = await storage.generate_presigned_post(unique_filename, upload.content_type)
+
+    metadata = ImageMetadata(
+        id=image_id,
+        filename=unique_filename,
+        upload_url=upload_url,
+        size=upload.size or 0,
+        content_type=upload.content_type,
+        created_at=datetime.utcnow().isoformat(),
+        tags=upload.tags,
+        description=upload.description,
+        status="pending"
+    )
+    await db.save_pending(metadata)
+
+    return UploadTicket(id=image_id, upload_url=upload_url, fields=fields,
+                        expires_in=settings.UPLOAD_URL_EXPIRES_IN, image=metadata)
+
+@router.post("/{image_id}/complete", response_model=ImageMetadata)
+async def complete_upload(
+    image_id: str,
+    background_tasks: BackgroundTasks,
+    storage: StorageService = Depends(get_storage_service),
+    db: DatabaseService = Depends(get_db_service)
+):
+    """Phase two of a direct upload: verifies the object landed in S3 and finalizes the image."""
+    image = await db.get_metadata(image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    if image.status == "pending":
+        head = await storage.head_file(image.filename)
+        if head is None:
+            raise HTTPException(status_code=409, detail="Image has not been uploaded yet")
+
+        image.size = head['ContentLength']
+        image.etag = head['ETag'].strip('"')
+        image.upload_url = None
+        image.status = "ready"
+        try:
+            image.info = await probe_object(storage, image.filename)
+        except Exception as e:
+            print(f"Could not probe {image.id}: {e}")
+        if job_queue() is not None:
+            image.processing = "queued"
+        if await db.save_metadata(image, only_if_pending=True):
+            await schedule_processing(background_tasks, image, storage, db)
+        else:
+            # A concurrent completion got there first; answer with what it stored
+            image = await db.get_metadata(image_id)
+            if not image:
+                raise HTTPException(status_code=404, detail="Image not found")
+
+    image.download_url = await storage.generate_presigned_url(image.filename)
+    return image
+
+@router.get("/", response_model=ImagePage)
 async def list_images(
+    request: Request,
     filename: Optional[str] = Query(None, description="Filter by partial filename"),
     tag: Optional[str] = Query(None, description="Filter by tag"),
+    date_from: Optional[datetime] = Query(None, description="Only images created at or after this time"),
+    date_to: Optional[datetime] = Query(None, description="Only images created at or before this time"),
+    limit: int = Query(50, ge=1, le=1000, description="Maximum number of images per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    rendition: Optional[str] = Query(None, description="Sign this rendition where it has been generated"),
+    fields: Optional[str] = Query(None, description="Comma-separated image fields to return, e.g. id,download_url,tags"),
+    compact: bool = Query(False, description="Omit fields that are null"),
     db: DatabaseService = Depends(get_db_service),
     storage: StorageService = Depends(get_storage_service)
 ):
+    _check_rendition(rendition)
+    projection = _projection(fields)
     valid_tag = tag if tag and tag.strip() else None
     valid_filename = filename if filename and filename.strip() else None
     
-    filters = ImageFilter(filename=valid_filename, tag=valid_tag)
-    images = await db.list_images(filters)
+    filters = ImageFilter(filename=valid_filename, tag=valid_tag, date_from=date_from, date_to=date_to)
+    images, next_cursor = await db.list_images(filters, limit=limit, cursor=cursor)
     
-    # Populate download URLs for each image
-    for img in images:
-        img.download_url = await storage.generate_presigned_url(img.filename)
-        
-    return images
+    # Populate download URLs for all images in one batch; listing never
+    # generates renditions, images without the requested one get the original
+    def key(img: ImageMetadata) -> str:
+        return img.renditions[rendition].filename if rendition in img.renditions else img.filename
+
+    if projection is None or "download_url" in projection:
+        urls = await storage.generate_presigned_urls([key(img) for img in images])
+        for img in images:
+            img.download_url = urls.get(key(img))
+
+    return cached_response(request, ImagePage(items=images, limit=limit, next_cursor=next_cursor),
+                           include=_page_include(ImagePage, projection), exclude_none=compact)
+
+@router.get("/search", response_model=SearchPage)
+async def search_images(
+    request: Request,
+    q: str = Query(..., min_length=1, description="Words to match in filename, description and tags; "
+                                                  "each also matches as a prefix"),
+    mode: str = Query("and", pattern="^(and|or)$", description="Match all words (and) or any word (or)"),
+    limit: int = Query(50, ge=1, le=1000, description="Maximum number of images per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated image fields to return, e.g. id,download_url,tags"),
+    compact: bool = Query(False, description="Omit fields that are null"),
+    db: DatabaseService = Depends(get_db_service),
+    storage: StorageService = Depends(get_storage_service)
+):
+    """Full-text search, most relevant first."""
+    projection = _projection(fields)
+    images, total, next_cursor, truncated = await db.search_images(q, mode=mode, limit=limit, cursor=cursor)
+    if projection is None or "download_url" in projection:
+        urls = await storage.generate_presigned_urls([img.filename for img in images])
+        for img in images:
+            img.download_url = urls.get(img.filename)
+    return cached_response(request, SearchPage(items=images, limit=limit, next_cursor=next_cursor, total=total,
+                                                      truncated=truncated),
+                           include=_page_include(SearchPage, projection), exclude_none=compact)
+
+@router.get("/facets", response_model=Facets)
+async def image_facets(
+    request: Request,
+    limit: int = Query(100, ge=1, le=10000, description="Maximum number of tags (most used first)"),
+    db: DatabaseService = Depends(get_db_service)
+):
+    """
+    Image counts per tag, content type and upload day, from counters kept up
+    to date on every write. Tags come from the last rollup (python -m
+    app.facets), so limit can't exceed FACET_SUMMARY_TAGS.
+    """
+    counts = await db.get_facets(min(limit, settings.FACET_SUMMARY_TAGS))
+
+    def facet(values: dict[str, int], by_count: bool = True) -> list[FacetCount]:
+        # Most used first (ties alphabetically), or newest first for days
+        ordered = (sorted(values.items(), key=lambda entry: (-entry[1], entry[0])) if by_count
+                   else sorted(values.items(), reverse=True))
+        return [FacetCount(value=value, count=count) for value, count in ordered if count > 0]
+
+    return cached_response(request, Facets(tags=facet(counts['tags'])[:limit],
+                                           content_types=facet(counts['content_types']),
+                                           days=facet(counts['days'], by_count=False)))
+
+@router.get("/changes", response_model=ChangePage)
+async def image_changes(
+    since: Optional[str] = Query(None, description="Cursor from the previous call; omit to start from now"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of change log entries to read"),
+    db: DatabaseService = Depends(get_db_service),
+    storage: StorageService = Depends(get_storage_service)
+):
+    """
+    Images created, updated or deleted since the cursor, for incremental sync.
+    Without `since` only a cursor for the current position is returned: take
+    it, list the images once, then poll with it. An image changed several
+    times is returned once, as of its latest change; `410` means the cursor
+    is past the change log retention and the client must list again.
+    """
+    if settings.CHANGE_PARTITIONS <= 0:
+        raise HTTPException(status_code=404, detail="Change feed is disabled")
+    entries, positions, more = await db.get_changes(decode_position(since) if since else None, limit)
+
+    latest = {}
+    for entry in entries:
+        latest[entry['image_id']] = entry
+    changes = [ImageChange(id=entry['image_id'], op=entry['op'], changed_at=entry['changed_at'],
+                           image=ImageMetadata(**entry['image']) if entry.get('image') else None)
+               for entry in sorted(latest.values(), key=lambda entry: entry['changed_at'])]
+    images = [change.image for change in changes if change.image is not None and change.image.status == "ready"]
+    urls = await storage.generate_presigned_urls([image.filename for image in images])
+    for image in images:
+        image.download_url = urls.get(image.filename)
+    return ChangePage(items=changes, cursor=encode_position(positions), has_more=more)
 
 @router.get("/{image_id}", response_model=ImageMetadata)
 async def get_image(
+    request: Request,
     image_id: str,
+    rendition: Optional[str] = Query(None, description="Return a download URL for this rendition, e.g. thumb"),
     db: DatabaseService = Depends(get_db_service),
     storage: StorageService = Depends(get_storage_service)
 ):
+    _check_rendition(rendition)
     image = await db.get_metadata(image_id)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
-        
-    image.download_url = await storage.generate_presigned_url(image.filename)
-    return image
+
+    if rendition is not None:
+        if image.status != "ready":
+            raise HTTPException(status_code=409, detail="Image has not been uploaded yet")
+        # Generated on first request if missing (e.g. images uploaded before renditions existed)
+        image = await renditions.ensure(image, [rendition], storage, db)
+        image.download_url = await storage.generate_presigned_url(image.renditions[rendition].filename)
+    elif image.status == "ready":
+        image.download_url = await storage.generate_presigned_url(image.filename)
+    return cached_response(request, image)
+
+@router.get("/{image_id}/similar", response_model=SimilarImages)
+async def similar_images(
+    request: Request,
+    image_id: str,
+    max_distance: Optional[int] = Query(None, ge=0, le=64, description="Maximum Hamming distance in bits "
+                                                                       "(default SIMILAR_MAX_DISTANCE)"),
+    limit: int = Query(20, ge=1, le=1000),
+    db: DatabaseService = Depends(get_db_service),
+    storage: StorageService = Depends(get_storage_service)
+):
+    """Images that look like this one (near-duplicates first), by perceptual hash."""
+    image = await db.get_metadata(image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if image.status != "ready":
+        raise HTTPException(status_code=409, detail="Image has not been uploaded yet")
+    # Hashed on first request if missing (e.g. images uploaded before hashing existed)
+    image = await hash_image(image, storage, db)
+    if image.phash is None:
+        raise HTTPException(status_code=422, detail="Image cannot be hashed")
+
+    max_distance = settings.SIMILAR_MAX_DISTANCE if max_distance is None else max_distance
+    similar = await db.find_similar(image.phash, max_distance, limit, exclude=image.id)
+    urls = await storage.generate_presigned_urls([match.filename for match, _ in similar])
+    items = [SimilarImage(**match.model_dump(exclude={'download_url'}), download_url=urls.get(match.filename),
+                          distance=distance)
+             for match, distance in similar]
+    return cached_response(request, SimilarImages(items=items, max_distance=max_distance))
+
+@router.get("/{image_id}/content")
+async def download_image(
+    request: Request,
+    image_id: str,
+    rendition: Optional[str] = Query(None, description="Stream this rendition instead of the original"),
+    db: DatabaseService = Depends(get_db_service),
+    storage: StorageService = Depends(get_storage_service)
+):
+    """
+    Streams the image through the service, for clients that cannot use the
+    presigned URL. Supports Range (including several ranges), If-Range,
+    If-None-Match and If-Modified-Since.
+    """
+    _check_rendition(rendition)
+    image = await db.get_metadata(image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if image.status != "ready":
+        raise HTTPException(status_code=409, detail="Image has not been uploaded yet")
+
+    if rendition is not None:
+        image = await renditions.ensure(image, [rendition], storage, db)
+        spec = image.renditions[rendition]
+        return await stream_object(request, storage, spec.filename, spec.content_type)
+    return await stream_object(request, storage, image.filename, image.content_type)
 
 @router.delete("/{image_id}")
 async def delete_image(
@@ -95,10 +774,7 @@ async def delete_image(
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
         
-    # Delete from S3
-    await storage.delete_file(image.filename)
-    
-    # Delete from DynamoDB
-    await db.delete_metadata(image_id)
+    # Delete from S3 and DynamoDB
+    await remove_image(image, storage, db)
     
     return {"message": "Image deleted successfully"}
@@ -0,0 +1,116 @@
+from botocore.exceptions import ClientError
+
+# Single-table layout for the metadata table:
+#   image items   id=<uuid>,                 entity="image#<n>" (see image_entity), created_at
+#   tag items     id="tag#<tag>#<uuid>",     tag_key=<tag>,  created_at, copy of the image attributes
+#   pending items id=<uuid>, status="pending", expires_at    (direct uploads not completed yet)
+#   blob items    id="blob#<sha256>", object_key, ref_count (dedup index: images sharing one object)
+#   facet items   id="facet#<kind>#<value>#<shard>", count, facet_key, facet_group; summary id="facet#summary" (see app/facets.py)
+#   change logs   id="changes#<p>", seq, bumped_at, horizon; entries id="change#<p>#<seq>" (see app/changes.py)
+#   search terms  id="term#<key>#<uuid>", term_key, created_at, image_id, matches (see app/search.py)
+#   idempotency   id="idem#<key>", state, fingerprint, owner, locked_until, response, expires_at
+# All indexes are sparse: only items carrying the partition attribute appear in them.
+# Items carrying TTL_ATTRIBUTE (epoch seconds) are removed by DynamoDB TTL.
+# Image items written before listings were sharded have entity="image"; match images
+# with begins_with(entity, IMAGE_ENTITY).
+IMAGE_ENTITY = "image"
+TTL_ATTRIBUTE = "expires_at"
+CREATED_AT_INDEX = "created_at-index"
+TAG_INDEX = "tag-index"
+FACET_INDEX = "facet-index"
+TERM_INDEX = "term-index"
+
+THROUGHPUT = {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+
+ATTRIBUTE_DEFINITIONS = [
+    {'AttributeName': 'id', 'AttributeType': 'S'},
+    {'AttributeName': 'entity', 'AttributeType': 'S'},
+    {'AttributeName': 'created_at', 'AttributeType': 'S'},
+    {'AttributeName': 'tag_key', 'AttributeType': 'S'},
+    {'AttributeName': 'facet_group', 'AttributeType': 'S'},
+    {'AttributeName': 'facet_key', 'AttributeType': 'S'},
+    {'AttributeName': 'term_key', 'AttributeType': 'S'},
+]
+
+GLOBAL_SECONDARY_INDEXES = [
+    {
+        'IndexName': CREATED_AT_INDEX,
+        'KeySchema': [{'AttributeName': 'entity', 'KeyType': 'HASH'},
+                      {'AttributeName': 'created_at', 'KeyType': 'RANGE'}],
+        'Projection': {'ProjectionType': 'ALL'},
+        'ProvisionedThroughput': THROUGHPUT,
+    },
+    {
+        'IndexName': TAG_INDEX,
+        'KeySchema': [{'AttributeName': 'tag_key', 'KeyType': 'HASH'},
+                      {'AttributeName': 'created_at', 'KeyType': 'RANGE'}],
+        'Projection': {'ProjectionType': 'ALL'},
+        'ProvisionedThroughput': THROUGHPUT,
+    },
+    {
+        # Lists the facet counters; keys only, so count updates don't write to it
+        'IndexName': FACET_INDEX,
+        'KeySchema': [{'AttributeName': 'facet_group', 'KeyType': 'HASH'},
+                      {'AttributeName': 'facet_key', 'KeyType': 'RANGE'}],
+        'Projection': {'ProjectionType': 'KEYS_ONLY'},
+        'ProvisionedThroughput': THROUGHPUT,
+    },
+    {
+        'IndexName': TERM_INDEX,
+        'KeySchema': [{'AttributeName': 'term_key', 'KeyType': 'HASH'},
+                      {'AttributeName': 'created_at', 'KeyType': 'RANGE'}],
+        'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': ['image_id', 'matches']},
+        'ProvisionedThroughput': THROUGHPUT,
+    },
+]
+
+
+def metadata_table_definition(table_name: str) -> dict:
+    return dict(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=ATTRIBUTE_DEFINITIONS,
+        GlobalSecondaryIndexes=GLOBAL_SECONDARY_INDEXES,
+        ProvisionedThroughput=THROUGHPUT,
+    )
+
+
+async def ensure_metadata_table(dynamo, table_name: str):
+    """
+    Creates the metadata table with its indexes and TTL, or adds whatever is
+    missing from an existing table (dev/test bootstrap only).
+    """
+    table = await dynamo.Table(table_name)
+    try:
+        await table.load()
+        print(f"Table {table_name} exists.")
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ResourceNotFoundException':
+            raise
+        print(f"Creating table {table_name}...")
+        await dynamo.create_table(**metadata_table_definition(table_name))
+    else:
+        existing = {index['IndexName'] for index in (await table.global_secondary_indexes) or []}
+        for index in GLOBAL_SECONDARY_INDEXES:
+            if index['IndexName'] in existing:
+                continue
+            print(f"Adding index {index['IndexName']} to {table_name}...")
+            await dynamo.meta.client.update_table(
+                TableName=table_name,
+                AttributeDefinitions=ATTRIBUTE_DEFINITIONS,
+                GlobalSecondaryIndexUpdates=[{'Create': index}],
+            )
+
+    await _ensure_ttl(dynamo, table_name)
+
+
+async def _ensure_ttl(dynamo, table_name: str):
+    client = dynamo.meta.client
+    response = await client.describe_time_to_live(TableName=table_name)
+    if response['TimeToLiveDescription'].get('TimeToLiveStatus') in ('ENABLED', 'ENABLING'):
+        return
+    print(f"Enabling TTL on {table_name}.{TTL_ATTRIBUTE}...")
+    await client.update_time_to_live(
+        TableName=table_name,
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': TTL_ATTRIBUTE},
+    )
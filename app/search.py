@@ -0,0 +1,268 @@
+"""
+Full-text search over filename, description and tags, with an inverted index
+stored in the metadata table.
+
+Every ready image has one posting item per index key it contains,
+"term#<key>#<image id>", written next to the image in save_metadata and
+deleted with it. Keys are "^<prefix>" for each prefix of a token from
+SEARCH_MIN_PREFIX up to SEARCH_MAX_PREFIX characters (the whole token when
+shorter), or "=<token>" for tokens too short to have prefixes. A posting
+holds the image's created_at and `matches`, the image's tokens under that
+key with their weights, so longer query tokens are filtered from the
+posting of their SEARCH_MAX_PREFIX prefix.
+
+term-index (term_key, created_at) lists a key's postings. An "and" query
+pages through the keys of its tokens side by side until the shortest one is
+complete, and takes its matches as candidates; the other tokens are checked
+per candidate, from the pages already read or by fetching the candidate's
+posting ids with BatchGetItem. An "or" query reads every key to the end.
+A key is read up to SEARCH_MAX_POSTINGS postings; past that the result is
+flagged as truncated. Items stored before the index existed need a one-off
+rebuild from the table:
+
+    python -m app.search
+"""
+import asyncio
+import heapq
+import re
+import uuid
+from typing import Optional
+
+from app.config import settings
+from app.models import ImageMetadata
+from app.schema import IMAGE_ENTITY, TERM_INDEX
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+# Relevance weight of a term by the field it occurs in
+FIELD_WEIGHTS = {"filename": 3, "tags": 2, "description": 1}
+# A term reached only as a prefix counts for this much of an exact match
+PREFIX_WEIGHT = 0.5
+
+
+def tokenize(text: Optional[str]) -> list[str]:
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+def _filename_tokens(filename: str) -> list[str]:
+    # Stored keys are "<uuid>.<ext>"; the random stem only bloats the term dictionary
+    stem, _, extension = filename.rpartition(".")
+    try:
+        uuid.UUID(stem)
+    except ValueError:
+        return tokenize(filename)
+    return tokenize(extension)
+
+
+def document_terms(image: ImageMetadata) -> dict[str, int]:
+    """Weighted term frequencies of the searchable fields of an image."""
+    terms: dict[str, int] = {}
+    fields = (("filename", _filename_tokens(image.filename)),
+              ("tags", [token for tag in image.tags for token in tokenize(tag)]),
+              ("description", tokenize(image.description)))
+    for field, tokens in fields:
+        for token in tokens:
+            terms[token] = terms.get(token, 0) + FIELD_WEIGHTS[field]
+    return terms
+
+
+def term_key(token: str) -> str:
+    """The index key a query token is looked up under."""
+    if len(token) < settings.SEARCH_MIN_PREFIX:
+        return f"={token}"
+    return f"^{token[:settings.SEARCH_MAX_PREFIX]}"
+
+
+def document_postings(image: ImageMetadata) -> dict[str, dict[str, int]]:
+    """The index keys of an image, each with the matching terms and their weights."""
+    postings: dict[str, dict[str, int]] = {}
+    for term, weight in document_terms(image).items():
+        if len(term) < settings.SEARCH_MIN_PREFIX:
+            postings.setdefault(f"={term}", {})[term] = weight
+            continue
+        for length in range(settings.SEARCH_MIN_PREFIX, min(len(term), settings.SEARCH_MAX_PREFIX) + 1):
+            postings.setdefault(f"^{term[:length]}", {})[term] = weight
+    return postings
+
+
+def posting_item_id(key: str, image_id: str) -> str:
+    return f"term#{key}#{image_id}"
+
+
+def posting_items(image: ImageMetadata) -> list[dict]:
+    """The posting items save_metadata writes for a ready image."""
+    if image.status != "ready":
+        return []
+    return [{'id': posting_item_id(key, image.id), 'term_key': key, 'image_id': image.id,
+             'created_at': image.created_at, 'matches': matches}
+            for key, matches in document_postings(image).items()]
+
+
+def posting_item_ids(image_id: str, filename: str, tags: list[str], description: Optional[str]) -> list[str]:
+    """The ids of an image's posting items, recomputed from its searchable fields."""
+    image = ImageMetadata(id=image_id, filename=filename, size=0, content_type="", created_at="",
+                          tags=tags, description=description)
+    return [posting_item_id(key, image_id) for key in document_postings(image)]
+
+
+def match_weight(token: str, matches: dict) -> float:
+    """Score of the best term of a posting that the query token matches, 0 if none does."""
+    best = 0.0
+    for term, weight in matches.items():
+        if term == token:
+            best = max(best, float(weight))
+        elif len(token) >= settings.SEARCH_MIN_PREFIX and term.startswith(token):
+            best = max(best, PREFIX_WEIGHT * float(weight))
+    return best
+
+
+def rank(tokens: list[str], postings: dict[str, list[dict]], mode: str = "and", offset: int = 0,
+         limit: int = 50) -> tuple[list[str], int]:
+    """
+    Returns the ids of one page of matches (most relevant first, newest
+    first among equal scores) and the total number of matches, from the
+    postings fetched per index key. Every query token matches itself and,
+    from SEARCH_MIN_PREFIX characters on, the terms it is a prefix of. In
+    "and" mode an image must match every token, in "or" mode at least one.
+    Scores are the sum over tokens of the field weight of the best match.
+    """
+    if not tokens:
+        return [], 0
+    created_at: dict[str, str] = {}
+    per_token = []
+    for token in tokens:
+        scores: dict[str, float] = {}
+        for posting in postings.get(term_key(token), []):
+            score = match_weight(token, posting['matches'])
+            if score > 0:
+                scores[posting['image_id']] = score
+                created_at[posting['image_id']] = posting['created_at']
+        per_token.append(scores)
+
+    if mode == "and":
+        # Intersect starting from the rarest token
+        per_token.sort(key=len)
+        matched = set(per_token[0])
+        for scores in per_token[1:]:
+            matched.intersection_update(scores)
+            if not matched:
+                return [], 0
+    else:
+        matched = set().union(*per_token)
+
+    ranked = heapq.nlargest(
+        offset + limit, matched,
+        key=lambda image_id: (sum(scores.get(image_id, 0.0) for scores in per_token), created_at[image_id]))
+    return ranked[offset:], len(matched)
+
+
+POSTING_ATTRIBUTES = ('id', 'image_id', 'created_at', 'matches')
+# Postings read per Query page
+POSTINGS_PAGE = 1000
+
+
+class PostingList:
+    """The postings of one index key, read from term-index a page at a time."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.items: list[dict] = []
+        self.done = False
+        self._start_key: Optional[dict] = None
+
+    @property
+    def capped(self) -> bool:
+        return not self.done and len(self.items) >= settings.SEARCH_MAX_POSTINGS
+
+    async def fetch_page(self, table):
+        kwargs = {'IndexName': TERM_INDEX, 'KeyConditionExpression': 'term_key = :key',
+                  'ExpressionAttributeValues': {':key': self.key}, 'Limit': POSTINGS_PAGE}
+        if self._start_key is not None:
+            kwargs['ExclusiveStartKey'] = self._start_key
+        response = await table.query(**kwargs)
+        self.items.extend(response.get('Items', []))
+        self._start_key = response.get('LastEvaluatedKey')
+        self.done = self._start_key is None
+
+    async def fetch_all(self, table):
+        while not self.done and not self.capped:
+            await self.fetch_page(table)
+
+
+def candidates(tokens: list[str], postings: list[dict]) -> list[str]:
+    """Images whose posting matches every one of the tokens (all looked up under that posting's key)."""
+    return [posting['image_id'] for posting in postings
+            if all(match_weight(token, posting['matches']) > 0 for token in tokens)]
+
+
+SEARCH_ATTRIBUTES = ('id', 'filename', 'content_type', 'created_at', 'tags', 'description', 'status')
+
+
+async def scan_images(table, segments: int, attributes: tuple = SEARCH_ATTRIBUTES) -> list[dict]:
+    """Every image item's `attributes` (by default the searchable ones), read with a parallel Scan."""
+    from boto3.dynamodb.conditions import Attr
+
+    return await _scan(table, segments, attributes, Attr('entity').begins_with(IMAGE_ENTITY))
+
+
+async def _scan(table, segments: int, attributes: tuple, condition) -> list[dict]:
+    names = {f'#a{i}': name for i, name in enumerate(attributes)}
+
+    async def scan_segment(segment: int) -> list[dict]:
+        kwargs = {
+            'FilterExpression': condition,
+            'ProjectionExpression': ', '.join(names),
+            'ExpressionAttributeNames': names,
+            'Segment': segment,
+            'TotalSegments': segments,
+        }
+        items = []
+        while True:
+            response = await table.scan(**kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    results = await asyncio.gather(*(scan_segment(segment) for segment in range(segments)))
+    # size is not needed for search; the projection leaves it out
+    return [{'size': 0, **item} for items in results for item in items]
+
+
+async def rebuild(table) -> tuple[int, int]:
+    """
+    Writes the postings of every ready image and deletes postings whose
+    image is gone; returns the number of postings written and deleted. A
+    one-off for tables written before the index existed, or after postings
+    were lost to failed writes.
+    """
+    from boto3.dynamodb.conditions import Attr
+
+    images = [ImageMetadata(**item) for item in await scan_images(table, settings.SEARCH_SCAN_SEGMENTS)]
+    items = [item for image in images for item in posting_items(image)]
+    current = {item['id'] for item in items}
+    stale = [item['id'] for item in await _scan(table, settings.SEARCH_SCAN_SEGMENTS, ('id',),
+                                                Attr('id').begins_with("term#"))
+             if item['id'] not in current]
+    async with table.batch_writer() as batch:
+        for item in items:
+            await batch.put_item(Item=item)
+        for item_id in stale:
+            await batch.delete_item(Key={'id': item_id})
+    return len(items), len(stale)
+
+
+def main():
+    async def run():
+        from app.clients import clients
+        try:
+            written, deleted = await rebuild(await clients.table())
+        finally:
+            await clients.close()
+        print(f"Search index rebuilt: {written} postings written, {deleted} stale postings deleted")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
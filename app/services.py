@@ -1,119 +1,1182 @@
-import aioboto3
 from fastapi import UploadFile, HTTPException
 from app.config import settings
-from app.models import ImageMetadata, ImageFilter
+from app.models import ImageMetadata, ImageFilter, ImageInfo
+from app.presign import presigner
+from app.cache import MetadataCache, MISSING
+from app.search import (tokenize, term_key, rank, candidates, posting_item_id, posting_items, posting_item_ids,
+                        PostingList, POSTING_ATTRIBUTES)
+from app.similarity import SimilarityIndex
+from app.facets import FacetCache, rollup, facet_keys, sum_counters, group_counts, top_tags, days_since, COUNTER_ATTRIBUTES
+from app.changes import change_partition, select_changes, settle_cutoff
+from app.metrics import instrumented
+from app.resilience import is_throttling
+from app.schema import IMAGE_ENTITY, CREATED_AT_INDEX, TAG_INDEX, TTL_ATTRIBUTE
+import asyncio
+import base64
+import hashlib
+import heapq
+import itertools
+import json
+import random
 import uuid
 import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Awaitable, Iterable, Optional
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Attr
+from pydantic import BaseModel
 
+# AWS limits for the batch APIs
+S3_DELETE_BATCH = 1000
+DYNAMO_GET_BATCH = 100
+DYNAMO_WRITE_BATCH = 25
+
+def chunked(values: list, size: int) -> list[list]:
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+async def gather_bounded(coros: Iterable[Awaitable], limit: int) -> list:
+    """Like asyncio.gather, but with at most `limit` awaitables running at once."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros))
+
+def _retry_delay(attempt: int) -> float:
+    # Jittered exponential backoff for unprocessed batch items
+    return random.uniform(0, settings.BATCH_RETRY_BASE_DELAY * (2 ** attempt))
+
+def s3_error(action: str, error: ClientError) -> HTTPException:
+    # Throttling that outlasted the retries is worth retrying later, not a server error
+    if is_throttling(error):
+        return HTTPException(status_code=503, detail=f"S3 {action} Throttled: {error}",
+                             headers={"Retry-After": "1"})
+    return HTTPException(status_code=500, detail=f"S3 {action} Failed: {error}")
+
+@dataclass
+class UploadResult:
+    filename: str
+    size: int
+    content_hash: str # hex SHA-256 of the body
+    etag: str
+    head: bytes = b"" # First PROBE_HEADER_BYTES of the body, for header probing
+
+@instrumented("storage")
 class StorageService:
-    def __init__(self):
-        self.session = aioboto3.Session()
+    def __init__(self, s3):
+        self.s3 = s3
 
     async def upload_file(self, file: UploadFile, filename: str) -> str:
-        async with self.session.client("s3",
-                                       region_name=settings.AWS_REGION,
-                                       endpoint_url=settings.AWS_ENDPOINT_URL,
-                                       aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                       aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY) as s3:
+        try:
+            # Upload file
+            await self.s3.upload_fileobj(file.file, settings.BUCKET_NAME, filename)
+            return filename
+        except ClientError as e:
+            raise s3_error("Upload", e)
+
+    async def upload_stream(self, chunks: AsyncIterator[bytes], filename: str,
+                            content_type: str) -> "UploadResult":
+        """
+        Streams an upload of unknown length into S3 without buffering the body.
+
+        Bytes are cut into UPLOAD_PART_SIZE parts sent as an S3 multipart upload
+        with at most UPLOAD_CONCURRENCY parts in flight; reading from `chunks`
+        pauses while all slots are busy, so memory stays around
+        (concurrency + 1) * part_size whatever the file size. Bodies smaller
+        than one part go out as a single PutObject. Size and SHA-256 are
+        computed on the fly. On any failure the multipart upload is aborted so
+        no orphaned parts are left behind.
+        """
+        part_size = settings.UPLOAD_PART_SIZE
+        slots = asyncio.Semaphore(settings.UPLOAD_CONCURRENCY)
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        buffer = bytearray()
+        upload_id = None
+        tasks: list[asyncio.Task] = []
+
+        async def upload_part(number: int, body: bytes) -> dict:
             try:
-                # Upload file
-                await s3.upload_fileobj(file.file, settings.BUCKET_NAME, filename)
-                return filename
+                response = await self.s3.upload_part(Bucket=settings.BUCKET_NAME, Key=filename,
+                                                     UploadId=upload_id, PartNumber=number, Body=body)
+                return {'PartNumber': number, 'ETag': response['ETag']}
+            finally:
+                slots.release()
+
+        async def submit_part(body: bytes):
+            nonlocal upload_id
+            if upload_id is None:
+                response = await self.s3.create_multipart_upload(Bucket=settings.BUCKET_NAME, Key=filename,
+                                                                 ContentType=content_type)
+                upload_id = response['UploadId']
+            await slots.acquire()
+            for task in tasks:
+                # Fail fast instead of streaming the rest of a doomed upload
+                if task.done() and task.exception():
+                    raise task.exception()
+            tasks.append(asyncio.create_task(upload_part(len(tasks) + 1, body)))
+
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                digest.update(chunk)
+                size += len(chunk)
+                if len(head) < settings.PROBE_HEADER_BYTES:
+                    head += chunk[:settings.PROBE_HEADER_BYTES - len(head)]
+                buffer += chunk
+                while len(buffer) >= part_size:
+                    await submit_part(bytes(buffer[:part_size]))
+                    del buffer[:part_size]
+
+            if upload_id is None:
+                response = await self.s3.put_object(Bucket=settings.BUCKET_NAME, Key=filename,
+                                                    Body=bytes(buffer), ContentType=content_type)
+                etag = response['ETag']
+            else:
+                if buffer:
+                    await submit_part(bytes(buffer))
+                    buffer.clear()
+                parts = await asyncio.gather(*tasks)
+                response = await self.s3.complete_multipart_upload(
+                    Bucket=settings.BUCKET_NAME, Key=filename, UploadId=upload_id,
+                    MultipartUpload={'Parts': parts})
+                etag = response['ETag']
+        except BaseException as e:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if upload_id is not None:
+                try:
+                    await self.s3.abort_multipart_upload(Bucket=settings.BUCKET_NAME, Key=filename,
+                                                         UploadId=upload_id)
+                except ClientError as abort_error:
+                    print(f"Failed to abort multipart upload {upload_id}: {abort_error}")
+            if isinstance(e, ClientError):
+                raise s3_error("Upload", e)
+            raise
+
+        return UploadResult(filename=filename, size=size, content_hash=digest.hexdigest(), etag=etag, head=head)
+
+    async def generate_presigned_post(self, filename: str, content_type: str) -> tuple[str, dict]:
+        """
+        Presigned POST policy letting the client upload `filename` straight to
+        S3; the policy pins the content type and caps the size.
+        """
+        try:
+            post = await self.s3.generate_presigned_post(
+                settings.BUCKET_NAME, filename,
+                Fields={'Content-Type': content_type},
+                Conditions=[{'Content-Type': content_type},
+                            ['content-length-range', 1, settings.MAX_UPLOAD_SIZE]],
+                ExpiresIn=settings.UPLOAD_URL_EXPIRES_IN)
+        except ClientError as e:
+            raise s3_error("Presign", e)
+        return post['url'], post['fields']
+
+    async def head_file(self, filename: str) -> Optional[dict]:
+        """Returns the object's HEAD response, or None if it does not exist."""
+        try:
+            return await self.s3.head_object(Bucket=settings.BUCKET_NAME, Key=filename)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise s3_error("Head", e)
+
+    async def get_file(self, filename: str, max_size: Optional[int] = None) -> bytes:
+        """Downloads a whole object; refuses objects larger than `max_size`."""
+        try:
+            response = await self.s3.get_object(Bucket=settings.BUCKET_NAME, Key=filename)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                raise HTTPException(status_code=404, detail="Image object not found")
+            raise s3_error("Get", e)
+        async with response['Body'] as body:
+            if max_size is not None and response['ContentLength'] > max_size:
+                raise HTTPException(status_code=413, detail=f"Image exceeds {max_size} bytes")
+            return await body.read()
+
+    async def open_file(self, filename: str, **conditions) -> dict:
+        """
+        GetObject for streaming: `conditions` (Range, IfMatch, IfNoneMatch,
+        IfModifiedSince, IfUnmodifiedSince) are passed through, and S3's
+        answers to them surface as 304/412/416. The caller must consume or
+        close response['Body'] to release the pooled connection.
+        """
+        try:
+            return await self.s3.get_object(Bucket=settings.BUCKET_NAME, Key=filename, **conditions)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code in ('404', 'NoSuchKey', 'NotFound'):
+                raise HTTPException(status_code=404, detail="Image object not found")
+            if code in ('304', 'NotModified'):
+                headers = e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+                raise HTTPException(status_code=304, headers={name: headers[name.lower()]
+                                                              for name in ('ETag', 'Last-Modified')
+                                                              if name.lower() in headers})
+            if code in ('412', 'PreconditionFailed'):
+                raise HTTPException(status_code=412, detail="Precondition failed")
+            if code == 'InvalidRange':
+                size = e.response['Error'].get('ActualObjectSize')
+                raise HTTPException(status_code=416, detail="Range not satisfiable",
+                                    headers={'Content-Range': f"bytes */{size}"} if size else None)
+            raise s3_error("Get", e)
+
+    async def get_range(self, filename: str, start: int, end: int) -> tuple[bytes, int]:
+        """Bytes start..end (inclusive) of an object, and the object's total size."""
+        try:
+            response = await self.s3.get_object(Bucket=settings.BUCKET_NAME, Key=filename,
+                                                Range=f"bytes={start}-{end}")
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                raise HTTPException(status_code=404, detail="Image object not found")
+            if e.response['Error']['Code'] == 'InvalidRange':
+                # Empty object
+                return b"", 0
+            raise s3_error("Get", e)
+        async with response['Body'] as body:
+            data = await body.read()
+        total = response.get('ContentRange', '').rpartition('/')[2]
+        return data, int(total) if total.isdigit() else len(data)
+
+    async def put_file(self, filename: str, body: bytes, content_type: str):
+        try:
+            await self.s3.put_object(Bucket=settings.BUCKET_NAME, Key=filename, Body=body,
+                                     ContentType=content_type)
+        except ClientError as e:
+            raise s3_error("Upload", e)
+
+    async def delete_files(self, filenames: list[str]) -> dict[str, str]:
+        """
+        Deletes many objects with DeleteObjects (up to 1000 keys per call, calls
+        run with bounded concurrency). Returns an error message for every key
+        that could not be deleted.
+        """
+        errors = {}
+
+        async def delete_chunk(chunk: list[str]):
+            try:
+                response = await self.s3.delete_objects(
+                    Bucket=settings.BUCKET_NAME,
+                    Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True})
             except ClientError as e:
-                raise HTTPException(status_code=500, detail=f"S3 Upload Failed: {e}")
+                errors.update({key: f"S3 Delete Failed: {e}" for key in chunk})
+                return
+            for error in response.get('Errors', []):
+                errors[error['Key']] = f"S3 Delete Failed: {error.get('Code')} {error.get('Message')}"
+
+        await gather_bounded((delete_chunk(chunk) for chunk in chunked(filenames, S3_DELETE_BATCH)),
+                             settings.BATCH_CONCURRENCY)
+        return errors
 
     async def delete_file(self, filename: str):
-        async with self.session.client("s3",
-                                       region_name=settings.AWS_REGION,
-                                       endpoint_url=settings.AWS_ENDPOINT_URL,
-                                       aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                       aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY) as s3:
+        try:
+            await self.s3.delete_object(Bucket=settings.BUCKET_NAME, Key=filename)
+        except ClientError as e:
+            raise s3_error("Delete", e)
+
+    async def generate_presigned_url(self, filename: str) -> str:
+        urls = await self.generate_presigned_urls([filename])
+        return urls.get(filename, "")
+
+    async def generate_presigned_urls(self, filenames: list[str]) -> dict[str, str]:
+        """
+        Presigns download URLs for many keys at once. Signing happens locally
+        against one cached signing context, and still-valid URLs are reused.
+        """
+        from app.clients import clients
+
+        try:
+            signer = await presigner.signer(await clients.credentials())
+        except Exception as e:
+            print(f"Error generating presigned URL: {e}")
+            return {}
+        return presigner.sign_many(signer, settings.BUCKET_NAME, filenames)
+
+def encode_cursor(last_evaluated_key: Optional[dict]) -> Optional[str]:
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, separators=(",", ":"), sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[dict]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, dict) or not all(isinstance(v, str) for v in key.values()):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+def _iso_utc(value: datetime) -> str:
+    # created_at is stored as a naive UTC ISO string
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+def image_entity(image_id: str) -> str:
+    """The created_at-index partition of an image: one of IMAGE_LIST_SHARDS, by id."""
+    return f"{IMAGE_ENTITY}#{zlib.crc32(image_id.encode()) % settings.IMAGE_LIST_SHARDS}"
+
+def image_partitions() -> list[str]:
+    """Every created_at-index partition holding images, including the unsharded one of older items."""
+    return [IMAGE_ENTITY] + [f"{IMAGE_ENTITY}#{shard}" for shard in range(settings.IMAGE_LIST_SHARDS)]
+
+def tag_item_id(tag: str, image_id: str) -> str:
+    return f"tag#{tag}#{image_id}"
+
+def blob_item_id(content_hash: str) -> str:
+    return f"blob#{content_hash}"
+
+def facet_item_id(key: str, shard: int) -> str:
+    return f"facet#{key}#{shard}"
+
+FACET_SUMMARY_ITEM_ID = "facet#summary"
+
+def idempotency_item_id(key: str) -> str:
+    return f"idem#{key}"
+
+def change_head_item_id(partition: int) -> str:
+    return f"changes#{partition}"
+
+def change_item_id(partition: int, seq: int) -> str:
+    return f"change#{partition}#{seq}"
+
+async def hash_upload(file: UploadFile) -> str:
+    """SHA-256 of an UploadFile's body; the file is rewound afterwards."""
+    digest = hashlib.sha256()
+    while chunk := await file.read(1024 * 1024):
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest()
+
+@instrumented("database")
+class DatabaseService:
+    # Upper bound on DynamoDB round trips used to fill one filtered page
+    MAX_QUERY_PAGES = 10
+
+    def __init__(self, table, cache: Optional[MetadataCache] = None,
+                 similarity_index: Optional[SimilarityIndex] = None,
+                 facet_cache: Optional[FacetCache] = None):
+        self.table = table
+        self.cache = cache
+        self.similarity_index = similarity_index
+        self.facet_cache = facet_cache
+
+    async def _cache_put(self, metadata: ImageMetadata):
+        if self.cache is None:
+            return
+        if metadata.processing == "queued":
+            # The worker updates it from another process, which can't invalidate this cache
+            await self.cache.delete(metadata.id)
+        else:
+            await self.cache.set(metadata.id, metadata.model_dump(exclude={'download_url'}),
+                                 settings.METADATA_CACHE_TTL)
+
+    async def save_metadata(self, metadata: ImageMetadata, only_if_pending: bool = False) -> bool:
+        """
+        Writes the image item and its tag items. With only_if_pending, the
+        image item is only replaced while it is still a pending upload, so of
+        concurrent completions exactly one goes on to count it; the others get
+        False (and the cached pending copy is dropped).
+        """
+        item = metadata.model_dump()
+        if only_if_pending:
             try:
-                await s3.delete_object(Bucket=settings.BUCKET_NAME, Key=filename)
+                await self.table.put_item(Item={**item, 'entity': image_entity(metadata.id)},
+                                          ConditionExpression='#status = :pending',
+                                          ExpressionAttributeNames={'#status': 'status'},
+                                          ExpressionAttributeValues={':pending': 'pending'})
             except ClientError as e:
-                raise HTTPException(status_code=500, detail=f"S3 Delete Failed: {e}")
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                if self.cache is not None:
+                    await self.cache.delete(metadata.id)
+                return False
+        async with self.table.batch_writer() as batch:
+            if not only_if_pending:
+                await batch.put_item(Item={**item, 'entity': image_entity(metadata.id)})
+            # One adjacency item per tag, so tag lookups are a Query on tag-index
+            for tag in set(metadata.tags):
+                await batch.put_item(Item={**item,
+                                           'id': tag_item_id(tag, metadata.id),
+                                           'image_id': metadata.id,
+                                           'tag_key': tag})
+            # Search postings, so queries are Queries on term-index (see app.search)
+            for posting in posting_items(metadata):
+                await batch.put_item(Item=posting)
+        await self._cache_put(metadata)
+        if self.similarity_index is not None:
+            self.similarity_index.add(metadata)
+        if metadata.status == "ready":
+            await asyncio.gather(self._count_facets(metadata.tags, metadata.content_type, metadata.created_at, 1),
+                                 self._record_change(metadata.id))
+        return True
 
-    async def generate_presigned_url(self, filename: str) -> str:
-        async with self.session.client("s3",
-                                       region_name=settings.AWS_REGION,
-                                       endpoint_url=settings.AWS_ENDPOINT_URL,
-                                       aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                       aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY) as s3:
+    async def _count_facets(self, tags: list[str], content_type: str, created_at: str, delta: int):
+        """
+        Adds `delta` to the image's tag/content type/upload day counters, each
+        on one random shard. Best-effort: a failure is logged and the counts
+        stay off until the next recount (python -m app.facets --recount).
+        """
+        if settings.FACET_SHARDS <= 0:
+            return
+
+        async def add(key: str):
+            shard = random.randrange(settings.FACET_SHARDS)
+            await self.table.update_item(Key={'id': facet_item_id(key, shard)},
+                                         UpdateExpression='ADD #count :delta SET facet_key = :key, facet_group = :group',
+                                         ExpressionAttributeNames={'#count': 'count'},
+                                         ExpressionAttributeValues={':delta': delta, ':key': key,
+                                                                    ':group': f"{key.partition('#')[0]}#{shard}"})
+
+        results = await asyncio.gather(*(add(key) for key in facet_keys(tags, content_type, created_at)),
+                                       return_exceptions=True)
+        for error in (result for result in results if isinstance(result, Exception)):
+            print(f"Failed to update facet counts: {error}")
+
+    async def _record_change(self, image_id: str):
+        """
+        Appends the image's current state to its change log, after a write to
+        it: an upsert with the stored image, or a delete tombstone if it is
+        gone. The image is read after the sequence number is taken, so the
+        highest entry of an image always reflects its latest write, whatever
+        order concurrent writers get here in. Best-effort: if the entry can't
+        be written its sequence number stays a gap, which readers skip once
+        it is CHANGE_SETTLE seconds old.
+        """
+        if settings.CHANGE_PARTITIONS <= 0:
+            return
+        partition = change_partition(image_id)
+        now = datetime.utcnow().isoformat()
+        try:
+            response = await self.table.update_item(Key={'id': change_head_item_id(partition)},
+                                                    UpdateExpression='ADD seq :one SET bumped_at = :now',
+                                                    ExpressionAttributeValues={':one': 1, ':now': now},
+                                                    ReturnValues='UPDATED_NEW')
+            seq = int(response['Attributes']['seq'])
+            stored = (await self.table.get_item(Key={'id': image_id}, ConsistentRead=True)).get('Item')
+            image = self._to_metadata(stored)
+            if image is not None and image.status != "ready":
+                image = None
+            item = {'id': change_item_id(partition, seq), 'seq': seq, 'image_id': image_id,
+                    'op': 'delete' if image is None else 'upsert', 'changed_at': now}
+            if image is not None:
+                item['image'] = image.model_dump(exclude={'download_url'})
+            await self.table.put_item(Item=item)
+        except Exception as e:
+            print(f"Failed to record change of {image_id}: {e}")
+
+    async def save_renditions(self, image: ImageMetadata, renditions: dict) -> bool:
+        """
+        Records generated renditions on the image item and its tag items. Each
+        rendition is set as its own map entry, so concurrent generations of
+        different renditions don't overwrite each other. Returns False if the
+        image no longer exists.
+        """
+        names = {f'#r{i}': name for i, name in enumerate(renditions)}
+        values = {f':r{i}': rendition.model_dump() for i, rendition in enumerate(renditions.values())}
+        update = 'SET ' + ', '.join(f'renditions.{name} = {value}' for name, value in zip(names, values))
+
+        async def record(item_id: str, returns: str = 'NONE') -> Optional[dict]:
+            kwargs = dict(Key={'id': item_id}, ConditionExpression='attribute_exists(id)',
+                          ExpressionAttributeNames=names, ExpressionAttributeValues=values,
+                          ReturnValues=returns)
+            for attempt in range(2):
+                try:
+                    response = await self.table.update_item(UpdateExpression=update, **kwargs)
+                    return response.get('Attributes', {})
+                except ClientError as e:
+                    code = e.response['Error']['Code']
+                    if code == 'ConditionalCheckFailedException':
+                        return None
+                    if code != 'ValidationException' or attempt:
+                        raise
+                # Items written before renditions existed have no map to set entries on
+                try:
+                    await self.table.update_item(
+                        UpdateExpression='SET renditions = if_not_exists(renditions, :empty)',
+                        ConditionExpression='attribute_exists(id)',
+                        ExpressionAttributeValues={':empty': {}}, Key={'id': item_id})
+                except ClientError as e:
+                    if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                        return None
+                    raise
+
+        # The image item comes back as stored, with renditions other writers added meanwhile
+        recorded = await asyncio.gather(record(image.id, 'ALL_NEW'),
+                                        *(record(tag_item_id(tag, image.id)) for tag in set(image.tags)))
+        if recorded[0] is None:
+            return False
+        stored = ImageMetadata(**recorded[0])
+        await self._cache_put(stored)
+        if stored.status == "ready":
+            await self._record_change(image.id)
+        return True
+
+    async def _update_attributes(self, image: ImageMetadata, attributes: dict) -> bool:
+        """
+        Sets top-level attributes on the image item and its tag items, and on
+        `image` itself. Returns False if the image no longer exists.
+        """
+        names = {f'#a{i}': name for i, name in enumerate(attributes)}
+        values = {f':a{i}': value.model_dump(exclude_none=True) if isinstance(value, BaseModel) else value
+                  for i, value in enumerate(attributes.values())}
+        update = 'SET ' + ', '.join(f'{name} = {value}' for name, value in zip(names, values))
+
+        async def record(item_id: str, returns: str = 'NONE') -> Optional[dict]:
             try:
-                url = await s3.generate_presigned_url('get_object',
-                                                      Params={'Bucket': settings.BUCKET_NAME,
-                                                              'Key': filename},
-                                                      ExpiresIn=3600)
-                return url
+                response = await self.table.update_item(Key={'id': item_id}, UpdateExpression=update,
+                                                        ConditionExpression='attribute_exists(id)',
+                                                        ExpressionAttributeNames=names,
+                                                        ExpressionAttributeValues=values, ReturnValues=returns)
             except ClientError as e:
-                print(f"Error generating presigned URL: {e}")
-                return ""
+                if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                    return None
+                raise
+            return response.get('Attributes', {})
 
-class DatabaseService:
-    def __init__(self):
-        self.session = aioboto3.Session()
-
-    async def save_metadata(self, metadata: ImageMetadata):
-        async with self.session.resource("dynamodb",
-                                         region_name=settings.AWS_REGION,
-                                         endpoint_url=settings.AWS_ENDPOINT_URL,
-                                         aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                         aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY) as dynamo:
-            table = await dynamo.Table(settings.TABLE_NAME)
-            await table.put_item(Item=metadata.model_dump())
+        # The cache gets the image item as stored, not the caller's possibly stale copy
+        recorded = await asyncio.gather(record(image.id, 'ALL_NEW'),
+                                        *(record(tag_item_id(tag, image.id)) for tag in set(image.tags)))
+        if recorded[0] is None:
+            return False
+        for name, value in attributes.items():
+            setattr(image, name, value)
+        stored = ImageMetadata(**recorded[0])
+        await self._cache_put(stored)
+        if stored.status == "ready":
+            await self._record_change(image.id)
+        return True
 
-    async def get_metadata(self, image_id: str) -> ImageMetadata:
-        async with self.session.resource("dynamodb",
-                                         region_name=settings.AWS_REGION,
-                                         endpoint_url=settings.AWS_ENDPOINT_URL,
-                                         aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                         aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY) as dynamo:
-            table = await dynamo.Table(settings.TABLE_NAME)
-            response = await table.get_item(Key={'id': image_id})
+    async def set_processing(self, image: ImageMetadata, status: str, error: Optional[str] = None) -> bool:
+        """Records the job pipeline status; False if the image no longer exists."""
+        return await self._update_attributes(image, {'processing': status, 'processing_error': error})
+
+    async def save_info(self, image: ImageMetadata, info: ImageInfo) -> bool:
+        """Records probed dimensions/EXIF info; False if the image no longer exists."""
+        return await self._update_attributes(image, {'info': info})
+
+    async def save_phash(self, image: ImageMetadata, phash: str) -> bool:
+        """Records the perceptual hash; False if the image no longer exists."""
+        if not await self._update_attributes(image, {'phash': phash}):
+            return False
+        if self.similarity_index is not None:
+            self.similarity_index.add(image)
+        return True
+
+    async def acquire_blob(self, content_hash: str) -> Optional[str]:
+        """
+        Takes a reference on the stored object with this content hash and
+        returns its key, or None if there is no live one. A blob whose count
+        already dropped to zero is being deleted and can't be revived.
+        """
+        try:
+            response = await self.table.update_item(
+                Key={'id': blob_item_id(content_hash)},
+                UpdateExpression='ADD ref_count :one',
+                ConditionExpression='attribute_exists(id) AND ref_count > :zero',
+                ExpressionAttributeValues={':one': 1, ':zero': 0},
+                ReturnValues='ALL_NEW')
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+        return response['Attributes']['object_key']
+
+    async def register_blob(self, content_hash: str, object_key: str, size: int) -> bool:
+        """
+        Indexes a freshly uploaded object under its content hash with one
+        reference. Fails (returns False) if a live blob already exists, e.g.
+        because a concurrent upload of the same content won the race.
+        """
+        try:
+            await self.table.put_item(
+                Item={'id': blob_item_id(content_hash), 'object_key': object_key,
+                      'ref_count': 1, 'size': size, 'created_at': datetime.utcnow().isoformat()},
+                ConditionExpression='attribute_not_exists(id) OR ref_count <= :zero',
+                ExpressionAttributeValues={':zero': 0})
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    async def release_blob(self, content_hash: str, object_key: str) -> bool:
+        """
+        Drops one reference. Returns True when it was the last one: the object
+        is then unreferenced for good (acquire_blob never revives a zero
+        count, and a re-upload gets a new key), so the caller deletes it. The
+        index item is removed only if it still describes this object.
+        """
+        try:
+            response = await self.table.update_item(
+                Key={'id': blob_item_id(content_hash)},
+                UpdateExpression='ADD ref_count :minus_one',
+                ConditionExpression='attribute_exists(id) AND object_key = :key',
+                ExpressionAttributeValues={':minus_one': -1, ':key': object_key},
+                ReturnValues='UPDATED_NEW')
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                # Index lost track of this object; keeping it is the safe choice
+                print(f"No blob index item for {content_hash} -> {object_key}")
+                return False
+            raise
+        if response['Attributes']['ref_count'] > 0:
+            return False
+        try:
+            await self.table.delete_item(
+                Key={'id': blob_item_id(content_hash)},
+                ConditionExpression='ref_count <= :zero AND object_key = :key',
+                ExpressionAttributeValues={':zero': 0, ':key': object_key})
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                print(f"Failed to remove blob index item {content_hash}: {e}")
+        return True
+
+    async def claim_idempotency_key(self, key: str, fingerprint: str, owner: str) -> Optional[str]:
+        """
+        Locks an Idempotency-Key for a new request, or returns the stored
+        response (JSON) of the request that already completed under it. A key
+        whose request is still running gives 409; a lock not renewed for
+        IDEMPOTENCY_LOCK_TIMEOUT is taken over, as its request has died. A key
+        reused for a different request (other fingerprint) gives 422.
+
+        `owner` is a token unique to the claiming request; renewing,
+        completing and releasing the lock only succeed while it holds it.
+        """
+        item_id = idempotency_item_id(key)
+        for _ in range(2):
+            now = int(time.time())
+            response = await self.table.get_item(Key={'id': item_id}, ConsistentRead=True)
             item = response.get('Item')
-            if not item:
+            if item is not None and item[TTL_ATTRIBUTE] > now:
+                if item['fingerprint'] != fingerprint:
+                    raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+                if item['state'] == 'done':
+                    return item['response']
+                if item['locked_until'] > now:
+                    break
+            try:
+                await self.table.put_item(
+                    Item={'id': item_id, 'state': 'in_progress', 'fingerprint': fingerprint, 'owner': owner,
+                          'locked_until': now + settings.IDEMPOTENCY_LOCK_TIMEOUT,
+                          TTL_ATTRIBUTE: now + settings.IDEMPOTENCY_TTL},
+                    ConditionExpression=('attribute_not_exists(id) OR #ttl <= :now'
+                                         ' OR (#state = :in_progress AND locked_until <= :now)'),
+                    ExpressionAttributeNames={'#ttl': TTL_ATTRIBUTE, '#state': 'state'},
+                    ExpressionAttributeValues={':now': now, ':in_progress': 'in_progress'})
                 return None
-            return ImageMetadata(**item)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                # Claimed (or completed) concurrently: look again
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress",
+                            headers={"Retry-After": "1"})
+
+    async def _update_idempotency_key(self, key: str, owner: str, **kwargs) -> bool:
+        """Updates a key's lock while `owner` holds it; False if it was taken over (or is gone)."""
+        try:
+            await self.table.update_item(
+                Key={'id': idempotency_item_id(key)},
+                ConditionExpression='#state = :in_progress AND #owner = :owner',
+                ExpressionAttributeNames={**kwargs.pop('ExpressionAttributeNames', {}),
+                                          '#state': 'state', '#owner': 'owner'},
+                ExpressionAttributeValues={**kwargs.pop('ExpressionAttributeValues', {}),
+                                           ':in_progress': 'in_progress', ':owner': owner},
+                **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    async def renew_idempotency_key(self, key: str, owner: str) -> bool:
+        """Extends a running request's lock by IDEMPOTENCY_LOCK_TIMEOUT; False if the lock was lost."""
+        return await self._update_idempotency_key(
+            key, owner, UpdateExpression='SET locked_until = :until',
+            ExpressionAttributeValues={':until': int(time.time()) + settings.IDEMPOTENCY_LOCK_TIMEOUT})
+
+    async def complete_idempotency_key(self, key: str, owner: str, response: str) -> bool:
+        """Stores the finished response under a claimed key, for replay until it expires."""
+        return await self._update_idempotency_key(
+            key, owner, UpdateExpression='SET #state = :done, #response = :response REMOVE locked_until, #owner',
+            ExpressionAttributeNames={'#response': 'response'},
+            ExpressionAttributeValues={':done': 'done', ':response': response})
+
+    async def release_idempotency_key(self, key: str, owner: str) -> bool:
+        """Drops the lock of a failed request, so a retry runs it again."""
+        try:
+            await self.table.delete_item(
+                Key={'id': idempotency_item_id(key)},
+                ConditionExpression='#state = :in_progress AND #owner = :owner',
+                ExpressionAttributeNames={'#state': 'state', '#owner': 'owner'},
+                ExpressionAttributeValues={':in_progress': 'in_progress', ':owner': owner})
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    async def save_pending(self, metadata: ImageMetadata):
+        """
+        Stores the record of a direct upload that has not completed yet. It is
+        kept out of the indexes and expires via TTL unless save_metadata()
+        replaces it on completion.
+        """
+        item = metadata.model_dump()
+        item[TTL_ATTRIBUTE] = int(time.time()) + settings.PENDING_UPLOAD_TTL
+        await self.table.put_item(Item=item)
+        await self._cache_put(metadata)
+
+    async def get_metadata(self, image_id: str) -> ImageMetadata:
+        if self.cache is not None:
+            cached = await self.cache.get(image_id)
+            if cached is MISSING:
+                return None
+            if cached is not None:
+                return ImageMetadata(**cached)
+
+        metadata = await self._read_metadata(image_id)
+        if self.cache is not None:
+            if metadata is None:
+                await self.cache.set_missing(image_id, settings.METADATA_CACHE_NEGATIVE_TTL)
+            else:
+                await self._cache_put(metadata)
+        return metadata
+
+    async def refresh_metadata(self, image: ImageMetadata) -> ImageMetadata:
+        """
+        Re-reads an image, bypassing the cache, before deciding that work on it
+        (a rendition, the hash) is still missing: another process may have done
+        it since the copy at hand was read. Returns the copy when the image is gone.
+        """
+        metadata = await self._read_metadata(image.id, consistent=True)
+        if metadata is None:
+            return image
+        await self._cache_put(metadata)
+        return metadata
+
+    async def _read_metadata(self, image_id: str, consistent: bool = False) -> Optional[ImageMetadata]:
+        response = await self.table.get_item(Key={'id': image_id}, ConsistentRead=consistent)
+        return self._to_metadata(response.get('Item'))
+
+    @staticmethod
+    def _to_metadata(item: Optional[dict]) -> Optional[ImageMetadata]:
+        if not item:
+            return None
+        # TTL deletion lags behind expiry; treat expired records as gone
+        if TTL_ATTRIBUTE in item and item[TTL_ATTRIBUTE] <= time.time():
+            return None
+        return ImageMetadata(**item)
+
+    async def batch_get_metadata(self, image_ids: list[str]) -> dict[str, Optional[ImageMetadata]]:
+        """
+        Fetches many images with BatchGetItem (100 keys per call, calls run with
+        bounded concurrency; unprocessed keys are retried with backoff). Cached
+        entries are served from the cache. The result maps each id to its
+        metadata or None when it does not exist; ids that still could not be
+        read after the retries are left out.
+        """
+        results: dict[str, Optional[ImageMetadata]] = {}
+        pending = []
+        for image_id in dict.fromkeys(image_ids):
+            cached = await self.cache.get(image_id) if self.cache is not None else None
+            if cached is MISSING:
+                results[image_id] = None
+            elif cached is not None:
+                results[image_id] = ImageMetadata(**cached)
+            else:
+                pending.append(image_id)
+
+        # The resource's client (de)serializes DynamoDB types for us
+        client = self.table.meta.client
+        table_name = self.table.name
+
+        async def fetch(chunk: list[str]):
+            request_items = {table_name: {'Keys': [{'id': image_id} for image_id in chunk]}}
+            for attempt in range(settings.BATCH_MAX_RETRIES + 1):
+                response = await client.batch_get_item(RequestItems=request_items)
+                for item in response.get('Responses', {}).get(table_name, []):
+                    metadata = self._to_metadata(item)
+                    if metadata is not None:
+                        results[metadata.id] = metadata
+                        await self._cache_put(metadata)
+                request_items = response.get('UnprocessedKeys')
+                if not request_items:
+                    break
+                await asyncio.sleep(_retry_delay(attempt))
+
+            unprocessed = {key['id'] for key in (request_items or {}).get(table_name, {}).get('Keys', [])}
+            for image_id in chunk:
+                if image_id not in results and image_id not in unprocessed:
+                    results[image_id] = None
+
+        await gather_bounded((fetch(chunk) for chunk in chunked(pending, DYNAMO_GET_BATCH)),
+                             settings.BATCH_CONCURRENCY)
+        return results
+
+    async def batch_delete_metadata(self, images: list[ImageMetadata]) -> set[str]:
+        """
+        Deletes many images (and their tag and search posting items) with
+        BatchWriteItem (25 requests per call, bounded concurrency, unprocessed
+        items retried). Returns the ids of images that could not be fully deleted.
+        """
+        requests = []
+        for image in images:
+            requests.append(image.id)
+            requests.extend(tag_item_id(tag, image.id) for tag in set(image.tags))
+            requests.extend(posting_item_ids(image.id, image.filename, image.tags, image.description))
+
+        client = self.table.meta.client
+        table_name = self.table.name
+        failed = set()
+
+        async def write(chunk: list[str]):
+            request_items = {table_name: [{'DeleteRequest': {'Key': {'id': item_id}}}
+                                          for item_id in chunk]}
+            for attempt in range(settings.BATCH_MAX_RETRIES + 1):
+                try:
+                    response = await client.batch_write_item(RequestItems=request_items)
+                except ClientError as e:
+                    print(f"Batch delete failed: {e}")
+                    break
+                request_items = response.get('UnprocessedItems')
+                if not request_items:
+                    return
+                await asyncio.sleep(_retry_delay(attempt))
+            for request in request_items.get(table_name, []):
+                # Map tag and posting items ("tag#<tag>#<id>", "term#<key>#<id>") back to their image id
+                failed.add(request['DeleteRequest']['Key']['id'].rsplit('#', 1)[-1])
+
+        await gather_bounded((write(chunk) for chunk in chunked(requests, DYNAMO_WRITE_BATCH)),
+                             settings.BATCH_CONCURRENCY)
+        for image in images:
+            if image.id in failed:
+                continue
+            if self.cache is not None:
+                await self.cache.set_missing(image.id, settings.METADATA_CACHE_NEGATIVE_TTL)
+            if self.similarity_index is not None:
+                self.similarity_index.remove(image.id)
+        deleted = [image for image in images if image.id not in failed and image.status == "ready"]
+        await asyncio.gather(*(self._count_facets(image.tags, image.content_type, image.created_at, -1)
+                               for image in deleted),
+                             *(self._record_change(image.id) for image in deleted))
+        return failed
 
     async def delete_metadata(self, image_id: str):
-        async with self.session.resource("dynamodb",
-                                         region_name=settings.AWS_REGION,
-                                         endpoint_url=settings.AWS_ENDPOINT_URL,
-                                         aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                         aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY) as dynamo:
-            table = await dynamo.Table(settings.TABLE_NAME)
-            await table.delete_item(Key={'id': image_id})
-
-    async def list_images(self, filter_params: ImageFilter) -> list[ImageMetadata]:
-        async with self.session.resource("dynamodb",
-                                         region_name=settings.AWS_REGION,
-                                         endpoint_url=settings.AWS_ENDPOINT_URL,
-                                         aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                         aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY) as dynamo:
-            table = await dynamo.Table(settings.TABLE_NAME)
-            
-            # Simple scan with filter expression
-            # Use FilterExpression for attributes
-            scan_kwargs = {}
-            filter_expression = None
-            
+        response = await self.table.delete_item(Key={'id': image_id}, ReturnValues='ALL_OLD')
+        if self.cache is not None:
+            # The row is known to be gone, so remember that instead of just dropping the entry
+            await self.cache.set_missing(image_id, settings.METADATA_CACHE_NEGATIVE_TTL)
+        if self.similarity_index is not None:
+            self.similarity_index.remove(image_id)
+        old = response.get('Attributes', {})
+        if old.get('entity', '').startswith(IMAGE_ENTITY):
+            await asyncio.gather(self._count_facets(old.get('tags', []), old['content_type'], old['created_at'], -1),
+                                 self._record_change(image_id))
+        related = [tag_item_id(tag, image_id) for tag in set(old.get('tags', []))]
+        if old.get('status', 'ready') == 'ready' and 'filename' in old:
+            related.extend(posting_item_ids(image_id, old['filename'], old.get('tags', []), old.get('description')))
+        if related:
+            async with self.table.batch_writer() as batch:
+                for item_id in related:
+                    await batch.delete_item(Key={'id': item_id})
+
+    async def list_images(self, filter_params: ImageFilter, limit: int = 50,
+                          cursor: Optional[str] = None) -> tuple[list[ImageMetadata], Optional[str]]:
+        """
+        Returns one page of images (newest first) and the cursor of the next page.
+        Tag filters query tag-index, everything else queries the image
+        partitions of created_at-index and merges them; the partial filename
+        match is applied as a filter on top.
+        """
+        # Deferred: importing boto3 costs ~70 ms on a cold start
+        from boto3.dynamodb.conditions import Attr, Key
+
+        range_condition = None
+        if filter_params.date_from and filter_params.date_to:
+            range_condition = Key('created_at').between(_iso_utc(filter_params.date_from),
+                                                        _iso_utc(filter_params.date_to))
+        elif filter_params.date_from:
+            range_condition = Key('created_at').gte(_iso_utc(filter_params.date_from))
+        elif filter_params.date_to:
+            range_condition = Key('created_at').lte(_iso_utc(filter_params.date_to))
+
+        def query_kwargs(index_name: str, key_condition) -> dict:
+            kwargs = {
+                'IndexName': index_name,
+                'KeyConditionExpression': key_condition if range_condition is None else key_condition & range_condition,
+                'ScanIndexForward': False,
+            }
             if filter_params.filename:
                 # Use 'contains' for partial match
-                condition = Attr('filename').contains(filter_params.filename)
-                filter_expression = condition if filter_expression is None else filter_expression & condition
-            
-            if filter_params.tag:
-                 # Check if tag is in tags list
-                condition = Attr('tags').contains(filter_params.tag)
-                filter_expression = condition if filter_expression is None else filter_expression & condition
-
-            # Add more filters if needed (date logic needs ISO string comparison)
-            
-            if filter_expression:
-                scan_kwargs['FilterExpression'] = filter_expression
-
-            response = await table.scan(**scan_kwargs)
-            items = response.get('Items', [])
-            return [ImageMetadata(**item) for item in items]
+                kwargs['FilterExpression'] = Attr('filename').contains(filter_params.filename)
+            return kwargs
+
+        if filter_params.tag:
+            items, start_key = await self._query_page(query_kwargs(TAG_INDEX, Key('tag_key').eq(filter_params.tag)),
+                                                      limit, decode_cursor(cursor))
+            next_cursor = encode_cursor(start_key)
+        else:
+            items, next_cursor = await self._merge_partitions(
+                lambda partition: query_kwargs(CREATED_AT_INDEX, Key('entity').eq(partition)), limit, cursor)
+
+        images = [ImageMetadata(**{**item, 'id': item.get('image_id', item['id'])}) for item in items]
+        return images, next_cursor
+
+    async def _query_page(self, query_kwargs: dict, limit: int,
+                          start_key: Optional[dict]) -> tuple[list[dict], Optional[dict]]:
+        """Up to `limit` items of a Query (filters applied) and the key to resume it from."""
+        items = []
+        for _ in range(self.MAX_QUERY_PAGES):
+            if start_key:
+                query_kwargs['ExclusiveStartKey'] = start_key
+            # Only evaluate as many items as are still missing, so the
+            # LastEvaluatedKey is an exact resume point for the next page
+            query_kwargs['Limit'] = limit - len(items)
+            response = await self.table.query(**query_kwargs)
+            items.extend(response.get('Items', []))
+            start_key = response.get('LastEvaluatedKey')
+            if not start_key or len(items) >= limit:
+                break
+        return items, start_key
+
+    async def _merge_partitions(self, query_kwargs, limit: int,
+                                cursor: Optional[str]) -> tuple[list[dict], Optional[str]]:
+        """
+        One newest-first page across the image partitions of created_at-index:
+        up to `limit` items are read from each and merged. The cursor maps
+        every partition not yet exhausted to "<created_at>|<id>" of the last
+        item taken from it ("" before the first).
+        """
+        partitions = image_partitions()
+        positions = decode_cursor(cursor) if cursor else dict.fromkeys(partitions, "")
+        if not set(positions) <= set(partitions):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        def start_key(partition: str, position: str) -> Optional[dict]:
+            if not position:
+                return None
+            created_at, _, image_id = position.partition("|")
+            return {'id': image_id, 'entity': partition, 'created_at': created_at}
+
+        pages = await asyncio.gather(*(self._query_page(query_kwargs(partition), limit,
+                                                        start_key(partition, position))
+                                       for partition, position in positions.items()))
+        sources = [[(item, partition) for item in items] for partition, (items, _) in zip(positions, pages)]
+        page = list(itertools.islice(heapq.merge(*sources, key=lambda entry: entry[0]['created_at'], reverse=True),
+                                     limit))
+
+        taken: dict[str, list[dict]] = {}
+        for item, partition in page:
+            taken.setdefault(partition, []).append(item)
+        next_positions = {}
+        for partition, (items, resume_key) in zip(positions, pages):
+            used = taken.get(partition, [])
+            if len(used) < len(items):
+                last = used[-1] if used else None
+                next_positions[partition] = f"{last['created_at']}|{last['id']}" if last else positions[partition]
+            elif resume_key:
+                next_positions[partition] = f"{resume_key['created_at']}|{resume_key['id']}"
+        return [item for item, _ in page], encode_cursor(next_positions)
+
+    async def search_images(self, query: str, mode: str = "and", limit: int = 50,
+                            cursor: Optional[str] = None) -> tuple[list[ImageMetadata], int, Optional[str], bool]:
+        """
+        Full-text search through the posting items (see app.search); the page
+        is hydrated with batch_get_metadata. Returns one page of matching
+        images in relevance order, the total number of matches, the cursor
+        of the next page, and whether a key had more than SEARCH_MAX_POSTINGS
+        postings (then the total is a lower bound and matches may be missing).
+        """
+        position = decode_cursor(cursor)
+        try:
+            offset = int(position['offset']) if position else 0
+        except (KeyError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        tokens = list(dict.fromkeys(tokenize(query)))
+        lists = {key: PostingList(key) for key in dict.fromkeys(term_key(token) for token in tokens)}
+        if mode == "and" and lists:
+            postings, truncated = await self._intersect_postings(tokens, lists)
+        else:
+            await asyncio.gather(*(postings.fetch_all(self.table) for postings in lists.values()))
+            postings = {key: postings.items for key, postings in lists.items()}
+            truncated = any(postings.capped for postings in lists.values())
+        ids, total = rank(tokens, postings, mode=mode, offset=offset, limit=limit)
+
+        found = await self.batch_get_metadata(ids)
+        images = [found[image_id] for image_id in ids
+                  if found.get(image_id) is not None and found[image_id].status == "ready"]
+        next_offset = offset + len(ids)
+        next_cursor = encode_cursor({'offset': str(next_offset)}) if next_offset < total else None
+        return images, total, next_cursor, truncated
+
+    async def _intersect_postings(self, tokens: list[str],
+                                  lists: dict[str, PostingList]) -> tuple[dict[str, list[dict]], bool]:
+        """
+        The postings an "and" query needs: every posting of its shortest key
+        (read a page per key at a time until one key is complete), and for
+        the other keys those of the candidates it yields.
+        """
+        while not any(postings.done or postings.capped for postings in lists.values()):
+            await asyncio.gather(*(postings.fetch_page(self.table) for postings in lists.values()))
+        driver = min(lists.values(), key=lambda postings: (not postings.done, len(postings.items)))
+        truncated = not driver.done
+
+        matched = candidates([token for token in tokens if term_key(token) == driver.key], driver.items)
+        matched_ids = set(matched)
+        result = {driver.key: [posting for posting in driver.items if posting['image_id'] in matched_ids]}
+        for key, postings in lists.items():
+            if key == driver.key:
+                continue
+            known = {posting['image_id']: posting for posting in postings.items}
+            if not postings.done:
+                missing = [image_id for image_id in matched if image_id not in known]
+                items = await self.get_items([posting_item_id(key, image_id) for image_id in missing],
+                                             POSTING_ATTRIBUTES)
+                known.update((item['image_id'], item) for item in items.values())
+            result[key] = [known[image_id] for image_id in matched if image_id in known]
+        return result, truncated
+
+    async def find_similar(self, phash: str, max_distance: int, limit: int,
+                           exclude: Optional[str] = None) -> list[tuple[ImageMetadata, int]]:
+        """
+        Images whose perceptual hash is within `max_distance` bits of `phash`,
+        nearest first, as (image, distance). Like search_images(), ids that
+        another instance deleted since the last rebuild are dropped.
+        """
+        if self.similarity_index is None:
+            raise HTTPException(status_code=503, detail="Similarity search is not available")
+        await self.similarity_index.ensure(self.table)
+        matches = self.similarity_index.query(phash, max_distance, limit, exclude=exclude)
+        found = await self.batch_get_metadata([image_id for image_id, _ in matches])
+        similar = []
+        for image_id, distance in matches:
+            image = found.get(image_id)
+            if image_id in found and (image is None or image.status != "ready"):
+                self.similarity_index.remove(image_id)
+            elif image is not None:
+                similar.append((image, distance))
+        return similar
+
+    async def get_items(self, item_ids: list[str], attributes: Optional[tuple] = None) -> dict[str, dict]:
+        """
+        Reads raw items by id with BatchGetItem (100 keys per call, bounded
+        concurrency, unprocessed keys retried); missing items are left out.
+        Gives 503 if some keys stay unprocessed.
+        """
+        client = self.table.meta.client
+        table_name = self.table.name
+        projection = {}
+        if attributes:
+            projection = {'ProjectionExpression': ', '.join(f'#p{i}' for i in range(len(attributes))),
+                          'ExpressionAttributeNames': {f'#p{i}': name for i, name in enumerate(attributes)}}
+        items = {}
+
+        async def fetch(chunk: list[str]):
+            request_items = {table_name: {'Keys': [{'id': item_id} for item_id in chunk], **projection}}
+            for attempt in range(settings.BATCH_MAX_RETRIES + 1):
+                response = await client.batch_get_item(RequestItems=request_items)
+                for item in response.get('Responses', {}).get(table_name, []):
+                    items[item['id']] = item
+                request_items = response.get('UnprocessedKeys')
+                if not request_items:
+                    return
+                await asyncio.sleep(_retry_delay(attempt))
+            raise HTTPException(status_code=503, detail="Could not read all items, retry",
+                                headers={"Retry-After": "1"})
+
+        await gather_bounded((fetch(chunk) for chunk in chunked(item_ids, DYNAMO_GET_BATCH)),
+                             settings.BATCH_CONCURRENCY)
+        return items
+
+    async def get_facets(self, limit: int) -> dict[str, dict[str, int]]:
+        """
+        Image counts by tag (the `limit` most used as of the last rollup),
+        content type and upload day. Starts from the rolled-up summary and
+        reads the live shards of those counters, and of the days since the
+        rollup, with BatchGetItem; older days keep their rolled-up counts.
+        A summary that is missing (fresh table) or older than
+        FACET_SUMMARY_MAX_AGE (the scheduled rollup isn't running) is rolled
+        up first. Served from the facet cache while fresh.
+        """
+        cached = self.facet_cache.get(limit) if self.facet_cache is not None else None
+        if cached is not None:
+            return cached
+
+        summary = (await self.table.get_item(Key={'id': FACET_SUMMARY_ITEM_ID})).get('Item')
+        max_age = (datetime.utcnow() - timedelta(seconds=settings.FACET_SUMMARY_MAX_AGE)).isoformat()
+        if summary is None or summary['rolled_up_at'] < max_age:
+            await rollup(self.table)
+            summary = (await self.table.get_item(Key={'id': FACET_SUMMARY_ITEM_ID}, ConsistentRead=True)).get('Item')
+        summary = summary or {}
+        keys = [*(f"tag#{tag}" for tag in top_tags(summary.get('tags', {}), limit)),
+                *(f"type#{content_type}" for content_type in summary.get('content_types', {})),
+                *(f"day#{day}" for day in days_since(summary.get('rolled_up_at')))]
+        items = await self.get_items([facet_item_id(key, shard) for key in keys
+                                      for shard in range(settings.FACET_SHARDS)], COUNTER_ATTRIBUTES)
+        facets = group_counts(sum_counters(list(items.values())))
+        facets['days'] = {**{day: int(count) for day, count in summary.get('days', {}).items()
+                             if f"day#{day}" not in keys}, **facets['days']}
+        if self.facet_cache is not None:
+            self.facet_cache.put(limit, facets)
+        return facets
+
+    async def get_changes(self, since: Optional[list[int]], limit: int) -> tuple[list[dict], list[int], bool]:
+        """
+        Reads the change log entries after the per-partition positions in
+        `since` (None: start from the current heads), at most `limit` of
+        them, shared round-robin between the partitions so none falls
+        behind. Returns the entries (in log order per partition), the new
+        positions and whether more entries are waiting.
+        """
+        partitions = range(settings.CHANGE_PARTITIONS)
+        heads = await self.get_items([change_head_item_id(partition) for partition in partitions])
+        heads = [heads.get(change_head_item_id(partition), {}) for partition in partitions]
+        tips = [int(head.get('seq', 0)) for head in heads]
+        if since is None:
+            return [], tips, False
+
+        for partition in partitions:
+            if since[partition] > tips[partition]:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            if since[partition] < int(heads[partition].get('horizon', 0)):
+                raise HTTPException(status_code=410, detail="Cursor is older than the change log retention, "
+                                                            "list images again and restart")
+
+        wanted = {partition: [] for partition in partitions}
+        budget, offset = limit, 1
+        while budget:
+            progressed = False
+            for partition in partitions:
+                seq = since[partition] + offset
+                if budget and seq <= tips[partition]:
+                    wanted[partition].append(seq)
+                    budget -= 1
+                    progressed = True
+            if not progressed:
+                break
+            offset += 1
+
+        items = await self.get_items([change_item_id(partition, seq)
+                                      for partition, seqs in wanted.items() for seq in seqs])
+        cutoff = settle_cutoff()
+        entries, positions = [], []
+        for partition in partitions:
+            fetched = {seq: items[change_item_id(partition, seq)] for seq in wanted[partition]
+                       if change_item_id(partition, seq) in items}
+            delivered, position = select_changes(since[partition], wanted[partition], fetched,
+                                                 heads[partition].get('bumped_at', '') <= cutoff, cutoff)
+            entries.extend(delivered)
+            positions.append(position)
+        more = any(since[partition] + len(wanted[partition]) < tips[partition] for partition in partitions)
+        return entries, positions, more
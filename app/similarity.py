@@ -0,0 +1,271 @@
+"""
+Near-duplicate detection with 64-bit perceptual hashes.
+
+Every image gets a pHash (DCT of a 32x32 grayscale, low frequencies
+thresholded at their median), stored on the item as 16 hex digits. Visually
+similar images have hashes a small Hamming distance apart, whatever their
+encoding, size or EXIF orientation.
+
+All hashes live in an in-process NumPy index (one packed uint64 array), so
+a query is an XOR plus popcount over the whole array, done in blocks to
+bound the temporaries. NumPy is imported on first use to keep it off the
+cold-start path.
+"""
+import asyncio
+import io
+import time
+from concurrent.futures import BrokenExecutor
+from typing import Optional
+
+from fastapi import HTTPException
+from app.config import settings
+from app.models import ImageMetadata
+
+HASH_SIZE = 8 # 8x8 low frequencies = 64 bits
+SAMPLE_SIZE = 32
+QUERY_BLOCK = 1 << 20 # Hashes compared per vectorized step (8 MiB of uint64)
+
+_dct_matrix = None
+
+
+def _dct(np):
+    global _dct_matrix
+    if _dct_matrix is None:
+        # Orthonormal DCT-II, so low-frequency coefficients are comparable in scale
+        n = np.arange(SAMPLE_SIZE)
+        matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * SAMPLE_SIZE)) * np.sqrt(2 / SAMPLE_SIZE)
+        matrix[0] /= np.sqrt(2)
+        _dct_matrix = matrix
+    return _dct_matrix
+
+
+def perceptual_hash(body: bytes) -> Optional[str]:
+    """
+    pHash of an encoded image as 16 hex digits, or None if it cannot be
+    decoded. Runs in the rendition worker pool, so it only takes and returns
+    plain values.
+    """
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(io.BytesIO(body)) as original:
+            # Let the JPEG decoder downscale while decoding; the hash only needs 32x32
+            original.draft("L", (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+            image = ImageOps.exif_transpose(original).convert("L")
+            image = image.resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.Resampling.BOX)
+    except Exception:
+        return None
+    pixels = np.asarray(image, dtype=np.float64)
+    dct = _dct(np)
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+    bits = np.packbits(low > np.median(low))
+    return bits.tobytes().hex()
+
+
+def hamming(a: str, b: str) -> int:
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+async def compute_hash(body: bytes) -> Optional[str]:
+    """perceptual_hash() off the event loop, in the rendition worker pool."""
+    from app.renditions import renditions
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(renditions.executor(), perceptual_hash, body)
+    except BrokenExecutor as e:
+        renditions.close()
+        print(f"Hash worker failed: {e}")
+        return None
+
+
+class SimilarityIndex:
+    """
+    In-process index of every image's perceptual hash.
+
+    Hashes are packed into one uint64 array (slots 0..n-1, kept dense by
+    moving the last entry into a removed slot) next to a list of image ids.
+    Like the search index it is built by a Scan on first use, kept current
+    by DatabaseService writes in this process and rebuilt in the background
+    after SIMILAR_INDEX_TTL seconds.
+    """
+
+    def __init__(self):
+        self._hashes = None # numpy.ndarray[uint64], with spare capacity past _count
+        self._count = 0
+        self._ids: list[str] = []
+        self._slots: dict[str, int] = {}
+        self.built_at: Optional[float] = None
+        self._building: Optional[asyncio.Task] = None
+        # Writes seen while a rebuild is scanning, replayed onto the new index
+        self._pending: Optional[list[tuple[str, object]]] = None
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at is not None
+
+    # --- maintenance -------------------------------------------------------
+
+    def add(self, image: ImageMetadata):
+        if self._pending is not None:
+            self._pending.append(("add", image))
+        if not self.ready and self._building is None:
+            return
+        self._add(image)
+
+    def remove(self, image_id: str):
+        if self._pending is not None:
+            self._pending.append(("remove", image_id))
+        self._remove(image_id)
+
+    def _add(self, image: ImageMetadata):
+        if image.status != "ready" or image.phash is None:
+            self._remove(image.id)
+            return
+        import numpy as np
+
+        value = int(image.phash, 16)
+        slot = self._slots.get(image.id)
+        if slot is not None:
+            self._hashes[slot] = value
+            return
+        if self._hashes is None or self._count == len(self._hashes):
+            grown = np.zeros(max(1024, self._count * 2), dtype=np.uint64)
+            if self._hashes is not None:
+                grown[:self._count] = self._hashes[:self._count]
+            self._hashes = grown
+        slot = self._count
+        self._hashes[slot] = value
+        self._ids.append(image.id)
+        self._slots[image.id] = slot
+        self._count += 1
+
+    def _remove(self, image_id: str):
+        slot = self._slots.pop(image_id, None)
+        if slot is None:
+            return
+        last = self._count - 1
+        if slot != last:
+            moved = self._ids[last]
+            self._hashes[slot] = self._hashes[last]
+            self._ids[slot] = moved
+            self._slots[moved] = slot
+        self._ids.pop()
+        self._count = last
+
+    def load(self, ids: list[str], hashes: list[str]):
+        """Replaces the contents in one go (rebuilds, benchmarks)."""
+        import numpy as np
+
+        self._hashes = np.fromiter((int(value, 16) for value in hashes), dtype=np.uint64, count=len(hashes))
+        self._ids = list(ids)
+        self._slots = {image_id: slot for slot, image_id in enumerate(self._ids)}
+        self._count = len(self._ids)
+
+    async def ensure(self, table):
+        """Builds the index on first use and schedules a refresh once it is stale."""
+        if self.ready:
+            if time.monotonic() - self.built_at > settings.SIMILAR_INDEX_TTL and self._building is None:
+                self._building = asyncio.create_task(self.rebuild(table))
+            return
+        if self._building is None:
+            self._building = asyncio.create_task(self.rebuild(table))
+        await asyncio.shield(self._building)
+
+    async def rebuild(self, table):
+        """Re-reads every image's hash with a parallel Scan and swaps in the fresh index."""
+        from app.search import scan_images
+
+        try:
+            self._pending = []
+            started = time.perf_counter()
+            items = [item for item in await scan_images(table, settings.SEARCH_SCAN_SEGMENTS,
+                                                        ('id', 'status', 'phash'))
+                     if item.get('phash') and item.get('status', 'ready') == 'ready']
+            fresh = SimilarityIndex()
+            fresh.load([item['id'] for item in items], [item['phash'] for item in items])
+            for op, value in self._pending:
+                if op == "add":
+                    fresh._add(value)
+                else:
+                    fresh._remove(value)
+            self._hashes, self._count, self._ids, self._slots = fresh._hashes, fresh._count, fresh._ids, fresh._slots
+            self.built_at = time.monotonic()
+            print(f"Similarity index built: {len(self)} hashes in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            if not self.ready:
+                raise
+            print(f"Similarity index refresh failed: {e}")
+        finally:
+            self._pending = None
+            self._building = None
+
+    # --- queries -----------------------------------------------------------
+
+    def query(self, phash: str, max_distance: int, limit: int,
+              exclude: Optional[str] = None) -> list[tuple[str, int]]:
+        """
+        Up to `limit` (id, distance) pairs within `max_distance` bits of
+        `phash`, nearest first. Each block keeps only its own `limit` best
+        candidates, so the merge stays small even for loose thresholds.
+        """
+        if not self._count or limit <= 0:
+            return []
+        import numpy as np
+
+        target = np.uint64(int(phash, 16))
+        keep = limit + (exclude is not None)
+        slots, distances = [], []
+        for start in range(0, self._count, QUERY_BLOCK):
+            block = self._hashes[start:min(start + QUERY_BLOCK, self._count)]
+            distance = np.bitwise_count(block ^ target)
+            within = distance <= max_distance
+            if np.count_nonzero(within) > keep:
+                # Distances are 0..64, so a histogram finds the cutoff for the block's
+                # best `keep` without sorting; only entries up to it are materialized
+                reached = np.cumsum(np.bincount(distance, minlength=65))
+                within = distance <= int(np.searchsorted(reached, keep))
+            hits = np.flatnonzero(within)
+            if len(hits) > keep:
+                hits = hits[np.argpartition(distance[hits], keep - 1)[:keep]]
+            slots.append(hits + start)
+            distances.append(distance[hits])
+        slots, distances = np.concatenate(slots), np.concatenate(distances)
+        order = np.lexsort((slots, distances))
+        matches = [(self._ids[slot], int(distance))
+                   for slot, distance in zip(slots[order].tolist(), distances[order].tolist())
+                   if self._ids[slot] != exclude]
+        return matches[:limit]
+
+
+async def hash_image(image: ImageMetadata, storage, db) -> ImageMetadata:
+    """Computes and records the hash of a stored image that has none yet."""
+    if image.phash is not None or not image.content_type.startswith("image/"):
+        return image
+    image = await db.refresh_metadata(image)
+    if image.phash is not None:
+        return image
+    body = await storage.get_file(image.filename, max_size=settings.RENDITION_MAX_SOURCE_SIZE)
+    phash = await compute_hash(body)
+    if phash is None:
+        raise HTTPException(status_code=422, detail="Cannot hash image")
+    if not await db.save_phash(image, phash):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return image
+
+
+async def hash_in_background(image: ImageMetadata, storage, db):
+    """Background-task variant of hash_image(): failures are logged, not raised."""
+    try:
+        await hash_image(image, storage, db)
+    except HTTPException as e:
+        print(f"Could not hash {image.id}: {e.detail}")
+    except Exception as e:
+        print(f"Could not hash {image.id}: {e}")
+
+
+similarity_index = SimilarityIndex()
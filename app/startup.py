@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+class StartupReport:
+    """
+    Records how long each cold-start phase takes (imports, SSM, client setup)
+    and the time to the first response, measured from the moment this module
+    was imported (handler.py imports it first). Emitted once as a JSON log
+    line when STARTUP_REPORT=1 is set in the environment.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.first_response_ms: float = None
+        self.emitted = False
+
+    @property
+    def enabled(self) -> bool:
+        return os.environ.get("STARTUP_REPORT", "").lower() in ("1", "true", "yes")
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def first_response(self):
+        if self.first_response_ms is not None:
+            return
+        self.first_response_ms = (time.perf_counter() - self.origin) * 1000
+        self.emit()
+
+    def as_dict(self) -> dict:
+        return {
+            "startup_report": True,
+            "phases_ms": {name: round(ms, 2) for name, ms in self.phases.items()},
+            "time_to_first_response_ms": round(self.first_response_ms, 2) if self.first_response_ms else None,
+            "modules_loaded": len(sys.modules),
+        }
+
+    def emit(self):
+        if self.enabled and not self.emitted:
+            self.emitted = True
+            print(json.dumps(self.as_dict()), flush=True)
+
+
+report = StartupReport()
+
+
+class FirstResponseMiddleware:
+    """Pure ASGI middleware marking when the first HTTP response starts."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or report.first_response_ms is not None:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                report.first_response()
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
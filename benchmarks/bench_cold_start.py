@@ -0,0 +1,87 @@
+"""
+Benchmark: Lambda cold start (import of handler.py + first request).
+
+Every run is a fresh interpreter that imports `handler` and invokes it with a
+synthetic API Gateway (REST) event, the way the Lambda runtime does, against a
+local moto server. Reports the median import time, first-response time and
+the startup report phases (see app/startup.py).
+
+    python -m benchmarks.bench_cold_start [--runs 5] [--path /images/?limit=10] [--importtime]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import local_aws, BENCH_BUCKET, BENCH_TABLE
+
+CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+import handler
+imported = time.perf_counter()
+path, _, query = sys.argv[1].partition("?")
+params = dict(p.split("=", 1) for p in query.split("&") if p) or None
+event = {
+    "resource": "/{proxy+}", "path": path, "httpMethod": "GET",
+    "headers": {"Host": "bench"}, "multiValueHeaders": {"Host": ["bench"]},
+    "queryStringParameters": params,
+    "multiValueQueryStringParameters": {k: [v] for k, v in params.items()} if params else None,
+    "requestContext": {"resourcePath": "/{proxy+}", "httpMethod": "GET", "path": path,
+                       "stage": "dev", "identity": {"sourceIp": "127.0.0.1"}},
+    "pathParameters": None, "stageVariables": None, "body": None, "isBase64Encoded": False,
+}
+response = handler.handler(event, None)
+done = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_response_ms": (done - start) * 1000,
+                  "status": response["statusCode"], "report": handler.report.as_dict()}))
+"""
+
+
+def run_once(endpoint: str, path: str) -> dict:
+    env = dict(os.environ, AWS_ENDPOINT_URL=endpoint, AWS_LAMBDA_FUNCTION_NAME="bench-cold-start",
+               BUCKET_NAME=BENCH_BUCKET, TABLE_NAME=BENCH_TABLE, ENV="dev", STARTUP_REPORT="0")
+    out = subprocess.run([sys.executable, "-c", CHILD, path], env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def import_breakdown(top: int = 15):
+    """Prints the slowest top-level imports of handler.py from `python -X importtime`."""
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import handler"],
+                         check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in err.splitlines()[1:]:
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace(":", "|", 1).split("|")]
+        rows.append((int(cumulative_us), name))
+    print(f"\nslowest imports (cumulative):")
+    for cumulative_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/images/?limit=10")
+    parser.add_argument("--importtime", action="store_true", help="also print the import breakdown")
+    args = parser.parse_args()
+
+    with local_aws() as endpoint:
+        # One untimed run creates the bucket/table and warms the .pyc cache
+        subprocess.run([sys.executable, "-c", "import asyncio\nfrom benchmarks.common import configure, bootstrap\n"
+                        f"configure({endpoint!r})\nasyncio.run(bootstrap())"], check=True, capture_output=True)
+        runs = [run_once(endpoint, args.path) for _ in range(args.runs + 1)][1:]
+
+    print(f"GET {args.path}: status {runs[0]['status']}, median of {len(runs)} cold starts")
+    print(f"  import handler        {statistics.median(r['import_ms'] for r in runs):8.1f} ms")
+    print(f"  time to first response {statistics.median(r['first_response_ms'] for r in runs):7.1f} ms")
+    for phase in runs[0]["report"]["phases_ms"]:
+        print(f"    {phase:<20} {statistics.median(r['report']['phases_ms'].get(phase, 0) for r in runs):8.1f} ms")
+    if args.importtime:
+        import_breakdown()
+
+
+if __name__ == "__main__":
+    main()
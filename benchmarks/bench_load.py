@@ -0,0 +1,281 @@
+"""
+Load test: drives the image API in-process against a local AWS stand-in.
+
+Seeds a metadata table with --rows images (tags drawn from a uniform or
+Zipf-skewed distribution), then runs each workload through the ASGI app with
+--concurrency requests in flight and reports throughput, p50/p95/p99 latency,
+errors and peak RSS. Results are written as JSON (per commit) and can be
+compared against an earlier run to catch regressions:
+
+    python -m benchmarks.bench_load --rows 10000 --concurrency 16 --requests 2000
+    python -m benchmarks.bench_load --compare benchmarks/results/load-<sha>.json
+
+Workloads: upload (POST /images/), list (GET /images/?tag=..), get
+(GET /images/{id}) and delete (DELETE /images/{id}). Seeding a large table is
+slow with moto; point BENCH_AWS_ENDPOINT at a running stand-in and pass
+--reuse-seed to seed it only once.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from httpx import AsyncClient
+
+from benchmarks.common import local_aws, configure, bootstrap, peak_rss_mb, percentile
+from app.config import settings
+
+WORKLOADS = ("upload", "list", "get", "delete")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+BODY = b"\xff\xd8" + b"\0" * 16 * 1024
+
+
+class TagPool:
+    """Draws 0-3 tags per image from `count` tags, uniformly or Zipf-skewed."""
+
+    def __init__(self, count: int, distribution: str, rng: random.Random):
+        self.tags = [f"tag{i:04d}" for i in range(count)]
+        self.rng = rng
+        self.weights = None
+        if distribution == "zipf":
+            self.weights = [1 / (rank + 1) ** 1.1 for rank in range(count)]
+
+    def sample(self) -> str:
+        return self.rng.choices(self.tags, weights=self.weights)[0]
+
+    def sample_set(self) -> list[str]:
+        return sorted({self.sample() for _ in range(self.rng.randint(0, 3))})
+
+
+def git_revision() -> tuple[str, bool]:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True).stdout.strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+async def write_images(rows: int, pool: TagPool) -> list[str]:
+    """Writes `rows` image items (plus their tag items) straight to the table; returns their ids."""
+    from app.clients import clients
+    from app.models import ImageMetadata
+    from app.services import gather_bounded, chunked, image_entity, tag_item_id, DYNAMO_WRITE_BATCH
+
+    table = await clients.table()
+    start = datetime.utcnow()
+    items, ids = [], []
+    for i in range(rows):
+        image_id = str(uuid.uuid4())
+        ids.append(image_id)
+        metadata = ImageMetadata(id=image_id, filename=f"{image_id}.jpg", size=len(BODY),
+                                 content_type="image/jpeg", tags=pool.sample_set(),
+                                 created_at=(start - timedelta(seconds=i)).isoformat())
+        item = metadata.model_dump()
+        items.append({**item, 'entity': image_entity(image_id)})
+        items.extend({**item, 'id': tag_item_id(tag, image_id), 'image_id': image_id, 'tag_key': tag}
+                     for tag in metadata.tags)
+
+    client = table.meta.client
+
+    async def write(chunk: list[dict]):
+        request_items = {table.name: [{'PutRequest': {'Item': item}} for item in chunk]}
+        while request_items:
+            response = await client.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems')
+
+    await gather_bounded((write(chunk) for chunk in chunked(items, DYNAMO_WRITE_BATCH)), 16)
+    return ids
+
+
+async def seed(rows: int, pool: TagPool, rng: random.Random, reuse: bool) -> list[str]:
+    """
+    Seeds the table with `rows` images and returns a sample of their ids for
+    the read workloads. The sample is stored in a marker item so --reuse-seed
+    can skip seeding; no workload deletes sampled images, so it stays valid.
+    """
+    from app.clients import clients
+
+    table = await clients.table()
+    marker = {'id': f"bench#seed#{rows}"}
+    if reuse:
+        existing = (await table.get_item(Key=marker)).get('Item')
+        if existing:
+            print(f"reusing seeded table ({rows} rows)")
+            return list(existing['sample_ids'])
+
+    began = time.perf_counter()
+    ids = await write_images(rows, pool)
+    print(f"seeded {rows} images in {time.perf_counter() - began:.1f}s")
+
+    sample_ids = rng.sample(ids, min(len(ids), 2000))
+    await table.put_item(Item={**marker, 'sample_ids': sample_ids})
+    return sample_ids
+
+
+async def drive(client: AsyncClient, requests: int, concurrency: int, make_request) -> dict:
+    """Runs `requests` requests with `concurrency` in flight; returns the stats."""
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            start = time.perf_counter()
+            response = await make_request(client, i)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    began = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - began
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def run(args) -> dict:
+    from app.main import app
+    from app.clients import clients
+
+    rng = random.Random(args.seed)
+    pool = TagPool(args.tags, args.distribution, rng)
+    await bootstrap()
+    seeded_ids = await seed(args.rows, pool, rng, args.reuse_seed)
+    uploaded: list[str] = []
+
+    async def upload(client, i):
+        files = {'file': (f"load_{i}.jpg", BODY, 'image/jpeg')}
+        response = await client.post("/images/", files=files, data={"tags": pool.sample_set()})
+        if response.status_code == 200:
+            uploaded.append(response.json()["id"])
+        return response
+
+    async def list_images(client, i):
+        if i % 4 == 0:
+            return await client.get("/images/", params={"limit": args.page_size})
+        return await client.get("/images/", params={"tag": pool.sample(), "limit": args.page_size})
+
+    async def get(client, i):
+        return await client.get(f"/images/{rng.choice(seeded_ids)}")
+
+    victims: list[str] = []
+
+    async def delete(client, i):
+        # Only images created in this run, so the seeded sample survives for later runs
+        return await client.delete(f"/images/{victims.pop()}")
+
+    handlers = {"upload": upload, "list": list_images, "get": get, "delete": delete}
+    results = {}
+    async with AsyncClient(app=app, base_url="http://bench") as client:
+        # Warm up the shared clients and the presigner
+        await client.get("/images/", params={"limit": 1})
+        for name in args.workloads:
+            if name == "delete":
+                # Uploaded images first (they have objects), topped up with fresh rows
+                victims.extend(await write_images(max(0, args.requests - len(uploaded)), pool))
+                victims.extend(uploaded)
+            results[name] = await drive(client, args.requests, args.concurrency, handlers[name])
+            print_row(name, results[name])
+    await clients.close()
+    return results
+
+
+def print_row(name: str, result: dict):
+    print(f"{name:<8} {result['throughput_rps']:>9.1f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+          f"{result['p99_ms']:>8.2f} {result['errors']:>7} {result['peak_rss_mb']:>8.1f}")
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Regressions of more than `threshold` (fraction) in throughput or p95/p99."""
+    regressions = []
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        for metric, higher_is_better in (("throughput_rps", True), ("p95_ms", False), ("p99_ms", False)):
+            value, previous = result[metric], before[metric]
+            change = (value - previous) / previous if previous else 0.0
+            worse = -change > threshold if higher_is_better else change > threshold
+            print(f"  {name:<8} {metric:<15} {previous:>9.2f} -> {value:>9.2f} ({change:+.1%})"
+                  + ("  REGRESSION" if worse else ""))
+            if worse:
+                regressions.append(f"{name} {metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="seeded metadata rows (10k-1M)")
+    parser.add_argument("--tags", type=int, default=200, help="number of distinct tags")
+    parser.add_argument("--distribution", choices=("uniform", "zipf"), default="zipf")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per workload")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument("--no-cache", action="store_true", help="disable the metadata cache")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reuse-seed", action="store_true", help="skip seeding if this row count was seeded")
+    parser.add_argument("--output", help="result file (default benchmarks/results/load-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed regression (fraction)")
+    args = parser.parse_args()
+
+    if args.no_cache:
+        import app.cache
+        import app.routers.images
+        app.cache.metadata_cache = app.routers.images.metadata_cache = None
+    # Rendering the synthetic bodies is not what is measured here
+    settings.RENDITIONS_ON_UPLOAD = False
+    settings.METRICS_EMF = False
+
+    print(f"{'workload':<8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'RSS MB':>8}")
+    with local_aws() as endpoint:
+        configure(endpoint)
+        results = asyncio.run(run(args))
+
+    sha, dirty = git_revision()
+    report = {
+        "commit": sha,
+        "dirty": dirty,
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{sha}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print("warning: baseline was run with a different configuration")
+        print(f"compared with {baseline.get('commit')}:")
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
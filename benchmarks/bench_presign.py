@@ -0,0 +1,83 @@
+"""
+Microbenchmark: presigned download URL generation.
+
+Compares, for 1k and 10k keys:
+  per-item   - the previous path: a new aioboto3 S3 client per URL (sampled
+               and extrapolated, it is too slow to run for every key)
+  client     - one shared aiobotocore client, generate_presigned_url per key
+  batched    - PresignService.sign_many with a cold URL cache
+  cached     - the same batch again with a warm URL cache
+
+No network access is needed; signing is local in every variant.
+
+    python -m benchmarks.bench_presign [--sizes 1000 10000] [--sample 200]
+"""
+import argparse
+import asyncio
+import time
+
+import aioboto3
+
+from app.config import settings
+from app.presign import PresignService
+
+BUCKET = "bench-bucket"
+CLIENT_KWARGS = dict(region_name="us-east-1", endpoint_url="http://127.0.0.1:4566",
+                     aws_access_key_id="test", aws_secret_access_key="test")
+
+
+async def per_item(session, keys):
+    for key in keys:
+        async with session.client("s3", **CLIENT_KWARGS) as s3:
+            await s3.generate_presigned_url("get_object", Params={"Bucket": BUCKET, "Key": key},
+                                            ExpiresIn=3600)
+
+
+async def shared_client(s3, keys):
+    for key in keys:
+        await s3.generate_presigned_url("get_object", Params={"Bucket": BUCKET, "Key": key},
+                                        ExpiresIn=3600)
+
+
+def report(name, n, seconds, extrapolated=False):
+    note = " (extrapolated)" if extrapolated else ""
+    print(f"  {name:<10} {seconds * 1000:10.1f} ms total  {seconds / n * 1e6:9.1f} us/key{note}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--sample", type=int, default=200, help="keys timed for the per-item variant")
+    args = parser.parse_args()
+
+    settings.AWS_ENDPOINT_URL = CLIENT_KWARGS["endpoint_url"]
+    settings.AWS_REGION = CLIENT_KWARGS["region_name"]
+    session = aioboto3.Session()
+
+    async with session.client("s3", **CLIENT_KWARGS) as s3:
+        for n in args.sizes:
+            keys = [f"{i:08d}-bench.jpg" for i in range(n)]
+            print(f"{n} keys")
+
+            sample = keys[:min(n, args.sample)]
+            start = time.perf_counter()
+            await per_item(session, sample)
+            report("per-item", n, (time.perf_counter() - start) * n / len(sample), extrapolated=len(sample) < n)
+
+            start = time.perf_counter()
+            await shared_client(s3, keys)
+            report("client", n, time.perf_counter() - start)
+
+            service = PresignService()
+            signer = await service.signer(s3)
+            start = time.perf_counter()
+            service.sign_many(signer, BUCKET, keys)
+            report("batched", n, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            service.sign_many(signer, BUCKET, keys)
+            report("cached", n, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Microbenchmark: serializing a listing page of ImageMetadata to JSON.
+
+Compares, for 1k and 10k items:
+  fastapi    - the previous path: response_model validation, jsonable_encoder
+               and the stdlib JSONResponse renderer
+  orjson     - orjson over model_dump() (skipped if orjson is not installed)
+  direct     - cached_response's path: model_dump_json() in pydantic-core
+  projected  - direct with ?fields=id,download_url,tags
+  compact    - direct with ?compact=true (null fields omitted)
+
+Reports wall time per page and the peak of traced allocations (tracemalloc,
+measured in a separate run so it does not skew the timing).
+
+    python -m benchmarks.bench_serialize [--sizes 1000 10000] [--repeat 5]
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.models import ImageInfo, ImageMetadata, ImagePage
+from app.routers.images import _page_include
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_page(n: int) -> ImagePage:
+    items = [ImageMetadata(id=f"{i:08d}-0000-4000-8000-000000000000", filename=f"{i:08d}.jpg", size=250_000 + i,
+                           content_type="image/jpeg", created_at="2026-01-01T00:00:00", tags=["travel", "beach"],
+                           description="Sunset over the bay" if i % 2 else None,
+                           download_url=f"https://testagram-images.s3.amazonaws.com/{i:08d}.jpg?X-Amz-Signature="
+                                        + "0" * 64,
+                           info=ImageInfo(width=4032, height=3024, format="JPEG"))
+             for i in range(n)]
+    return ImagePage(items=items, limit=n, next_cursor="eyJpZCI6IjAwMDAwMDAwIn0")
+
+
+def variants():
+    field = create_response_field(name="response", type_=ImagePage)
+    projection = _page_include(ImagePage, {"id", "download_url", "tags"})
+
+    async def fastapi_path(page):
+        content = await serialize_response(field=field, response_content=page)
+        return JSONResponse(content).body
+
+    async def orjson_path(page):
+        return orjson.dumps(page.model_dump())
+
+    async def direct(page):
+        return page.model_dump_json().encode()
+
+    async def projected(page):
+        return page.model_dump_json(include=projection).encode()
+
+    async def compact(page):
+        return page.model_dump_json(exclude_none=True).encode()
+
+    yield "fastapi", fastapi_path
+    if orjson is not None:
+        yield "orjson", orjson_path
+    yield "direct", direct
+    yield "projected", projected
+    yield "compact", compact
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        page = make_page(n)
+        print(f"{n} items")
+        for name, serialize in variants():
+            body = await serialize(page)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                await serialize(page)
+            seconds = (time.perf_counter() - start) / args.repeat
+
+            tracemalloc.start()
+            await serialize(page)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  {name:<10} {seconds * 1000:9.1f} ms  {seconds / n * 1e6:7.2f} us/item  "
+                  f"peak {peak / 2**20:7.1f} MiB  body {len(body) / 2**20:6.2f} MiB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
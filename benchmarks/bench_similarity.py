@@ -0,0 +1,81 @@
+"""
+Microbenchmark: similarity index queries (Hamming distance over packed
+64-bit perceptual hashes).
+
+For 100k, 1M and 10M random hashes, reports the index memory and the
+p50/p99 latency of
+  threshold  - neighbours within SIMILAR_MAX_DISTANCE bits, top 20
+  top-k      - the 10 nearest hashes at any distance (worst case for the merge)
+Queries are existing hashes with a few bits flipped, so every one has hits.
+
+No AWS access is needed.
+
+    python -m benchmarks.bench_similarity [--sizes 100000 1000000 10000000] [--queries 50]
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.similarity import SimilarityIndex
+
+
+class _Ids:
+    """Stands in for the id list, so 10M ids don't dominate the process's memory."""
+
+    def __init__(self, n: int):
+        self.n = n
+
+    def __getitem__(self, slot: int) -> str:
+        return f"id{slot}"
+
+    def __len__(self):
+        return self.n
+
+
+def build(n: int, rng) -> SimilarityIndex:
+    index = SimilarityIndex()
+    index._hashes = rng.integers(0, 2**64, size=n, dtype=np.uint64)
+    index._ids = _Ids(n)
+    index._count = n
+    return index
+
+
+def run(index: SimilarityIndex, queries: list[str], max_distance: int, limit: int) -> list[float]:
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.query(query, max_distance, limit)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"  {name:<10} p50 {statistics.median(timings) * 1000:8.2f} ms  p99 {p99 * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+
+    for n in args.sizes:
+        index = build(n, rng)
+        print(f"{n} hashes ({index._hashes.nbytes / 2**20:.0f} MiB)")
+        queries = []
+        for slot in rng.integers(0, n, size=args.queries):
+            flips = rng.choice(64, size=3, replace=False)
+            value = int(index._hashes[slot]) ^ sum(1 << int(bit) for bit in flips)
+            queries.append(f"{value:016x}")
+        report("threshold", run(index, queries, settings.SIMILAR_MAX_DISTANCE, 20))
+        report("top-k", run(index, queries, 64, 10))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark: peak RSS and throughput of image ingest.
+
+Each (mode, size) pair runs in a fresh subprocess so peak RSS is not carried
+over between runs. Modes:
+  stream - POST /images/stream, body piped into an S3 multipart upload
+  form   - POST /images/ multipart form (spooled by python-multipart first)
+
+    python -m benchmarks.bench_stream_upload [--sizes-mb 1 100 1024] [--modes stream form]
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.common import local_aws, configure, bootstrap, peak_rss_mb
+
+CHUNK = b"\0" * (64 * 1024)
+
+
+class ZeroFile:
+    """File-like object producing `size` zero bytes without holding them."""
+
+    def __init__(self, size: int):
+        self.remaining = size
+
+    def read(self, n: int = -1) -> bytes:
+        n = self.remaining if n < 0 else min(n, self.remaining)
+        self.remaining -= n
+        return bytes(n)
+
+
+async def body(size: int):
+    remaining = size
+    while remaining > 0:
+        chunk = CHUNK if remaining >= len(CHUNK) else CHUNK[:remaining]
+        remaining -= len(chunk)
+        yield chunk
+
+
+async def worker(endpoint: str, mode: str, size: int) -> dict:
+    configure(endpoint)
+    from app.main import app
+    from app.clients import clients
+
+    await bootstrap()
+    baseline = peak_rss_mb()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        if mode == "stream":
+            response = await client.post("/images/stream?filename=bench.jpg", content=body(size),
+                                         headers={"content-type": "image/jpeg"})
+        else:
+            files = {"file": ("bench.jpg", ZeroFile(size), "image/jpeg")}
+            response = await client.post("/images/", files=files)
+        elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    await clients.close()
+    return {"mode": mode, "size_mb": size / 2 ** 20, "seconds": elapsed,
+            "throughput_mb_s": size / 2 ** 20 / elapsed,
+            "baseline_rss_mb": baseline, "peak_rss_mb": peak_rss_mb()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 100, 1024])
+    parser.add_argument("--modes", nargs="+", default=["stream", "form"], choices=["stream", "form"])
+    parser.add_argument("--worker", nargs=3, metavar=("ENDPOINT", "MODE", "BYTES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        endpoint, mode, size = args.worker
+        print(json.dumps(asyncio.run(worker(endpoint, mode, int(size)))))
+        return
+
+    with local_aws() as endpoint:
+        print(f"{'mode':<7} {'size':>8} {'seconds':>8} {'MB/s':>8} {'base RSS':>9} {'peak RSS':>9}")
+        for size_mb in args.sizes_mb:
+            for mode in args.modes:
+                out = subprocess.run([sys.executable, "-m", "benchmarks.bench_stream_upload",
+                                      "--worker", endpoint, mode, str(size_mb * 2 ** 20)],
+                                     check=True, capture_output=True, text=True).stdout
+                r = json.loads(out.strip().splitlines()[-1])
+                print(f"{r['mode']:<7} {size_mb:>6}MB {r['seconds']:8.2f} {r['throughput_mb_s']:8.1f} "
+                      f"{r['baseline_rss_mb']:7.0f}MB {r['peak_rss_mb']:7.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: p50/p99 latency of the upload and delete write paths.
+
+  sequential - the previous flow: upload -> save -> sign, get -> delete object -> delete row
+  concurrent - finalize_upload / remove_image as used by the API
+
+Runs against a local moto server. Local calls take ~1 ms, so --rtt-ms adds an
+artificial delay to every AWS request to approximate a real network round trip.
+
+    python -m benchmarks.bench_write_paths [--iterations 200] [--rtt-ms 10]
+"""
+import argparse
+import asyncio
+import io
+import time
+import uuid
+from datetime import datetime
+
+from fastapi import UploadFile
+
+from benchmarks.common import local_aws, configure, bootstrap, percentile
+from app.clients import clients
+from app.models import ImageMetadata
+from app.routers.images import finalize_upload, remove_image
+from app.services import StorageService, DatabaseService
+
+BODY = b"\xff\xd8" + b"\0" * 32 * 1024
+
+
+def new_metadata() -> ImageMetadata:
+    image_id = str(uuid.uuid4())
+    return ImageMetadata(id=image_id, filename=f"{image_id}.jpg", size=len(BODY),
+                         content_type="image/jpeg", created_at=datetime.utcnow().isoformat(),
+                         tags=["bench", "write-paths"])
+
+
+async def upload_sequential(storage, db):
+    metadata = new_metadata()
+    await storage.upload_file(UploadFile(io.BytesIO(BODY)), metadata.filename)
+    await db.save_metadata(metadata)
+    metadata.download_url = await storage.generate_presigned_url(metadata.filename)
+    return metadata
+
+
+async def upload_concurrent(storage, db):
+    metadata = new_metadata()
+    await storage.upload_file(UploadFile(io.BytesIO(BODY)), metadata.filename)
+    return await finalize_upload(metadata, storage, db)
+
+
+async def delete_sequential(storage, db, image_id):
+    image = await db.get_metadata(image_id)
+    await storage.delete_file(image.filename)
+    await db.delete_metadata(image_id)
+
+
+async def delete_concurrent(storage, db, image_id):
+    image = await db.get_metadata(image_id)
+    await remove_image(image, storage, db)
+
+
+async def timed(samples, coro):
+    start = time.perf_counter()
+    result = await coro
+    samples.append((time.perf_counter() - start) * 1000)
+    return result
+
+
+def add_latency(client, rtt: float):
+    async def delay(**kwargs):
+        await asyncio.sleep(rtt)
+    client.meta.events.register("before-send.*.*", delay)
+
+
+async def run(iterations: int, rtt_ms: float):
+    await bootstrap()
+    s3 = await clients.s3()
+    table = await clients.table()
+    if rtt_ms:
+        add_latency(s3, rtt_ms / 1000)
+        add_latency(table.meta.client, rtt_ms / 1000)
+    # No metadata cache, so every get goes to DynamoDB as before
+    storage, db = StorageService(s3), DatabaseService(table)
+    await storage.generate_presigned_url("warm-up.jpg")
+
+    print(f"{'path':<20} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, upload, delete in [("sequential", upload_sequential, delete_sequential),
+                                 ("concurrent", upload_concurrent, delete_concurrent)]:
+        upload_ms, delete_ms = [], []
+        for _ in range(iterations):
+            metadata = await timed(upload_ms, upload(storage, db))
+            await timed(delete_ms, delete(storage, db, metadata.id))
+        for label, samples in [("upload", upload_ms), ("delete", delete_ms)]:
+            print(f"{name + ' ' + label:<20} {percentile(samples, 50):8.2f} {percentile(samples, 99):8.2f}")
+    await clients.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=10.0)
+    args = parser.parse_args()
+    with local_aws() as endpoint:
+        configure(endpoint)
+        asyncio.run(run(args.iterations, args.rtt_ms))
+
+
+if __name__ == "__main__":
+    main()
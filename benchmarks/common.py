@@ -0,0 +1,86 @@
+"""
+Shared helpers for the benchmarks.
+
+AWS is emulated by a moto server (`pip install "moto[server]"`) started in a
+subprocess, so its memory does not show up in the measured process. Set
+BENCH_AWS_ENDPOINT to reuse an already running stand-in such as LocalStack.
+"""
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from app.config import settings
+
+BENCH_BUCKET = "bench-images"
+BENCH_TABLE = "bench-metadata"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def local_aws():
+    """Yields the endpoint URL of a local S3/DynamoDB/SSM stand-in."""
+    endpoint = os.environ.get("BENCH_AWS_ENDPOINT")
+    if endpoint:
+        yield endpoint
+        return
+
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("moto server did not start; is moto[server] installed?")
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def configure(endpoint: str, bucket: str = BENCH_BUCKET, table: str = BENCH_TABLE):
+    """Points the app settings at the stand-in."""
+    settings.AWS_ENDPOINT_URL = endpoint
+    settings.BUCKET_NAME = bucket
+    settings.TABLE_NAME = table
+    settings.ENV = "local"
+
+
+async def bootstrap():
+    """Creates the bench bucket and table through the app's shared clients."""
+    from app.clients import clients
+    from app.schema import ensure_metadata_table
+
+    s3 = await clients.s3()
+    try:
+        await s3.head_bucket(Bucket=settings.BUCKET_NAME)
+    except Exception:
+        await s3.create_bucket(Bucket=settings.BUCKET_NAME)
+    await ensure_metadata_table(await clients.dynamodb(), settings.TABLE_NAME)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -1,4 +1,5 @@
 import boto3
+import json
 import shutil
 import os
 import subprocess
@@ -12,6 +13,15 @@ ROLE_NAME = "lambda-ex-role"
 ZIP_FILE = "function.zip"
 RUNTIME = "python3.11"
 HANDLER = "handler.handler"
+WORKER_FUNCTION_NAME = "testagram-worker"
+WORKER_HANDLER = "worker.handler"
+JOB_QUEUE_NAME = "testagram-jobs"
+JOB_DEAD_LETTER_QUEUE_NAME = "testagram-jobs-dead"
+JOB_MAX_ATTEMPTS = 3
+MAINTENANCE_RULE_NAME = "testagram-maintenance"
+MAINTENANCE_SCHEDULE = "rate(5 minutes)" # Facet rollup and change-log compaction (see worker.maintenance)
+BUCKET_NAME = "testagram-images"
+TABLE_NAME = "testagram-metadata"
 
 def create_zip():
     print("Creating deployment package...")
@@ -23,6 +33,7 @@ def create_zip():
     # 2. Copy App Code
     shutil.copytree("app", "build/app")
     shutil.copy("handler.py", "build/handler.py") # Add handler at root
+    shutil.copy("worker.py", "build/worker.py")
     
     # 3. Install deps to build dir (Target)
     # 3. Install deps to build dir (Target)
@@ -45,8 +56,55 @@ def create_zip():
     shutil.make_archive("function", "zip", "build")
     print(f"Created {ZIP_FILE}")
 
+def provision_resources(session):
+    # The Lambda skips the dev bootstrap to keep cold starts short, so create
+    # the bucket and table (with its indexes and TTL) here instead.
+    from app.schema import metadata_table_definition, TTL_ATTRIBUTE
+
+    s3 = session.client("s3", endpoint_url=AWS_ENDPOINT_URL)
+    try:
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        print(f"Bucket {BUCKET_NAME} created.")
+    except Exception as e:
+        print(f"Bucket creation skipped (might exist): {e}")
+
+    dynamodb = session.client("dynamodb", endpoint_url=AWS_ENDPOINT_URL)
+    try:
+        dynamodb.create_table(**metadata_table_definition(TABLE_NAME))
+        dynamodb.get_waiter("table_exists").wait(TableName=TABLE_NAME)
+        dynamodb.update_time_to_live(
+            TableName=TABLE_NAME,
+            TimeToLiveSpecification={"Enabled": True, "AttributeName": TTL_ATTRIBUTE}
+        )
+        print(f"Table {TABLE_NAME} created.")
+    except Exception as e:
+        print(f"Table creation skipped (might exist): {e}")
+
+    # Post-upload job queue; SQS moves jobs that keep failing to the dead-letter queue
+    sqs = session.client("sqs", endpoint_url=AWS_ENDPOINT_URL)
+    dead_letter_url = sqs.create_queue(QueueName=JOB_DEAD_LETTER_QUEUE_NAME)["QueueUrl"]
+    dead_letter_arn = sqs.get_queue_attributes(QueueUrl=dead_letter_url,
+                                               AttributeNames=["QueueArn"])["Attributes"]["QueueArn"]
+    queue_url = sqs.create_queue(QueueName=JOB_QUEUE_NAME, Attributes={
+        # Longer than the worker's Lambda timeout, as SQS requires for event sources
+        "VisibilityTimeout": "300",
+        "RedrivePolicy": json.dumps({"deadLetterTargetArn": dead_letter_arn,
+                                     "maxReceiveCount": str(JOB_MAX_ATTEMPTS)}),
+    })["QueueUrl"]
+    print(f"Job queue {queue_url} ready.")
+    return queue_url, dead_letter_url
+
 def deploy():
     session = boto3.Session(aws_access_key_id="test", aws_secret_access_key="test", region_name=AWS_REGION)
+    queue_url, dead_letter_url = provision_resources(session)
+    environment = {
+        "BUCKET_NAME": BUCKET_NAME,
+        "TABLE_NAME": TABLE_NAME,
+        "ENV": "dev",
+        "JOB_QUEUE_URL": queue_url,
+        "JOB_DEAD_LETTER_URL": dead_letter_url,
+        "JOB_MAX_ATTEMPTS": str(JOB_MAX_ATTEMPTS),
+    }
     lambda_client = session.client("lambda", endpoint_url=AWS_ENDPOINT_URL)
     iam = session.client("iam", endpoint_url=AWS_ENDPOINT_URL)
     apigateway = session.client("apigatewayv2", endpoint_url=AWS_ENDPOINT_URL)
@@ -66,11 +124,12 @@ def deploy():
         zipped_code = f.read()
 
     # Always delete first to avoid update issues
-    try:
-        lambda_client.delete_function(FunctionName=LAMBDA_FUNCTION_NAME)
-        print(f"Deleted existing function {LAMBDA_FUNCTION_NAME}")
-    except Exception:
-        pass
+    for function_name in (LAMBDA_FUNCTION_NAME, WORKER_FUNCTION_NAME):
+        try:
+            lambda_client.delete_function(FunctionName=function_name)
+            print(f"Deleted existing function {function_name}")
+        except Exception:
+            pass
 
     try:
         lambda_client.create_function(
@@ -79,13 +138,7 @@ def deploy():
             Role=f"arn:aws:iam::000000000000:role/{ROLE_NAME}",
             Handler=HANDLER,
             Code={"ZipFile": zipped_code},
-            Environment={
-                "Variables": {
-                    "BUCKET_NAME": "testagram-images",
-                    "TABLE_NAME": "testagram-metadata",
-                    "ENV": "dev"
-                }
-            },
+            Environment={"Variables": environment},
             Timeout=30,
             MemorySize=128
         )
@@ -94,6 +147,45 @@ def deploy():
         print(f"Error creating lambda: {e}")
         # traceback.print_exc()
 
+    # Worker Lambda consuming the job queue in batches
+    try:
+        lambda_client.create_function(
+            FunctionName=WORKER_FUNCTION_NAME,
+            Runtime=RUNTIME,
+            Role=f"arn:aws:iam::000000000000:role/{ROLE_NAME}",
+            Handler=WORKER_HANDLER,
+            Code={"ZipFile": zipped_code},
+            Environment={"Variables": environment},
+            Timeout=120,
+            MemorySize=512
+        )
+        queue_arn = session.client("sqs", endpoint_url=AWS_ENDPOINT_URL).get_queue_attributes(
+            QueueUrl=queue_url, AttributeNames=["QueueArn"])["Attributes"]["QueueArn"]
+        lambda_client.create_event_source_mapping(
+            EventSourceArn=queue_arn,
+            FunctionName=WORKER_FUNCTION_NAME,
+            BatchSize=10,
+            FunctionResponseTypes=["ReportBatchItemFailures"]
+        )
+        print(f"Lambda {WORKER_FUNCTION_NAME} created and subscribed to {JOB_QUEUE_NAME}.")
+    except Exception as e:
+        print(f"Error creating worker lambda: {e}")
+
+    # Periodic maintenance runs on the worker Lambda
+    try:
+        events = session.client("events", endpoint_url=AWS_ENDPOINT_URL)
+        rule_arn = events.put_rule(Name=MAINTENANCE_RULE_NAME, ScheduleExpression=MAINTENANCE_SCHEDULE,
+                                   State="ENABLED")["RuleArn"]
+        worker_arn = lambda_client.get_function(FunctionName=WORKER_FUNCTION_NAME)["Configuration"]["FunctionArn"]
+        lambda_client.add_permission(FunctionName=WORKER_FUNCTION_NAME, StatementId=MAINTENANCE_RULE_NAME,
+                                     Action="lambda:InvokeFunction", Principal="events.amazonaws.com",
+                                     SourceArn=rule_arn)
+        events.put_targets(Rule=MAINTENANCE_RULE_NAME, Targets=[{
+            "Id": WORKER_FUNCTION_NAME, "Arn": worker_arn, "Input": json.dumps({"maintenance": True})}])
+        print(f"Maintenance scheduled on {WORKER_FUNCTION_NAME} ({MAINTENANCE_SCHEDULE}).")
+    except Exception as e:
+        print(f"Error scheduling maintenance: {e}")
+
     # 3. Create API Gateway (REST API V1) which is more robust on LocalStack
     print("Checking API Gateway (V1)...")
     apigateway = session.client("apigateway", endpoint_url=AWS_ENDPOINT_URL)
@@ -186,14 +278,7 @@ def deploy():
     root_path = f"/restapis/{api_id}/dev/_user_request_"
     lambda_client.update_function_configuration(
         FunctionName=LAMBDA_FUNCTION_NAME,
-        Environment={
-            "Variables": {
-                "BUCKET_NAME": "testagram-images",
-                "TABLE_NAME": "testagram-metadata",
-                "ENV": "dev",
-                "ROOT_PATH": root_path
-            }
-        }
+        Environment={"Variables": {**environment, "ROOT_PATH": root_path}}
     )
         
     print(f"Deployment Complete!")
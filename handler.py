@@ -1,7 +1,20 @@
+# Imported first so the startup report measures everything below
+from app.startup import report
+
 try:
-    from app.main import handler
+    with report.phase("import_app"):
+        from app.main import app
+    with report.phase("import_mangum"):
+        from mangum import Mangum
 except ImportError:
     # Fallback or debugging
     import sys
     print(f"Path: {sys.path}")
     raise
+
+_adapter = Mangum(app)
+
+def handler(event, context):
+    response = _adapter(event, context)
+    report.first_response()
+    return response
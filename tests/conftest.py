@@ -3,6 +3,8 @@ import pytest_asyncio
 from httpx import AsyncClient
 from app.main import app
 from app.config import settings
+from app.clients import clients
+from app.schema import ensure_metadata_table
 import aioboto3
 
 # Verify we are in test environment (e.g. check standard env vars or override keys)
@@ -30,21 +32,13 @@ async def aws_setup():
         except:
             pass # Bucket might exist
 
-    # 2. Create Table
+    # 2. Create Table (with its query indexes)
     async with session.resource("dynamodb",
                                 region_name=settings.AWS_REGION, 
                                 endpoint_url=settings.AWS_ENDPOINT_URL,
                                 aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
                                 aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY) as dynamo:
-        try:
-            await dynamo.create_table(
-                TableName=TEST_TABLE,
-                KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
-                AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
-                ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-            )
-        except:
-            pass # Table might exist
+        await ensure_metadata_table(dynamo, TEST_TABLE)
 
     yield
 
@@ -55,3 +49,5 @@ async def aws_setup():
 async def client(aws_setup):
     async with AsyncClient(app=app, base_url="http://test") as ac:
         yield ac
+    # Each test runs on its own event loop; release the pooled AWS clients
+    await clients.close()
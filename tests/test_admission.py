@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from app.config import settings
+from app.admission import AdmissionController, AdmissionMiddleware, ConcurrencyLimiter, admission, route_pool
+
+def _limiter(limit=2, queue_size=1, adaptive=False):
+    return ConcurrencyLimiter("test", limit, 1, queue_size, latency_target=0.5, adaptive=adaptive)
+
+def test_routes_map_to_pools():
+    assert route_pool("POST", "/images/") == "upload"
+    assert route_pool("POST", "/images/stream") == "upload"
+    assert route_pool("GET", "/images/abc") == "default"
+    assert route_pool("POST", "/images/batch-get") == "default"
+    assert route_pool("GET", "/metrics") is None
+
+@pytest.mark.asyncio
+async def test_queue_hands_slots_over_in_order_and_sheds_when_full():
+    limiter = _limiter(limit=1, queue_size=1)
+    assert await limiter.acquire(1.0)
+
+    waiter = asyncio.create_task(limiter.acquire(1.0))
+    await asyncio.sleep(0)
+    assert limiter.queued == 1
+    assert not await limiter.acquire(1.0)  # queue full: shed at once
+
+    limiter.release()
+    assert await waiter and limiter.in_flight == 1 and limiter.queued == 0
+
+    assert not await limiter.acquire(0.01)  # timed out in the queue
+    assert limiter.queued == 0
+    limiter.release()
+    assert limiter.in_flight == 0
+
+def test_adaptive_limit_backs_off_and_recovers():
+    limiter = _limiter(limit=10, adaptive=True)
+    limiter.observe(2.0, overloaded=False)
+    assert limiter.current_limit == 9
+    limiter.observe(0.1, overloaded=True)  # within DECREASE_INTERVAL: one cut per interval
+    assert limiter.current_limit == 9
+
+    limiter.latency = 0.0
+    limiter.in_flight = 9
+    for _ in range(20):
+        limiter.observe(0.01, overloaded=False)
+    assert limiter.current_limit == 10
+
+@pytest.mark.asyncio
+async def test_middleware_sheds_and_rate_limits(client, monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(settings, "ADMISSION_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "ADMISSION_MIN_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "ADMISSION_QUEUE_SIZE", 0)
+    monkeypatch.setattr(admission, "pools", {})
+
+    pool = admission.pool("default")
+    assert pool.try_acquire()
+    busy = await client.get("/images/missing")
+    assert busy.status_code == 503 and int(busy.headers["retry-after"]) >= 1
+    assert (await client.get("/")).status_code == 200  # never limited
+    pool.release()
+    assert (await client.get("/images/missing")).status_code == 404
+
+    monkeypatch.setattr(settings, "ADMISSION_CLIENT_RATE", 0.01)
+    monkeypatch.setattr(settings, "ADMISSION_CLIENT_BURST", 1)
+    monkeypatch.setattr(settings, "ADMISSION_CLIENT_HEADER", "x-api-key")
+    monkeypatch.setattr(admission, "_clients", None)
+    assert (await client.get("/images/missing", headers={"x-api-key": "a"})).status_code == 404
+    limited = await client.get("/images/missing", headers={"x-api-key": "a"})
+    assert limited.status_code == 429 and int(limited.headers["retry-after"]) > 1
+    assert (await client.get("/images/missing", headers={"x-api-key": "b"})).status_code == 404
+
+@pytest.mark.asyncio
+async def test_slot_is_released_before_background_work(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_ENABLED", True)
+    controller = AdmissionController()
+    background = asyncio.Event()
+    in_flight = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+        # What BackgroundTasks run after the response
+        in_flight.append(controller.pool("default").in_flight)
+        background.set()
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/images/x", "headers": [], "client": ("10.0.0.1", 1)}
+    await AdmissionMiddleware(app, controller)(scope, None, send)
+    assert background.is_set() and in_flight == [0]
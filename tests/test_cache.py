@@ -0,0 +1,110 @@
+import pytest
+from app.cache import LRUCache, MISSING
+from app.config import settings
+
+@pytest.mark.asyncio
+async def test_lru_cache_ttl_eviction_and_negative_entries():
+    cache = LRUCache(max_entries=2)
+    await cache.set("a", {"id": "a"}, ttl=60)
+    await cache.set("b", {"id": "b"}, ttl=0)  # already expired
+    await cache.set_missing("c", ttl=60)      # evicts "a", the least recently used
+
+    assert await cache.get("a") is None
+    assert await cache.get("b") is None
+    assert await cache.get("c") is MISSING
+
+    stats = cache.stats()
+    assert stats["misses"] == 2
+    assert stats["negative_hits"] == 1
+    assert stats["evictions"] == 2  # "a" by size, "b" by TTL
+
+@pytest.mark.asyncio
+async def test_metadata_cache_read_through(client):
+    upload_res = await client.post("/images/", files={'file': ('cached.jpg', b'cached', 'image/jpeg')})
+    image_id = upload_res.json()["id"]
+
+    before = (await client.get("/cache/stats")).json()
+    assert (await client.get(f"/images/{image_id}")).status_code == 200
+    after = (await client.get("/cache/stats")).json()
+    assert after["hits"] == before["hits"] + 1  # populated by the upload
+
+    await client.delete(f"/images/{image_id}")
+    assert (await client.get(f"/images/{image_id}")).status_code == 404
+    assert (await client.get("/cache/stats")).json()["negative_hits"] == after["negative_hits"] + 1
+
+@pytest.mark.asyncio
+async def test_updates_cache_the_stored_item(client):
+    from app.cache import metadata_cache
+    from app.clients import clients
+    from app.services import DatabaseService
+
+    image = (await client.post("/images/", files={'file': ('stale.jpg', b'stale', 'image/jpeg')})).json()
+    db = DatabaseService(await clients.table(), metadata_cache)
+    first, second = await db.get_metadata(image["id"]), await db.get_metadata(image["id"])
+
+    # Each writer holds its own copy; the cache must not end up with only the last one's view
+    assert await db.set_processing(first, "done")
+    assert await db.save_phash(second, "ff00ff00ff00ff00")
+    cached = await db.get_metadata(image["id"])
+    assert cached.processing == "done" and cached.phash == "ff00ff00ff00ff00"
+    await client.delete(f"/images/{image['id']}")
+
+@pytest.mark.asyncio
+async def test_queued_images_are_not_cached(client, monkeypatch):
+    from app.cache import metadata_cache
+    from app.jobs import JobWorker, job_queue
+    monkeypatch.setattr(settings, "JOB_QUEUE_URL", "memory://test-cache-jobs")
+    monkeypatch.setattr(settings, "JOB_PROCESSORS", [])
+
+    image = (await client.post("/images/", files={'file': ('queued.jpg', b'queued', 'image/jpeg')})).json()
+    assert image["processing"] == "queued"
+    assert await metadata_cache.get(image["id"]) is None
+
+    # The worker's update is what the API serves next, not a copy cached while queued
+    assert await JobWorker(job_queue()).run_once() == 1
+    assert (await client.get(f"/images/{image['id']}")).json()["processing"] == "done"
+    await client.delete(f"/images/{image['id']}")
+
+@pytest.mark.asyncio
+async def test_rendition_done_elsewhere_is_not_regenerated(client, monkeypatch):
+    from app.cache import metadata_cache
+    from app.clients import clients
+    from app.models import Rendition
+    from app.renditions import renditions
+    from app.services import DatabaseService
+    monkeypatch.setattr(settings, "RENDITIONS_ON_UPLOAD", False)
+
+    image = (await client.post("/images/", files={'file': ('elsewhere.jpg', b'elsewhere', 'image/jpeg')})).json()
+    db = DatabaseService(await clients.table(), metadata_cache)
+    stale = await db.get_metadata(image["id"])
+    # Another process (the worker) records the rendition; this process's cache still has the old copy
+    thumb = Rendition(filename="elsewhere-thumb.webp", content_type="image/webp", width=1, height=1, size=1)
+    assert await DatabaseService(await clients.table()).save_renditions(stale.model_copy(), {"thumb": thumb})
+
+    async def regenerate(*args):
+        raise AssertionError("rendition regenerated")
+    monkeypatch.setattr(renditions, "_generate", regenerate)
+    stale = await db.get_metadata(image["id"])
+    assert (await renditions.ensure(stale, ["thumb"], None, db)).renditions["thumb"] == thumb
+    await client.delete(f"/images/{image['id']}")
+
+@pytest.mark.asyncio
+async def test_redis_cache_falls_back_when_unreachable(monkeypatch):
+    import sys, types
+    from app.cache import RedisCache
+
+    class Unreachable:
+        async def get(self, *args, **kwargs):
+            raise ConnectionError("connection refused")
+        set = delete = get
+    redis = types.ModuleType("redis")
+    redis.asyncio = types.SimpleNamespace(from_url=lambda url: Unreachable())
+    monkeypatch.setitem(sys.modules, "redis", redis)
+    monkeypatch.setitem(sys.modules, "redis.asyncio", redis.asyncio)
+
+    cache = RedisCache("redis://unreachable")
+    assert await cache.get("a") is None  # a miss, so the caller reads DynamoDB
+    await cache.set("a", {"id": "a"}, ttl=60)
+    await cache.set_missing("b", ttl=60)
+    await cache.delete("a")
+    assert cache.stats()["misses"] == 1 and cache.stats()["errors"] == 4
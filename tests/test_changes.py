@@ -0,0 +1,75 @@
+import pytest
+from app.config import settings
+from app.changes import select_changes, compact
+from app.clients import clients
+
+def _entry(seq, changed_at):
+    return {'seq': seq, 'image_id': f"img{seq}", 'op': 'upsert', 'changed_at': changed_at}
+
+def test_gaps_are_waited_for_until_settled():
+    cutoff = "2026-01-01T00:00:30"
+    fresh = {1: _entry(1, "2026-01-01T00:01:00"), 3: _entry(3, "2026-01-01T00:01:00")}
+    entries, position = select_changes(0, [1, 2, 3], fresh, head_settled=False, cutoff=cutoff)
+    assert [entry['seq'] for entry in entries] == [1] and position == 1
+
+    # A settled entry after the gap means the missing one can no longer be written
+    settled = {1: _entry(1, "2026-01-01T00:00:00"), 3: _entry(3, "2026-01-01T00:00:10")}
+    entries, position = select_changes(0, [1, 2, 3], settled, head_settled=False, cutoff=cutoff)
+    assert [entry['seq'] for entry in entries] == [1, 3] and position == 3
+
+    # Trailing gaps are skipped once the head itself has settled
+    entries, position = select_changes(3, [4, 5], {}, head_settled=True, cutoff=cutoff)
+    assert entries == [] and position == 5
+
+@pytest.mark.asyncio
+async def test_changes_since_cursor(client, monkeypatch):
+    monkeypatch.setattr(settings, "RENDITIONS_ON_UPLOAD", False)
+    start = (await client.get("/images/changes")).json()
+    assert start["items"] == [] and not start["has_more"]
+
+    upload = lambda name: client.post("/images/", files={'file': (name, b'not decodable', 'image/jpeg')})
+    kept = (await upload("kept.jpg")).json()
+    gone = (await upload("gone.jpg")).json()
+    await client.delete(f"/images/{gone['id']}")
+
+    page = (await client.get("/images/changes", params={'since': start["cursor"], 'limit': 1})).json()
+    assert page["has_more"] and len(page["items"]) == 1
+
+    changes = (await client.get("/images/changes", params={'since': start["cursor"]})).json()
+    by_id = {change["id"]: change for change in changes["items"]}
+    assert by_id[kept["id"]]["op"] == "upsert" and by_id[kept["id"]]["image"]["download_url"]
+    assert by_id[gone["id"]]["op"] == "delete" and by_id[gone["id"]]["image"] is None  # latest change only
+    assert not changes["has_more"]
+
+    after = (await client.get("/images/changes", params={'since': changes["cursor"]})).json()
+    assert kept["id"] not in {change["id"] for change in after["items"]}
+
+    # Compaction moves the horizon past everything; the old cursors expire
+    monkeypatch.setattr(settings, "CHANGE_RETENTION", 0)
+    monkeypatch.setattr(settings, "CHANGE_SETTLE", 0)
+    await client.delete(f"/images/{kept['id']}")
+    await compact(await clients.table())
+    expired = await client.get("/images/changes", params={'since': start["cursor"]})
+    assert expired.status_code == 410
+
+    # The scheduled maintenance run compacts too
+    from worker import maintenance
+    assert (await maintenance())["changes_deleted"] >= 3
+
+@pytest.mark.asyncio
+async def test_entries_hold_the_stored_image(client, monkeypatch):
+    from app.services import DatabaseService
+    monkeypatch.setattr(settings, "RENDITIONS_ON_UPLOAD", False)
+    start = (await client.get("/images/changes")).json()
+    image = (await client.post("/images/", files={'file': ('stored.jpg', b'stored', 'image/jpeg')})).json()
+
+    # Another writer's update lands between this writer's write and its log entry
+    table = await clients.table()
+    await table.update_item(Key={'id': image["id"]}, UpdateExpression='SET phash = :phash',
+                            ExpressionAttributeValues={':phash': "0f0f0f0f0f0f0f0f"})
+    await DatabaseService(table)._record_change(image["id"])
+
+    changes = (await client.get("/images/changes", params={'since': start["cursor"]})).json()
+    [change] = [change for change in changes["items"] if change["id"] == image["id"]]
+    assert change["image"]["phash"] == "0f0f0f0f0f0f0f0f"
+    await client.delete(f"/images/{image['id']}")
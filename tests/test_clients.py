@@ -0,0 +1,15 @@
+import pytest
+from app.clients import clients
+
+@pytest.mark.asyncio
+async def test_clients_are_reused(aws_setup):
+    s3 = await clients.s3()
+    table = await clients.table()
+    assert await clients.s3() is s3
+    assert await clients.table() is table
+
+    # Closing drops the clients; the next call opens a fresh pool
+    await clients.close()
+    assert not clients.started
+    assert await clients.s3() is not s3
+    await clients.close()
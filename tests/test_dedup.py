@@ -0,0 +1,42 @@
+import uuid
+import pytest
+from app.config import settings
+from app.clients import clients
+from app.services import blob_item_id
+
+async def _object_exists(key: str) -> bool:
+    s3 = await clients.s3()
+    listing = await s3.list_objects_v2(Bucket=settings.BUCKET_NAME, Prefix=key)
+    return listing.get("KeyCount", 0) > 0
+
+@pytest.mark.asyncio
+async def test_dedup_shares_object_until_last_reference(client, monkeypatch):
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", True)
+    monkeypatch.setattr(settings, "RENDITIONS_ON_UPLOAD", False)
+    body = f"same photo {uuid.uuid4()}".encode()
+
+    first = (await client.post("/images/", files={'file': ('a.jpg', body, 'image/jpeg')})).json()
+    second = (await client.post("/images/", files={'file': ('b.jpg', body, 'image/jpeg')})).json()
+    streamed = (await client.post("/images/stream?filename=c.jpg", content=body,
+                                  headers={"content-type": "image/jpeg"})).json()
+    assert first["id"] != second["id"]
+    assert first["filename"] == second["filename"] == streamed["filename"]
+    assert first["blob_hash"] == first["content_hash"]
+
+    table = await clients.table()
+    blob = (await table.get_item(Key={'id': blob_item_id(first["blob_hash"])}))["Item"]
+    assert blob["ref_count"] == 3
+
+    assert (await client.delete(f"/images/{first['id']}")).status_code == 200
+    assert (await client.post("/images/batch-delete", json={"ids": [second["id"]]})).status_code == 200
+    assert await _object_exists(first["filename"])
+
+    assert (await client.delete(f"/images/{streamed['id']}")).status_code == 200
+    assert not await _object_exists(first["filename"])
+    assert "Item" not in await table.get_item(Key={'id': blob_item_id(first["blob_hash"])})
+
+    # Re-uploading after the last reference is gone stores a fresh object
+    again = (await client.post("/images/", files={'file': ('d.jpg', body, 'image/jpeg')})).json()
+    assert again["filename"] != first["filename"]
+    assert await _object_exists(again["filename"])
+    await client.delete(f"/images/{again['id']}")
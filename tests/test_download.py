@@ -0,0 +1,47 @@
+import pytest
+from app.download import parse_range, resolve_ranges
+
+CONTENT = bytes(range(256)) * 40  # 10240 bytes
+
+def test_range_parsing_and_resolution():
+    assert parse_range("bytes=0-99, 200-, -50") == [(0, 99), (200, None), (None, 50)]
+    assert parse_range("bytes=5-1") is None  # malformed: ignored
+    assert parse_range("items=0-1") is None
+    assert resolve_ranges([(0, 99), (50, 149), (150, 160), (None, 10), (5000, None)], 1000) == [(0, 160), (990, 999)]
+    assert resolve_ranges([(2000, None)], 1000) == []
+
+@pytest.mark.asyncio
+async def test_content_streams_ranges_and_validators(client):
+    upload_res = await client.post("/images/", files={'file': ('proxy.bin', CONTENT, 'image/jpeg')})
+    image_id = upload_res.json()["id"]
+    url = f"/images/{image_id}/content"
+
+    full = await client.get(url)
+    assert full.status_code == 200 and full.content == CONTENT
+    assert full.headers["accept-ranges"] == "bytes"
+    etag, last_modified = full.headers["etag"], full.headers["last-modified"]
+
+    assert (await client.get(url, headers={"If-None-Match": etag})).status_code == 304
+    assert (await client.get(url, headers={"If-Modified-Since": last_modified})).status_code == 304
+
+    part = await client.get(url, headers={"Range": "bytes=100-199"})
+    assert part.status_code == 206 and part.content == CONTENT[100:200]
+    assert part.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+
+    # If-Range with a stale validator: the whole object instead of the range
+    stale = await client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert stale.status_code == 200 and stale.content == CONTENT
+    fresh = await client.get(url, headers={"Range": "bytes=-10", "If-Range": etag})
+    assert fresh.status_code == 206 and fresh.content == CONTENT[-10:]
+
+    multi = await client.get(url, headers={"Range": "bytes=0-9, 5000-5009"})
+    assert multi.status_code == 206
+    assert multi.headers["content-type"].startswith("multipart/byteranges; boundary=")
+    assert int(multi.headers["content-length"]) == len(multi.content)
+    assert CONTENT[0:10] in multi.content and CONTENT[5000:5010] in multi.content
+    assert f"Content-Range: bytes 5000-5009/{len(CONTENT)}".encode() in multi.content
+
+    unsatisfiable = await client.get(url, headers={"Range": "bytes=20000-"})
+    assert unsatisfiable.status_code == 416
+
+    await client.delete(f"/images/{image_id}")
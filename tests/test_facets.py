@@ -0,0 +1,66 @@
+import asyncio
+import uuid
+import pytest
+from httpx import AsyncClient
+from app.config import settings
+from app.clients import clients
+from app.facets import recount, rollup, days_since
+
+def _count(facets: dict, kind: str, value: str) -> int:
+    return next((entry["count"] for entry in facets[kind] if entry["value"] == value), 0)
+
+def test_days_since_rollup():
+    from datetime import date
+    assert days_since("2026-02-27T23:59:00", today=date(2026, 3, 1)) == ["2026-02-27", "2026-02-28", "2026-03-01"]
+    assert days_since(None, today=date(2026, 3, 1)) == ["2026-03-01"]
+
+@pytest.mark.asyncio
+async def test_facet_counts_follow_uploads_and_deletes(client, monkeypatch):
+    monkeypatch.setattr(settings, "FACET_CACHE_TTL", 0)
+    tag = f"facet-{uuid.uuid4().hex[:8]}"
+    content_type = f"image/x-{tag}"
+    ids = []
+    for i in range(3):
+        files = {'file': (f'f{i}.jpg', b'facet', content_type)}
+        ids.append((await client.post("/images/", files=files, data={"tags": [tag, "shared"]})).json()["id"])
+
+    # New tags and content types are listed from the next rollup on; a
+    # request that finds no summary rolls up first
+    from app.services import FACET_SUMMARY_ITEM_ID
+    await (await clients.table()).delete_item(Key={'id': FACET_SUMMARY_ITEM_ID})
+    facets = (await client.get("/images/facets")).json()
+    assert _count(facets, "tags", tag) == 3
+    assert _count(facets, "content_types", content_type) == 3
+    assert facets["days"][0]["count"] >= 3
+
+    # Counts of listed counters are live
+    await client.delete(f"/images/{ids[0]}")
+    await client.post("/images/batch-delete", json={"ids": [ids[1]]})
+    assert _count((await client.get("/images/facets")).json(), "tags", tag) == 1
+
+    # A recount from the table agrees with the maintained counters
+    totals = await recount(await clients.table())
+    assert totals["tags"][tag] == 1
+    assert _count((await client.get("/images/facets")).json(), "tags", tag) == 1
+
+    await client.delete(f"/images/{ids[2]}")
+    await rollup(await clients.table())
+    assert _count((await client.get("/images/facets")).json(), "tags", tag) == 0
+
+@pytest.mark.asyncio
+async def test_concurrent_completions_count_once(client, monkeypatch):
+    monkeypatch.setattr(settings, "FACET_CACHE_TTL", 0)
+    tag = f"complete-{uuid.uuid4().hex[:8]}"
+    ticket = (await client.post("/images/uploads", json={
+        "filename": "twice.png", "content_type": "image/png", "tags": [tag]})).json()
+    async with AsyncClient() as s3:
+        files = {"file": ("twice.png", b"twice", "image/png")}
+        await s3.post(ticket["upload_url"], data=ticket["fields"], files=files)
+
+    completions = await asyncio.gather(*(client.post(f"/images/{ticket['id']}/complete") for _ in range(2)))
+    assert [response.status_code for response in completions] == [200, 200]
+    assert all(response.json()["status"] == "ready" for response in completions)
+
+    await rollup(await clients.table())
+    assert _count((await client.get("/images/facets")).json(), "tags", tag) == 1
+    await client.delete(f"/images/{ticket['id']}")
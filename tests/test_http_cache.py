@@ -0,0 +1,47 @@
+import uuid
+import pytest
+from app.config import settings
+from app.http_cache import etag_matches
+from app.presign import presigner
+
+def test_signing_window_and_etag_comparison(monkeypatch):
+    monkeypatch.setattr(settings, "PRESIGN_WINDOW", 300)
+    assert presigner.window(1000.0) == (900.0, 1200.0)
+    monkeypatch.setattr(settings, "PRESIGN_WINDOW", 0)
+    assert presigner.window(1000.0) == (1000.0, 1000.0 + settings.PRESIGN_EXPIRES_IN - settings.PRESIGN_CACHE_MARGIN)
+
+    assert etag_matches('W/"abc", "def"', '"abc"')
+    assert etag_matches('*', '"abc"')
+    assert not etag_matches('"abcd"', '"abc"')
+
+@pytest.mark.asyncio
+async def test_reads_revalidate_with_etags(client, monkeypatch):
+    # Pin the signing window so the test can't straddle a window boundary
+    window = presigner.window(0.0)
+    monkeypatch.setattr(presigner, "window", lambda wall=None: window)
+    tag = f"etag-{uuid.uuid4().hex[:8]}"
+    upload_res = await client.post("/images/", files={'file': ('etag.jpg', b'etag', 'image/jpeg')}, params={'tags': [tag]})
+    image_id = upload_res.json()["id"]
+
+    first = await client.get(f"/images/{image_id}")
+    second = await client.get(f"/images/{image_id}")
+    assert first.content == second.content  # same presigned URL within the window
+    assert first.headers["etag"] == second.headers["etag"]
+    assert first.headers["cache-control"].startswith("public, max-age=")
+
+    not_modified = await client.get(f"/images/{image_id}", headers={"If-None-Match": first.headers["etag"]})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert not_modified.headers["etag"] == first.headers["etag"]
+
+    page = await client.get("/images/", params={'tag': tag})
+    assert (await client.get("/images/", params={'tag': tag},
+                             headers={"If-None-Match": page.headers["etag"]})).status_code == 304
+
+    # A new image changes the page, so the old ETag no longer matches
+    other_id = (await client.post("/images/", files={'file': ('etag2.jpg', b'etag2', 'image/jpeg')},
+                                  params={'tags': [tag]})).json()["id"]
+    changed = await client.get("/images/", params={'tag': tag}, headers={"If-None-Match": page.headers["etag"]})
+    assert changed.status_code == 200 and len(changed.json()["items"]) == 2
+
+    await client.delete(f"/images/{image_id}")
+    await client.delete(f"/images/{other_id}")
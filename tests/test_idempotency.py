@@ -0,0 +1,61 @@
+import uuid
+import pytest
+from app.config import settings
+from app.clients import clients
+from app.services import DatabaseService
+from app.routers.images import request_fingerprint
+
+@pytest.mark.asyncio
+async def test_retried_upload_is_replayed(client):
+    key = str(uuid.uuid4())
+    tag = f"idem-{key[:8]}"
+    upload = lambda body: client.post("/images/", files={'file': ('retry.jpg', body, 'image/jpeg')},
+                                      params={'tags': [tag]}, headers={"Idempotency-Key": key})
+
+    first = await upload(b'retry')
+    retry = await upload(b'retry')
+    assert first.status_code == retry.status_code == 200
+    assert retry.json()["id"] == first.json()["id"]
+    assert retry.headers["idempotent-replayed"] == "true" and "idempotent-replayed" not in first.headers
+    assert retry.json()["download_url"]
+
+    listed = (await client.get("/images/", params={'tag': tag})).json()
+    assert [item["id"] for item in listed["items"]] == [first.json()["id"]]
+
+    # Same key, different request
+    assert (await upload(b'something else')).status_code == 422
+
+    await client.delete(f"/images/{first.json()['id']}")
+
+@pytest.mark.asyncio
+async def test_in_flight_key_is_locked(client):
+    key = str(uuid.uuid4())
+    db = DatabaseService(await clients.table())
+    fingerprint = request_fingerprint("stream", "locked.jpg", "6", "image/jpeg", [], None)
+    assert await db.claim_idempotency_key(key, fingerprint, "first") is None
+
+    locked = await client.post("/images/stream", params={'filename': 'locked.jpg'}, content=b'locked',
+                               headers={"Idempotency-Key": key, "Content-Type": "image/jpeg"})
+    assert locked.status_code == 409 and locked.headers["retry-after"]
+
+    assert await db.release_idempotency_key(key, "first")
+    assert await db.claim_idempotency_key(key, fingerprint, "second") is None
+    assert await db.release_idempotency_key(key, "second")
+
+@pytest.mark.asyncio
+async def test_taken_over_lock_stays_with_the_new_owner(client, monkeypatch):
+    key = str(uuid.uuid4())
+    db = DatabaseService(await clients.table())
+    assert await db.claim_idempotency_key(key, "fingerprint", "slow") is None
+
+    # The first request stalls past the lock timeout and a retry takes the key over
+    monkeypatch.setattr(settings, "IDEMPOTENCY_LOCK_TIMEOUT", -1)
+    assert await db.renew_idempotency_key(key, "slow")
+    assert await db.claim_idempotency_key(key, "fingerprint", "retry") is None
+
+    # The stalled request can neither overwrite nor drop the retry's lock
+    assert not await db.renew_idempotency_key(key, "slow")
+    assert not await db.complete_idempotency_key(key, "slow", '{"id": "stale"}')
+    assert not await db.release_idempotency_key(key, "slow")
+    assert await db.complete_idempotency_key(key, "retry", '{"id": "fresh"}')
+    assert await db.claim_idempotency_key(key, "fingerprint", "third") == '{"id": "fresh"}'
@@ -1,3 +1,5 @@
+import hashlib
+import uuid
 import pytest
 from httpx import AsyncClient
 
@@ -22,8 +24,8 @@ async def test_list_images(client: AsyncClient):
     response = await client.get("/images/?tag=list_tag")
     assert response.status_code == 200
     data = response.json()
-    assert len(data) >= 1
-    assert "list_tag" in data[0]["tags"]
+    assert len(data["items"]) >= 1
+    assert "list_tag" in data["items"][0]["tags"]
 
 @pytest.mark.asyncio
 async def test_get_image(client: AsyncClient):
@@ -53,3 +55,141 @@ async def test_delete_image(client: AsyncClient):
     # Verify Get fails
     get_res = await client.get(f"/images/{image_id}")
     assert get_res.status_code == 404
+
+@pytest.mark.asyncio
+async def test_list_images_pagination(client: AsyncClient):
+    tag = f"page_{uuid.uuid4().hex[:8]}"
+    for i in range(3):
+        files = {'file': (f'page_{i}.jpg', b'page', 'image/jpeg')}
+        await client.post("/images/", files=files, data={"tags": [tag]})
+
+    first = (await client.get(f"/images/?tag={tag}&limit=2")).json()
+    assert len(first["items"]) == 2
+    assert first["next_cursor"]
+
+    second = (await client.get(f"/images/?tag={tag}&limit=2&cursor={first['next_cursor']}")).json()
+    assert len(second["items"]) == 1
+    assert second["next_cursor"] is None
+    ids = {img["id"] for img in first["items"] + second["items"]}
+    assert len(ids) == 3
+
+    # Newest first, and date filters narrow the range
+    assert first["items"][0]["created_at"] >= first["items"][1]["created_at"]
+    old = (await client.get(f"/images/?tag={tag}&date_to=2000-01-01T00:00:00")).json()
+    assert old["items"] == []
+
+@pytest.mark.asyncio
+async def test_list_images_merges_partitions(client: AsyncClient):
+    from datetime import datetime
+    from app.clients import clients
+    from app.schema import IMAGE_ENTITY
+    from app.services import encode_cursor
+    started = datetime.utcnow().isoformat()
+    ids = []
+    for i in range(5):
+        files = {'file': (f'merge_{i}.jpg', b'merge', 'image/jpeg')}
+        ids.append((await client.post("/images/", files=files)).json()["id"])
+    # An image written before listings were sharded
+    legacy = str(uuid.uuid4())
+    await (await clients.table()).put_item(Item={
+        'id': legacy, 'entity': IMAGE_ENTITY, 'filename': 'legacy.jpg', 'size': 1,
+        'content_type': 'image/jpeg', 'created_at': datetime.utcnow().isoformat(), 'tags': []})
+
+    pages, cursor = [], None
+    while True:
+        params = {'date_from': started, 'limit': 2, **({'cursor': cursor} if cursor else {})}
+        page = (await client.get("/images/", params=params)).json()
+        pages.append(page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert [image["id"] for items in pages for image in items] == [legacy] + list(reversed(ids))
+    assert [len(items) for items in pages] == [2, 2, 2]
+
+    assert (await client.get("/images/", params={'cursor': encode_cursor({'image#99': ''})})).status_code == 400
+    for image_id in ids + [legacy]:
+        await client.delete(f"/images/{image_id}")
+
+@pytest.mark.asyncio
+async def test_list_images_invalid_cursor(client: AsyncClient):
+    response = await client.get("/images/?cursor=not-a-cursor")
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_list_images_projection(client: AsyncClient):
+    tag = f"fields-{uuid.uuid4().hex[:8]}"
+    files = {'file': ('fields.jpg', b'fields content', 'image/jpeg')}
+    image_id = (await client.post("/images/", files=files, data={"tags": [tag]})).json()["id"]
+
+    projected = (await client.get(f"/images/?tag={tag}&fields=id,download_url")).json()
+    assert projected["limit"] == 50 and "next_cursor" in projected
+    assert set(projected["items"][0]) == {"id", "download_url"} and projected["items"][0]["download_url"]
+
+    compact = (await client.get(f"/images/?tag={tag}&compact=true")).json()["items"][0]
+    assert "description" not in compact and compact["tags"] == [tag]
+
+    assert (await client.get("/images/?fields=id,nope")).status_code == 400
+    await client.delete(f"/images/{image_id}")
+
+@pytest.mark.asyncio
+async def test_upload_image_stream(client: AsyncClient):
+    from app.config import settings
+    body = b"x" * (settings.UPLOAD_PART_SIZE + 123)  # forces a two-part multipart upload
+
+    async def chunks():
+        for start in range(0, len(body), 64 * 1024):
+            yield body[start:start + 64 * 1024]
+
+    response = await client.post("/images/stream?filename=big.jpg&tags=stream",
+                                 content=chunks(), headers={"content-type": "image/jpeg"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["size"] == len(body)
+    assert data["content_hash"] == hashlib.sha256(body).hexdigest()
+    assert data["content_type"] == "image/jpeg"
+
+@pytest.mark.asyncio
+async def test_direct_upload(client: AsyncClient):
+    ticket = (await client.post("/images/uploads", json={
+        "filename": "direct.png", "content_type": "image/png", "tags": ["direct"]})).json()
+    assert ticket["image"]["status"] == "pending"
+
+    # Completing before the bytes are in S3 is rejected
+    early = await client.post(f"/images/{ticket['id']}/complete")
+    assert early.status_code == 409
+
+    async with AsyncClient() as s3:
+        files = {"file": ("direct.png", b"direct bytes", "image/png")}
+        upload = await s3.post(ticket["upload_url"], data=ticket["fields"], files=files)
+        assert upload.status_code in (200, 204)
+
+    response = await client.post(f"/images/{ticket['id']}/complete")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "ready"
+    assert data["size"] == len(b"direct bytes")
+    assert data["download_url"]
+
+@pytest.mark.asyncio
+async def test_direct_upload_too_large(client: AsyncClient):
+    response = await client.post("/images/uploads", json={
+        "filename": "huge.png", "content_type": "image/png", "size": 10 ** 12})
+    assert response.status_code == 413
+
+@pytest.mark.asyncio
+async def test_batch_endpoints(client: AsyncClient):
+    files = [('files', (f'batch_{i}.jpg', f'batch {i}'.encode(), 'image/jpeg')) for i in range(3)]
+    upload = await client.post("/images/batch", files=files, data={"tags": ["batch"]})
+    assert upload.status_code == 200
+    uploaded = upload.json()["items"]
+    assert [item["status"] for item in uploaded] == [200, 200, 200]
+    ids = [item["id"] for item in uploaded]
+
+    got = (await client.post("/images/batch-get", json={"ids": ids + ["missing-id"]})).json()["items"]
+    assert [item["status"] for item in got] == [200, 200, 200, 404]
+    assert all(item["image"]["download_url"] for item in got[:3])
+
+    deleted = (await client.post("/images/batch-delete", json={"ids": ids[:2] + ["missing-id"]})).json()["items"]
+    assert [item["status"] for item in deleted] == [200, 200, 404]
+    assert (await client.get(f"/images/{ids[0]}")).status_code == 404
+    assert (await client.get(f"/images/{ids[2]}")).status_code == 200
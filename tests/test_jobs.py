@@ -0,0 +1,68 @@
+import pytest
+from fastapi import HTTPException
+from app.config import settings
+from app.jobs import SQLiteQueue, JobWorker, PROCESSORS, job_queue
+
+@pytest.mark.asyncio
+async def test_sqlite_queue_visibility_retry_and_dead_letter(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 2)
+    queue = SQLiteQueue(str(tmp_path / "jobs.db"))
+    await queue.send({'image_id': 'a'})
+
+    [message] = await queue.receive(10, wait=0)
+    assert message.body == {'image_id': 'a'} and message.receive_count == 1
+    assert await queue.receive(10, wait=0) == []  # hidden while in flight
+
+    await queue.retry(message, delay=0)
+    [message] = await queue.receive(10, wait=0)
+    assert message.receive_count == 2
+
+    # Never acknowledged within its attempts: dead-lettered instead of delivered again
+    await queue.retry(message, delay=0)
+    assert await queue.receive(10, wait=0) == []
+
+@pytest.mark.asyncio
+async def test_upload_is_processed_by_the_worker(client, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_QUEUE_URL", "memory://test-jobs")
+    monkeypatch.setattr(settings, "JOB_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(settings, "JOB_PROCESSORS", ["flaky"])
+    calls = []
+
+    async def flaky(image, storage, db):
+        calls.append(image.id)
+        if len(calls) == 1:
+            raise RuntimeError("transient")
+    monkeypatch.setitem(PROCESSORS, "flaky", flaky)
+
+    upload_res = await client.post("/images/", files={'file': ('job.jpg', b'job', 'image/jpeg')})
+    image_id = upload_res.json()["id"]
+    assert upload_res.json()["processing"] == "queued"
+
+    worker = JobWorker(job_queue())
+    assert await worker.run_once() == 1  # fails, retried
+    assert await worker.run_once() == 1
+    assert calls == [image_id, image_id]
+    assert (await client.get(f"/images/{image_id}")).json()["processing"] == "done"
+    assert len(job_queue()) == 0
+
+    await client.delete(f"/images/{image_id}")
+
+@pytest.mark.asyncio
+async def test_permanent_failure_is_dead_lettered(client, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_QUEUE_URL", "memory://test-jobs-dead")
+
+    async def broken(image, storage, db):
+        raise HTTPException(status_code=422, detail="Cannot render image")
+    monkeypatch.setitem(PROCESSORS, "broken", broken)
+    monkeypatch.setattr(settings, "JOB_PROCESSORS", ["broken"])
+
+    upload_res = await client.post("/images/", files={'file': ('bad.jpg', b'bad', 'image/jpeg')})
+    image_id = upload_res.json()["id"]
+    await JobWorker(job_queue()).run_once()
+
+    image = (await client.get(f"/images/{image_id}")).json()
+    assert image["processing"] == "failed"
+    assert image["processing_error"] == "Cannot render image"
+    assert len(job_queue().dead) == 1
+
+    await client.delete(f"/images/{image_id}")
@@ -0,0 +1,38 @@
+import json
+import pytest
+from app.config import settings
+from app.metrics import Histogram
+
+def test_histogram_exposition_is_cumulative():
+    histogram = Histogram("latency_seconds", "test", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, route="/x")
+    lines = histogram.expose()
+    assert 'latency_seconds_bucket{route="/x",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/x",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/x",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{route="/x"} 3' in lines
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_routes_and_dependencies(client):
+    assert (await client.get("/images/?limit=5")).status_code == 200
+    assert (await client.get("/images/does-not-exist")).status_code == 404
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'testagram_http_requests_total{method="GET",route="/images/",status="200"}' in body
+    assert 'testagram_http_requests_total{method="GET",route="/images/{image_id}",status="404"}' in body
+    assert 'operation="list_images",outcome="ok",service="database"' in body
+    assert f'operation="Query",resource="{settings.TABLE_NAME}",service="dynamodb"' in body
+    assert "testagram_dynamodb_items_scanned_total" in body
+
+@pytest.mark.asyncio
+async def test_emf_line_per_request(client, monkeypatch, capsys):
+    monkeypatch.setattr(settings, "METRICS_EMF", True)
+    await client.get("/images/?limit=1")
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    assert lines[-1]["route"] == "/images/"
+    assert lines[-1]["_aws"]["CloudWatchMetrics"][0]["Namespace"] == settings.METRICS_NAMESPACE
+    assert lines[-1]["DynamoDBLatency"] > 0
@@ -0,0 +1,82 @@
+import datetime as dt
+import time
+from unittest import mock
+from urllib.parse import urlsplit, parse_qs
+
+import boto3
+import pytest
+import botocore.auth
+from botocore.config import Config
+from app.presign import UrlSigner, SigningCredentials, PresignedUrlCache, PresignService
+
+FIXED_NOW = dt.datetime(2026, 10, 16, 12, 30, 5)
+
+class _FrozenDatetime(dt.datetime):
+    @classmethod
+    def utcnow(cls):
+        return FIXED_NOW
+
+def _botocore_url(endpoint, token, bucket, key):
+    with mock.patch.object(botocore.auth.datetime, "datetime", _FrozenDatetime):
+        s3 = boto3.client("s3", region_name="us-east-1", endpoint_url=endpoint,
+                          aws_access_key_id="AKID", aws_secret_access_key="SECRET",
+                          aws_session_token=token, config=Config(signature_version="s3v4"))
+        return s3.generate_presigned_url("get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=3600)
+
+def test_signer_matches_botocore(monkeypatch):
+    # boto3 would otherwise pick the test endpoint up from the environment
+    monkeypatch.delenv("AWS_ENDPOINT_URL", raising=False)
+    key = "dir/a b+ü.jpg"
+    for endpoint, token in [("http://127.0.0.1:4566", None), (None, "session-token")]:
+        expected = urlsplit(_botocore_url(endpoint, token, "my-bucket", key))
+        signer = UrlSigner(SigningCredentials("AKID", "SECRET", token), "us-east-1", endpoint)
+        actual = urlsplit(signer.presign_get("my-bucket", key, 3600, FIXED_NOW.replace(tzinfo=dt.timezone.utc)))
+        assert (actual.netloc, actual.path) == (expected.netloc, expected.path)
+        assert parse_qs(actual.query) == parse_qs(expected.query)
+
+def test_url_cache_honours_safety_margin():
+    cache = PresignedUrlCache(max_entries=2, margin=300)
+    cache.put("b", "k1", "url-1", expires_at=1000)
+    assert cache.get("b", "k1", now=600) == "url-1"
+    assert cache.get("b", "k1", now=700) is None  # inside the margin
+
+    cache.put("b", "k1", "url-1", expires_at=1000)
+    cache.put("b", "k2", "url-2", expires_at=1000)
+    cache.put("b", "k3", "url-3", expires_at=1000)
+    assert len(cache) == 2
+    assert cache.get("b", "k1", now=0) is None  # oldest entry evicted
+
+class _TemporaryCredentials:
+    """Stands in for aiobotocore's refreshable credentials."""
+
+    def __init__(self):
+        self.token = "token-1"
+        self.due = False
+
+    def refresh_needed(self):
+        return self.due
+
+    async def get_frozen_credentials(self):
+        if self.due:
+            self.token, self.due = "token-2", False
+        return SigningCredentials("AKID", "SECRET", self.token)
+
+@pytest.mark.asyncio
+async def test_signer_follows_credential_refresh():
+    service = PresignService()
+    credentials = _TemporaryCredentials()
+    assert (await service.signer(credentials)).credentials.token == "token-1"
+    service.cache.put("b", "k", "url", expires_at=time.time() + 3600)
+
+    # Due for a refresh before PRESIGN_CREDENTIALS_TTL is up: re-signed with the new token
+    credentials.due = True
+    assert (await service.signer(credentials)).credentials.token == "token-2"
+    assert len(service.cache) == 0
+
+@pytest.mark.asyncio
+async def test_session_credentials_sign_urls(client):
+    from app.clients import clients
+    frozen = await (await clients.credentials()).get_frozen_credentials()
+    image = (await client.post("/images/", files={'file': ('signed.jpg', b'signed', 'image/jpeg')})).json()
+    assert f"X-Amz-Credential={frozen.access_key}%2F" in image["download_url"]
+    await client.delete(f"/images/{image['id']}")
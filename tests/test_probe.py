@@ -0,0 +1,43 @@
+import io
+import pytest
+from PIL import Image
+from app.config import settings
+from app.clients import clients
+from app.probe import probe, backfill, NeedMoreBytes
+
+def _jpeg_with_exif(width=1200, height=800) -> bytes:
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees
+    exif.get_ifd(0x8769)[0x9003] = "2023:05:06 07:08:09"
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (10, 120, 200)).save(out, format="JPEG", exif=exif.tobytes())
+    return out.getvalue()
+
+def test_probe_reads_only_the_header():
+    data = _jpeg_with_exif()
+    info = probe(data[:2048])
+    assert (info.width, info.height, info.format) == (1200, 800, "JPEG")
+    assert info.orientation == 6
+    assert info.taken_at == "2023-05-06T07:08:09"
+
+    with pytest.raises(NeedMoreBytes):
+        probe(data[:100])
+    assert probe(b"not an image", complete=True) is None
+
+@pytest.mark.asyncio
+async def test_upload_records_info_and_backfill_fills_missing(client, monkeypatch):
+    monkeypatch.setattr(settings, "RENDITIONS_ON_UPLOAD", False)
+    upload_res = await client.post("/images/", files={'file': ('exif.jpg', _jpeg_with_exif(), 'image/jpeg')})
+    image_id = upload_res.json()["id"]
+    assert upload_res.json()["info"]["width"] == 1200
+    assert (await client.get(f"/images/{image_id}")).json()["info"]["orientation"] == 6
+
+    # Drop the info as if the image predated probing, then backfill it with ranged GETs
+    table = await clients.table()
+    await table.update_item(Key={'id': image_id}, UpdateExpression='REMOVE info')
+    monkeypatch.setattr(settings, "PROBE_HEADER_BYTES", 256)  # forces the range to grow
+    await backfill(concurrency=4)
+    item = (await table.get_item(Key={'id': image_id}))['Item']
+    assert item['info']['height'] == 800 and item['info']['taken_at'] == "2023-05-06T07:08:09"
+
+    await client.delete(f"/images/{image_id}")
@@ -0,0 +1,59 @@
+import io
+import uuid
+import pytest
+from PIL import Image
+from app.config import settings
+from app.clients import clients
+from app.renditions import render
+
+def _png(width=800, height=600) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 40, 90)).save(out, format="PNG")
+    return out.getvalue()
+
+def test_render_keeps_aspect_ratio_and_never_upscales():
+    data, width, height = render(_png(800, 600), 256, "WEBP", 80)
+    assert (width, height) == (256, 192)
+    assert Image.open(io.BytesIO(data)).format == "WEBP"
+
+    _, width, height = render(_png(100, 50), 1024, "JPEG", 85)
+    assert (width, height) == (100, 50)
+
+@pytest.mark.asyncio
+async def test_rendition_generated_lazily_and_deleted_with_image(client, monkeypatch):
+    monkeypatch.setattr(settings, "RENDITIONS_ON_UPLOAD", False)
+    upload_res = await client.post("/images/", files={'file': ('lazy.png', _png(), 'image/png')})
+    image_id = upload_res.json()["id"]
+    assert upload_res.json()["renditions"] == {}
+
+    response = await client.get(f"/images/{image_id}?rendition=thumb")
+    assert response.status_code == 200
+    thumb = response.json()["renditions"]["thumb"]
+    assert thumb["content_type"] == "image/webp"
+    assert max(thumb["width"], thumb["height"]) == 256
+    assert thumb["filename"] in response.json()["download_url"]
+
+    # Recorded on the item, so the next request does not regenerate it
+    again = (await client.get(f"/images/{image_id}")).json()
+    assert again["renditions"]["thumb"] == thumb
+
+    s3 = await clients.s3()
+    await client.delete(f"/images/{image_id}")
+    listing = await s3.list_objects_v2(Bucket=settings.BUCKET_NAME, Prefix=f"renditions/{image_id}/")
+    assert listing.get("KeyCount", 0) == 0
+
+@pytest.mark.asyncio
+async def test_renditions_generated_on_upload_and_listed(client, monkeypatch):
+    monkeypatch.setattr(settings, "RENDITIONS_ON_UPLOAD", True)
+    tag = f"rendition_{uuid.uuid4().hex[:8]}"
+    upload_res = await client.post("/images/", files={'file': ('eager.png', _png(), 'image/png')},
+                                   data={"tags": [tag]})
+    image_id = upload_res.json()["id"]
+
+    image = (await client.get(f"/images/{image_id}")).json()
+    assert set(image["renditions"]) == set(settings.RENDITIONS)
+
+    listed = (await client.get(f"/images/?tag={tag}&rendition=thumb")).json()["items"][0]
+    assert listed["renditions"]["thumb"]["filename"] in listed["download_url"]
+
+    assert (await client.get(f"/images/{image_id}?rendition=huge")).status_code == 400
@@ -0,0 +1,183 @@
+import json
+import time
+from contextlib import asynccontextmanager
+import pytest
+from aiobotocore.awsrequest import AioAWSResponse
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError, EndpointConnectionError
+from app.config import settings
+from app.metrics import aws_errors, aws_latency, aws_retries, instrument_client
+from app.resilience import (Resilience, RateLimiter, DependencyUnavailable, DeadlineExceeded, Deadline,
+                            _deadline)
+
+def _error(code, status=400):
+    return ClientError({'Error': {'Code': code, 'Message': code},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, 'PutItem')
+
+class _Body:
+    raw_headers = ()
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def read(self):
+        return self.data
+
+class Responses:
+    """before-send hook answering each attempt in turn: (status, error code) or an exception; then 200."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self, request, **kwargs):
+        self.calls += 1
+        status, code = self.outcomes.pop(0) if self.outcomes else (200, None)
+        if isinstance(status, Exception):
+            raise status
+        body = json.dumps({'__type': code, 'message': code} if code else {}).encode()
+        return AioAWSResponse(request.url, status, {}, _Body(body))
+
+@asynccontextmanager
+async def _client(layer, responses, service="dynamodb", instrument=False):
+    config = AioConfig(retries={"total_max_attempts": 1})
+    async with get_session().create_client(service, region_name="us-east-1", endpoint_url="http://aws.invalid",
+                                           aws_access_key_id="test", aws_secret_access_key="test",
+                                           config=config) as client:
+        if instrument:
+            instrument_client(client)
+        layer.attach(client)
+        client.meta.events.register("before-send", responses)
+        yield client
+
+@pytest.fixture
+def layer(monkeypatch):
+    monkeypatch.setattr(settings, "AWS_RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(settings, "CIRCUIT_FAILURE_THRESHOLD", 2)
+    return Resilience()
+
+@pytest.mark.asyncio
+async def test_throttling_is_retried_within_the_budget(layer):
+    responses = Responses((400, 'ProvisionedThroughputExceededException'), (500, 'InternalServerError'))
+    async with _client(layer, responses) as client:
+        await client.get_item(TableName='table', Key={'id': {'S': 'a'}})
+    assert responses.calls == 3
+
+    # Client errors are not retried
+    responses = Responses((400, 'ConditionalCheckFailedException'))
+    async with _client(layer, responses) as client:
+        with pytest.raises(ClientError):
+            await client.get_item(TableName='table', Key={'id': {'S': 'a'}})
+    assert responses.calls == 1
+
+    # An empty budget stops retrying
+    layer.budget.tokens = 0
+    responses = Responses((500, 'InternalServerError'))
+    async with _client(layer, responses) as client:
+        with pytest.raises(ClientError):
+            await client.get_item(TableName='table', Key={'id': {'S': 'a'}})
+    assert responses.calls == 1
+
+@pytest.mark.asyncio
+async def test_circuit_opens_and_recovers(layer, monkeypatch):
+    monkeypatch.setattr(settings, "AWS_MAX_ATTEMPTS", 1)
+    down = lambda: (EndpointConnectionError(endpoint_url="http://aws.invalid"), None)
+    async with _client(layer, Responses(down(), down())) as client:
+        for _ in range(2):
+            with pytest.raises(EndpointConnectionError):
+                await client.list_tables()
+
+    responses = Responses()
+    async with _client(layer, responses) as client:
+        with pytest.raises(DependencyUnavailable) as raised:
+            await client.list_tables()
+        assert raised.value.status_code == 503 and responses.calls == 0
+
+        layer.breaker("dynamodb").opened_at -= settings.CIRCUIT_RESET_TIMEOUT
+        await client.list_tables()
+    assert layer.breaker("dynamodb").state == "closed"
+    # Other dependencies have their own breakers
+    assert "sqs" not in layer.breakers
+
+@pytest.mark.asyncio
+async def test_retries_stop_at_the_request_deadline(layer, monkeypatch):
+    monkeypatch.setattr(settings, "AWS_RETRY_BASE_DELAY", 10.0)
+    monkeypatch.setattr(settings, "AWS_RETRY_MAX_DELAY", 10.0)
+    token = _deadline.set(Deadline(time.monotonic() + 0.05))
+    try:
+        responses = Responses(*[(400, 'ThrottlingException')] * 3)
+        async with _client(layer, responses) as client:
+            started = time.monotonic()
+            with pytest.raises(DeadlineExceeded):
+                await client.query(TableName='table', KeyConditionExpression='id = :id',
+                                   ExpressionAttributeValues={':id': {'S': 'a'}})
+            # Backoffs longer than the time left fail fast instead of sleeping
+            assert time.monotonic() - started < 1.0
+    finally:
+        _deadline.reset(token)
+    # Running out of time says nothing about the dependency
+    assert layer.breaker("dynamodb").failures == 0
+
+@pytest.mark.asyncio
+async def test_deadline_does_not_fail_the_trial_call(layer):
+    breaker = layer.breaker("dynamodb")
+    breaker.failures, breaker.opened_at = 2, time.monotonic() - settings.CIRCUIT_RESET_TIMEOUT
+    responses = Responses()
+    async with _client(layer, responses) as client:
+        token = _deadline.set(Deadline(time.monotonic() - 1))
+        try:
+            with pytest.raises(DeadlineExceeded):
+                await client.list_tables()
+        finally:
+            _deadline.reset(token)
+        assert responses.calls == 0 and breaker.failures == 2
+
+        # The trial slot was freed, so the next call gets to probe
+        await client.list_tables()
+    assert breaker.state == "closed"
+
+@pytest.mark.asyncio
+async def test_call_metrics_span_resilience_retries(layer, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_ENABLED", True)
+    labels = (("operation", "DescribeLimits"), ("resource", ""), ("service", "dynamodb"))
+    calls_before = sum(aws_latency.counts.get(labels, [0]))
+    retries_before = aws_retries.values[(("operation", "DescribeLimits"), ("service", "dynamodb"))]
+
+    responses = Responses((500, 'InternalServerError'), (500, 'InternalServerError'))
+    async with _client(layer, responses, instrument=True) as client:
+        await client.describe_limits()
+    # One observation for the call, however many attempts it took
+    assert sum(aws_latency.counts[labels]) == calls_before + 1
+    assert aws_retries.values[(("operation", "DescribeLimits"), ("service", "dynamodb"))] == retries_before + 2
+
+    monkeypatch.setattr(settings, "AWS_MAX_ATTEMPTS", 1)
+    down = (EndpointConnectionError(endpoint_url="http://aws.invalid"), None)
+    async with _client(layer, Responses(down), instrument=True) as client:
+        with pytest.raises(EndpointConnectionError):
+            await client.describe_limits()
+    assert aws_errors.values[(("code", "EndpointConnectionError"), ("operation", "DescribeLimits"),
+                              ("service", "dynamodb"))] >= 1
+
+def test_adaptive_rate_limiter_halves_on_throttle():
+    limiter = RateLimiter(rate=100, burst=0, adaptive=True)
+    assert limiter.reserve() == 0.0
+    assert limiter.reserve() == pytest.approx(0.01, abs=0.002)
+    limiter.on_throttle()
+    assert limiter.rate == 50
+    limiter.on_throttle()  # at most one decrease per second
+    assert limiter.rate == 50
+
+    static = RateLimiter(rate=0, burst=0)
+    static.on_throttle()
+    assert static.reserve() == 0.0
+
+@pytest.mark.asyncio
+async def test_client_error_handler_responses():
+    from starlette.requests import Request
+    from app.main import client_error_handler
+    request = Request({'type': 'http', 'method': 'GET', 'path': '/images/', 'headers': []})
+    busy = await client_error_handler(request, _error('ProvisionedThroughputExceededException'))
+    assert busy.status_code == 503 and busy.headers["Retry-After"] == "1"
+    failed = await client_error_handler(request, _error('AccessDeniedException'))
+    assert failed.status_code == 500 and failed.body == b'{"detail":"Internal Server Error"}'
@@ -0,0 +1,105 @@
+import uuid
+import pytest
+from app.config import settings
+from app.models import ImageMetadata
+from app.search import posting_items, rank, tokenize
+
+def _image(image_id, description=None, tags=(), created_at="2024-01-01T00:00:00"):
+    return ImageMetadata(id=image_id, filename=f"{uuid.uuid4()}.jpg", size=1, content_type="image/jpeg",
+                         created_at=created_at, tags=list(tags), description=description)
+
+def _search(images, query, mode="and", offset=0, limit=50):
+    postings = {}
+    for image in images:
+        for item in posting_items(image):
+            postings.setdefault(item['term_key'], []).append(item)
+    return rank(list(dict.fromkeys(tokenize(query))), postings, mode=mode, offset=offset, limit=limit)
+
+def test_postings_and_or_prefix_and_ranking():
+    images = [_image("a", "Sunset over the harbour", ["beach"], "2024-01-01T00:00:00"),
+              _image("b", "Sunrise at the beach", ["sunset"], "2024-01-02T00:00:00"),
+              _image("c", "City at night", ["city"], "2024-01-03T00:00:00")]
+
+    # Tag matches weigh more than description matches
+    assert _search(images, "sunset") == (["b", "a"], 2)
+    assert _search(images, "sunset beach", mode="and") == (["b", "a"], 2)
+    assert _search(images, "harbour city", mode="and") == ([], 0)
+    assert _search(images, "harbour city", mode="or")[1] == 2
+    # "sun" is a prefix of sunset and sunrise; equal scores go newest first
+    assert _search(images, "sun") == (["b", "a"], 2)
+    assert _search(images, "sun", offset=1, limit=1) == (["a"], 2)
+    # Tokens longer than SEARCH_MAX_PREFIX are filtered from their prefix's postings
+    assert _search(images, "sunrises") == ([], 0)
+    assert _search(images, "harbo") == (["a"], 1)
+
+@pytest.mark.asyncio
+async def test_search_endpoint(client):
+    word = f"zebra{uuid.uuid4().hex[:8]}"
+    ids = []
+    for i in range(3):
+        response = await client.post("/images/", files={'file': (f'search_{i}.jpg', b'data', 'image/jpeg')},
+                                     data={"description": f"A striped {word} number {i}", "tags": ["safari"]})
+        ids.append(response.json()["id"])
+
+    response = await client.get("/images/search", params={"q": f"{word} safari", "limit": 2})
+    assert response.status_code == 200
+    page = response.json()
+    assert page["total"] == 3
+    assert len(page["items"]) == 2 and page["next_cursor"]
+    assert all(item["download_url"] for item in page["items"])
+
+    # Prefix match, second page
+    response = await client.get("/images/search", params={"q": word[:-2], "limit": 2,
+                                                         "cursor": page["next_cursor"]})
+    assert len(response.json()["items"]) == 1 and response.json()["next_cursor"] is None
+
+    await client.delete(f"/images/{ids[0]}")
+    response = await client.get("/images/search", params={"q": word})
+    assert response.json()["total"] == 2
+    assert ids[0] not in {item["id"] for item in response.json()["items"]}
+
+    for image_id in ids[1:]:
+        await client.delete(f"/images/{image_id}")
+
+@pytest.mark.asyncio
+async def test_rebuild_indexes_existing_images(client):
+    from app.clients import clients
+    from app.schema import IMAGE_ENTITY
+    from app.search import rebuild
+
+    word = f"okapi{uuid.uuid4().hex[:8]}"
+    image = _image(str(uuid.uuid4()), f"An {word} in the forest")
+    table = await clients.table()
+    # Stored without postings, as before the index existed
+    await table.put_item(Item={**image.model_dump(), 'entity': IMAGE_ENTITY})
+    assert (await client.get("/images/search", params={"q": word})).json()["total"] == 0
+
+    written, _ = await rebuild(table)
+    assert written > 0
+    response = await client.get("/images/search", params={"q": word})
+    assert [item["id"] for item in response.json()["items"]] == [image.id]
+
+    await client.delete(f"/images/{image.id}")
+    assert (await client.get("/images/search", params={"q": word})).json()["total"] == 0
+
+@pytest.mark.asyncio
+async def test_and_query_finds_older_matches_past_the_page(client, monkeypatch):
+    import app.search
+    monkeypatch.setattr(app.search, "POSTINGS_PAGE", 2)
+    first, second = f"gnu{uuid.uuid4().hex[:6]}", f"yak{uuid.uuid4().hex[:6]}"
+    upload = lambda description: client.post("/images/", files={'file': ('and.jpg', b'and', 'image/jpeg')},
+                                             data={"description": description})
+    # The oldest image has both words; the first word has newer images past the first page
+    both = (await upload(f"{first} {second}")).json()["id"]
+    others = [(await upload(first)).json()["id"] for _ in range(4)]
+
+    page = (await client.get("/images/search", params={"q": f"{first} {second}"})).json()
+    assert [item["id"] for item in page["items"]] == [both] and page["total"] == 1 and not page["truncated"]
+
+    # A key read only up to the cap flags the result
+    monkeypatch.setattr(settings, "SEARCH_MAX_POSTINGS", 2)
+    page = (await client.get("/images/search", params={"q": f"{first} {second}", "mode": "or"})).json()
+    assert page["truncated"] and page["total"] < 5  # a lower bound
+
+    for image_id in [both, *others]:
+        await client.delete(f"/images/{image_id}")
@@ -0,0 +1,87 @@
+import pytest
+from fastapi import HTTPException
+from botocore.exceptions import ClientError
+from app.config import settings
+from app.models import ImageMetadata
+from app.services import StorageService
+from app.routers.images import finalize_upload, remove_image
+
+class FailingPartS3:
+    """Minimal S3 stand-in whose second part upload fails."""
+
+    def __init__(self):
+        self.aborted = []
+
+    async def create_multipart_upload(self, **kwargs):
+        return {'UploadId': 'upload-1'}
+
+    async def upload_part(self, PartNumber, **kwargs):
+        if PartNumber == 2:
+            raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'boom'}}, 'UploadPart')
+        return {'ETag': f'"etag-{PartNumber}"'}
+
+    async def abort_multipart_upload(self, UploadId, **kwargs):
+        self.aborted.append(UploadId)
+
+@pytest.mark.asyncio
+async def test_upload_stream_aborts_on_failure(monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_PART_SIZE", 1024)
+    s3 = FailingPartS3()
+
+    async def chunks():
+        for _ in range(5):
+            yield b"x" * 1024
+
+    with pytest.raises(HTTPException):
+        await StorageService(s3).upload_stream(chunks(), "orphan.jpg", "image/jpeg")
+    assert s3.aborted == ['upload-1']
+
+class FakeStorage:
+    def __init__(self, fail_delete=False):
+        self.fail_delete = fail_delete
+        self.deleted = []
+
+    async def generate_presigned_url(self, filename):
+        return f"https://example/{filename}"
+
+    async def delete_file(self, filename):
+        if self.fail_delete:
+            raise HTTPException(status_code=500, detail="S3 Delete Failed")
+        self.deleted.append(filename)
+
+    async def delete_files(self, filenames):
+        self.deleted.extend(filenames)
+        return {}
+
+class FakeDatabase:
+    def __init__(self, fail_save=False):
+        self.fail_save = fail_save
+        self.rows = {}
+
+    async def save_metadata(self, metadata):
+        if self.fail_save:
+            raise RuntimeError("throttled")
+        self.rows[metadata.id] = metadata
+
+    async def delete_metadata(self, image_id):
+        self.rows.pop(image_id, None)
+
+def _image():
+    return ImageMetadata(id="img-1", filename="img-1.jpg", size=1, content_type="image/jpeg",
+                         created_at="2026-01-01T00:00:00")
+
+@pytest.mark.asyncio
+async def test_finalize_upload_removes_object_when_metadata_fails():
+    storage, db = FakeStorage(), FakeDatabase(fail_save=True)
+    with pytest.raises(HTTPException):
+        await finalize_upload(_image(), storage, db)
+    assert storage.deleted == ["img-1.jpg"]
+
+@pytest.mark.asyncio
+async def test_remove_image_restores_row_when_object_delete_fails():
+    storage, db = FakeStorage(fail_delete=True), FakeDatabase()
+    image = _image()
+    db.rows[image.id] = image
+    with pytest.raises(HTTPException):
+        await remove_image(image, storage, db)
+    assert image.id in db.rows
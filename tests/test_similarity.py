@@ -0,0 +1,61 @@
+import io
+import random
+import pytest
+from PIL import Image, ImageDraw
+from app.config import settings
+from app.similarity import SimilarityIndex, perceptual_hash, hamming
+
+def _picture(seed: int, size=(640, 480), quality=90) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("RGB", (64, 48), (128, 128, 128))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(64), rng.randrange(48)
+        draw.ellipse((x, y, x + rng.randrange(8, 30), y + rng.randrange(8, 30)),
+                     fill=tuple(rng.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    image.resize(size, Image.Resampling.BICUBIC).save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+def test_hash_tolerates_resizing_and_recompression():
+    original = perceptual_hash(_picture(1))
+    assert hamming(original, perceptual_hash(_picture(1, size=(320, 240), quality=40))) <= 6
+    assert hamming(original, perceptual_hash(_picture(2))) > 12
+    assert perceptual_hash(b"not an image") is None
+
+def test_index_matches_brute_force():
+    rng = random.Random(7)
+    hashes = [f"{rng.getrandbits(64):016x}" for _ in range(5000)]
+    index = SimilarityIndex()
+    index.load([f"id{i}" for i in range(len(hashes))], hashes)
+    index._remove("id3")  # the last entry moves into slot 3
+
+    query = hashes[10]
+    within = {f"id{i}": hamming(query, value) for i, value in enumerate(hashes)
+              if i != 3 and hamming(query, value) <= 24}
+    matches = index.query(query, 24, 5)
+    assert [distance for _, distance in matches] == sorted(within.values())[:5]
+    assert all(within[image_id] == distance for image_id, distance in matches)
+    assert index.query(query, 0, 5, exclude="id10") == []
+
+@pytest.mark.asyncio
+async def test_similar_endpoint_and_near_duplicate_rejection(client, monkeypatch):
+    monkeypatch.setattr(settings, "RENDITIONS_ON_UPLOAD", False)
+    upload = lambda name, body: client.post("/images/", files={'file': (name, body, 'image/jpeg')})
+
+    first = (await upload("a.jpg", _picture(11))).json()
+    near = (await upload("a-small.jpg", _picture(11, size=(200, 150), quality=50))).json()
+    other = (await upload("b.jpg", _picture(12))).json()
+    assert first["phash"] and near["phash"]
+
+    similar = (await client.get(f"/images/{first['id']}/similar", params={'max_distance': 8})).json()
+    ids = [item["id"] for item in similar["items"]]
+    assert near["id"] in ids and other["id"] not in ids and first["id"] not in ids
+    assert similar["items"][0]["download_url"]
+
+    monkeypatch.setattr(settings, "NEAR_DUPLICATE_DISTANCE", 8)
+    rejected = await upload("a-again.jpg", _picture(11, quality=70))
+    assert rejected.status_code == 409 and "Near-duplicate" in rejected.json()["detail"]
+
+    for image in (first, near, other):
+        await client.delete(f"/images/{image['id']}")
@@ -0,0 +1,88 @@
+"""
+Job worker for post-upload processing (see app/jobs.py).
+
+As a Lambda behind an SQS event source mapping (handler "worker.handler",
+with ReportBatchItemFailures) it processes each delivered batch; run as
+`python worker.py` it polls JOB_QUEUE_URL (SQS or sqlite:///...) until stopped.
+
+The same Lambda is also invoked on a schedule with {"maintenance": true}
+(an EventBridge rule, see deploy.py) to run the periodic table maintenance.
+"""
+import asyncio
+import json
+from contextlib import nullcontext
+
+from app.config import settings
+from app.jobs import JobWorker, Message, job_queue, DONE, RETRY
+from app.resilience import request_deadline
+from app.services import gather_bounded
+
+# One loop for the life of the container, so the pooled AWS clients survive warm invocations
+_loop = asyncio.new_event_loop()
+
+
+async def _process_records(records: list[dict], context) -> dict:
+    worker = JobWorker(job_queue())
+    messages = [Message(record['messageId'], json.loads(record['body']), record['receiptHandle'],
+                        int(record.get('attributes', {}).get('ApproximateReceiveCount', 1)))
+                for record in records]
+
+    async def handle(message: Message) -> str:
+        try:
+            outcome = await worker.process(message)
+        except Exception as e:
+            print(f"Job {message.id} crashed: {e}")
+            return RETRY
+        if outcome == RETRY:
+            # Back off instead of waiting out the whole visibility timeout
+            try:
+                await worker.queue.retry(message, worker.retry_delay(message))
+            except Exception as e:
+                print(f"Could not delay retry of job {message.id}: {e}")
+        elif outcome != DONE:
+            await worker.queue.dead_letter(message)
+        return outcome
+
+    budget = context.get_remaining_time_in_millis() / 1000 - settings.LAMBDA_DEADLINE_MARGIN if context else None
+    with request_deadline(budget) if budget else nullcontext():
+        outcomes = await gather_bounded((handle(message) for message in messages), settings.JOB_CONCURRENCY)
+    # Only failed records are redelivered (partial batch response)
+    return {"batchItemFailures": [{"itemIdentifier": message.id}
+                                  for message, outcome in zip(messages, outcomes) if outcome == RETRY]}
+
+
+async def maintenance() -> dict:
+    """Periodic upkeep: rolls up the facet counters and compacts the change log."""
+    from app.changes import compact
+    from app.clients import clients
+    from app.facets import rollup
+
+    table = await clients.table()
+    totals = await rollup(table)
+    deleted, replaced = await compact(table)
+    return {"facet_tags": len(totals['tags']), "changes_deleted": deleted, "changes_replaced": replaced}
+
+
+def handler(event, context):
+    if event.get('maintenance'):
+        return _loop.run_until_complete(maintenance())
+    return _loop.run_until_complete(_process_records(event.get('Records', []), context))
+
+
+async def main():
+    queue = job_queue()
+    if queue is None:
+        raise SystemExit("JOB_QUEUE_URL is not set")
+    print(f"Worker consuming {settings.JOB_QUEUE_URL} (concurrency {settings.JOB_CONCURRENCY})")
+    from app.clients import clients
+    try:
+        await JobWorker(queue).run()
+    finally:
+        await clients.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass